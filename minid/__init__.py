@@ -11,9 +11,19 @@ def configure_logging(level=logging.INFO, logpath=None):
         logging.basicConfig(level=level, format=log_format)
 
 
+def __getattr__(name):
+    # The async client imports asyncio, which slows down starting the CLI
+    if name == 'AsyncMinidClient':
+        from minid.async_client import AsyncMinidClient
+        return AsyncMinidClient
+    raise AttributeError('module {!r} has no attribute {!r}'.format(
+        __name__, name))
+
+
 # https://docs.python.org/3/howto/logging.html#configuring-logging-for-a-library  # noqa
 logging.getLogger('minid').addHandler(logging.NullHandler())
 
 __all__ = [
     'MinidClient',
+    'AsyncMinidClient',
 ]
@@ -0,0 +1,445 @@
+"""
+Copyright 2016 University of Chicago, University of Southern California
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import asyncio
+import logging
+import functools
+import itertools
+
+import requests
+from fair_identifiers_client.identifiers_api import IdentifierClientError
+
+from minid.minid import MinidClient
+from minid.cache import CachedResponse
+from minid.exc import (MinidException, LoginRequired, BatchRegisterError,
+                       IdentifierServiceError)
+
+log = logging.getLogger(__name__)
+
+
+class IdentifierResponse(CachedResponse):
+    """A response from the identifiers service. The response body is
+    available as ``data``, and its fields can be read directly."""
+
+    def __init__(self, data, http_status=None):
+        super().__init__(data)
+        self.http_status = http_status
+
+
+class AsyncIdentifierClientError(IdentifierServiceError,
+                                 IdentifierClientError):
+    """
+    Raised by the AsyncMinidClient when the identifiers service responds
+    with an error. It is an IdentifierClientError like the errors raised by
+    the MinidClient for the same requests, so either client's errors can be
+    handled the same way, such as checking for an ``http_status`` of 404.
+    """
+
+    def __init__(self, message, method, response, data=None):
+        # The identifiers client's errors wrap a requests response
+        wrapped = requests.Response()
+        wrapped.status_code = response.status_code
+        wrapped.reason = response.reason_phrase
+        wrapped.headers = requests.structures.CaseInsensitiveDict(
+            response.headers)
+        wrapped.url = str(response.url)
+        wrapped.encoding = response.encoding
+        wrapped._content = response.content
+        wrapped.request = requests.Request(method, wrapped.url).prepare()
+        IdentifierClientError.__init__(self, wrapped)
+        self.args = (message,)
+        self.data = data
+
+
+class AsyncMinidClient(object):
+    """
+    An asyncio version of the MinidClient. Methods mirror those of the
+    MinidClient, but are coroutines which send requests to the identifiers
+    service over a single asynchronous connection pool, so many requests can
+    be in flight from one thread. Files are checksummed in an executor so
+    hashing never blocks the event loop.
+
+    Errors from the identifiers service are raised as an
+    AsyncIdentifierClientError, which is an IdentifierClientError like the
+    errors raised by the MinidClient.
+
+    Logins, tokens and caches are shared with the wrapped MinidClient. The
+    client should be closed with ``aclose()`` when finished, or used as an
+    ``async with`` context manager.
+
+    Requires httpx, which is installed with ``pip install minid[async]``.
+    """
+    # Manifest records read in the executor at a time by batch_register()
+    READ_BATCH_SIZE = 1000
+
+    def __init__(self, client=None, pool_size=100, executor=None,
+                 transport=None, **kwargs):
+        """
+        ** Parameters **
+          ``client`` (*MinidClient*)
+          The client providing logins and configuration. If not given, one is
+          created with any other keyword arguments.
+          ``pool_size`` (*int*)
+          The most connections to the identifiers service open at once.
+          ``executor`` (*concurrent.futures.Executor*)
+          The executor used to checksum files, and for other blocking work
+          such as loading tokens. Defaults to the event loop's default
+          executor.
+          ``transport`` (*httpx.AsyncBaseTransport*)
+          Send requests through a custom httpx transport.
+        """
+        self.client = client or MinidClient(**kwargs)
+        self.pool_size = pool_size
+        self.executor = executor
+        self.transport = transport
+        self._http_client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close every connection to the identifiers service"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+    @property
+    def http_client(self):
+        """The httpx.AsyncClient used to send requests to the identifiers
+        service. It is built on first use."""
+        if self._http_client is None:
+            try:
+                import httpx
+            except ImportError:
+                raise MinidException('The AsyncMinidClient requires httpx. '
+                                     'Install it with "pip install '
+                                     'minid[async]"')
+            limits = httpx.Limits(max_connections=self.pool_size,
+                                  max_keepalive_connections=self.pool_size)
+            self._http_client = httpx.AsyncClient(
+                base_url=self.client.base_url, limits=limits,
+                transport=self.transport,
+                headers={'User-Agent': self.client.app_name})
+        return self._http_client
+
+    def is_logged_in(self):
+        return self.client.is_logged_in()
+
+    async def _check_login(self):
+        # Checking the login may load tokens from disk
+        if not await self._run(self.is_logged_in):
+            raise LoginRequired('The Minid Client did not have a valid '
+                                'authorizer.')
+
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking function in the executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _request(self, method, path, params=None, json=None):
+        """Send a request to the identifiers service and return an
+        IdentifierResponse. Requests wait on the client's rate limiter, and
+        failures are retried as allowed by its retry policy. If the service
+        rejects the authorization, it is refreshed and the request sent once
+        more. The authorizer may read tokens from disk or refresh them over
+        the network, so it is only used in the executor."""
+        http_client = self.http_client
+        import httpx
+        policy = self.client.retry_policy
+        rate_limiter = self.client.rate_limiter
+        authorizer = await self._run(getattr, self.client, 'authorizer')
+        attempt, refreshed = 0, False
+        while True:
+            if rate_limiter is not None:
+                await asyncio.sleep(rate_limiter.reserve())
+            headers = {}
+            if authorizer is not None:
+                headers['Authorization'] = await self._run(
+                    authorizer.get_authorization_header)
+            try:
+                # A leading slash keeps identifiers such as 'hdl:...' from
+                # being parsed as the scheme of an absolute URL
+                response = await http_client.request(
+                    method, '/' + path, params=params, json=json,
+                    headers=headers)
+            except httpx.TransportError as te:
+                sent = not isinstance(te, (httpx.ConnectError,
+                                           httpx.ConnectTimeout))
+                if (attempt >= policy.max_retries or
+                        not policy.is_retryable(method, error=te, sent=sent)):
+                    raise
+                delay = policy.get_delay(attempt)
+            else:
+                status_code = response.status_code
+                if (status_code == 401 and not refreshed and
+                        authorizer is not None and
+                        await self._run(
+                            authorizer.handle_missing_authorization)):
+                    log.debug('Retrying {} {} with a new authorization'
+                              ''.format(method, path))
+                    refreshed = True
+                    continue
+                if (status_code < 400 or attempt >= policy.max_retries or
+                        not policy.is_retryable(method,
+                                                status_code=status_code)):
+                    break
+                delay = policy.get_delay(attempt, policy.parse_retry_after(
+                    response.headers.get('Retry-After')))
+            log.debug('Retrying {} {} in {:.2f}s (attempt {})'.format(
+                method, path, delay, attempt + 1))
+            attempt += 1
+            await asyncio.sleep(delay)
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        if response.status_code >= 400:
+            message = data.get('message') if isinstance(data, dict) else None
+            raise AsyncIdentifierClientError(
+                '{} {} failed ({}): {}'.format(method, path,
+                                               response.status_code,
+                                               message or response.text),
+                method, response, data=data)
+        return IdentifierResponse(data, http_status=response.status_code)
+
+    async def _use_response_cache(self, func, *args):
+        """Call a response cache function, in the executor if the cache also
+        keeps responses in SQLite"""
+        if getattr(self.client.response_cache, 'filename', None) is None:
+            return func(*args)
+        return await self._run(func, *args)
+
+    async def _cached_lookup(self, key, path, params=None):
+        response_cache = self.client.response_cache
+        if response_cache is None:
+            return await self._request('GET', path, params=params)
+        response = await self._use_response_cache(response_cache.get, key)
+        if response is None:
+            response = await self._request('GET', path, params=params)
+            await self._use_response_cache(response_cache.set, key, response)
+        else:
+            log.debug('Using cached response for {}'.format(key))
+        return response
+
+    async def register(self, checksums, title='', locations=None, test=False,
+                       metadata=None, **kwargs):
+        """Register pre-prepared data, where the checksum already exists for
+        a given file. See ``MinidClient.register()``."""
+        await self._check_login()
+        fields = MinidClient._get_register_args(
+            checksums, title=title, locations=locations, test=test,
+            metadata=metadata, **kwargs)
+        namespace = fields.pop('namespace')
+        fields = {name: value for name, value in fields.items()
+                  if value is not None}
+        response = await self._request(
+            'POST', 'namespace/{}/identifier'.format(namespace), json=fields)
+        await self._use_response_cache(
+            self.client._invalidate_cached_responses, fields.get('replaces'))
+        return response
+
+    async def register_file(self, filename, title='', locations=None,
+                            test=False, replaces=None, algorithms=('sha256',)):
+        """Checksum a file in the executor, and register it. See
+        ``MinidClient.register_file()``."""
+        await self._check_login()
+        self.client._check_algorithms(algorithms)
+        # Fetching the user's name for the metadata may go to the network
+        metadata = await self._run(self.client._get_file_metadata, filename,
+                                   title)
+        computed = await self._run(MinidClient.compute_checksums, filename,
+                                   algorithms,
+                                   **self.client._checksum_options())
+        checksums = [{'function': name, 'value': computed[name]}
+                     for name in algorithms]
+        return await self.register(checksums, title=metadata['title'],
+                                   locations=locations or [], test=test,
+                                   metadata=metadata, replaces=replaces)
+
+    async def register_files(self, filenames, test=False, locations=None,
+                             algorithms=('sha256',), jobs=10):
+        """
+        Register many files, with up to ``jobs`` files being checksummed or
+        registered at once. See ``MinidClient.register_files()`` for the
+        parameters.
+        ** Returns **
+          A list of (filename, identifier) tuples, in the order of filenames.
+        ** Raises **
+          BatchRegisterError if any files failed to register. Its ``errors``
+          holds (position, filename, exception) tuples, and ``results`` the
+          list of results with None for each file which failed.
+        """
+        await self._check_login()
+        self.client._check_algorithms(algorithms)
+        filenames = list(filenames)
+        # Fetch the user's name once, before any file needs it
+        await self._run(self.client.get_cached_created_by)
+
+        async def register(filename):
+            return filename, await self.register_file(
+                filename, locations=locations, test=test,
+                algorithms=algorithms)
+
+        results, errors = await self._gather(register, filenames, jobs)
+        if errors:
+            raise BatchRegisterError(
+                '{} of {} files failed to register'.format(len(errors),
+                                                           len(filenames)),
+                errors=errors, results=results)
+        return results
+
+    async def update(self, minid, title=None, existing=None, **kwargs):
+        """Update an existing minid. See ``MinidClient.update()``."""
+        self.client._check_update_args(kwargs)
+        await self._check_login()
+        identifier, fields = MinidClient._get_update_args(minid, title=title,
+                                                          **kwargs)
+        if existing is not None:
+            fields = MinidClient._diff_update_args(fields, existing)
+            if fields is None:
+                return self.client._skip_update(identifier, existing)
+        # Only 'replaces' and 'replaced_by' may be cleared by sending None
+        fields = {name: value for name, value in fields.items()
+                  if value is not None or name in ('replaces', 'replaced_by')}
+        response = await self._request('PUT', identifier, json=fields)
+        await self._use_response_cache(
+            self.client._invalidate_cached_responses, identifier,
+            fields.get('replaces'), fields.get('replaced_by'))
+        return response
+
+    async def check(self, entity, algorithm='sha256'):
+        """Look up a minid, or the minids registered for a file, which is
+        checksummed in the executor. See ``MinidClient.check()``."""
+        if self.client.is_valid_identifier(entity):
+            hdl = self.client.to_identifier(entity, 'hdl')
+            return await self._cached_lookup('identifier:' + hdl, hdl)
+        alg = self.client.get_algorithm(algorithm)
+        checksum = await self._run(MinidClient.compute_checksum, entity, alg,
+                                   **self.client._checksum_options())
+        log.debug('File lookup using ({}) {}'.format(algorithm, checksum))
+        return await self._cached_lookup(
+            'checksum:{}:{}'.format(algorithm, checksum),
+            'checksum/{}'.format(checksum))
+
+    async def register_rfm(self, rfm_record, test, update_if_exists=False):
+        """Register a Minid for a given rfm record. See
+        ``MinidClient.register_rfm()``."""
+        checksums, locations, updatable = self.client._get_rfm_args(
+            rfm_record, test)
+        if update_if_exists and updatable:
+            existing_minid = (await self.check(rfm_record['url'])).data
+            if existing_minid and self.client.validate_checksums(
+                    existing_minid['checksums'], checksums):
+                m_resp = (await self.update(rfm_record['url'],
+                                            title=rfm_record['filename'],
+                                            locations=locations,
+                                            existing=existing_minid)).data
+                log.info('Updating existing minid {} for filename {}'
+                         ''.format(rfm_record['url'], rfm_record['filename']))
+            else:
+                m_resp = await self.register(checksums, test=test,
+                                             locations=locations,
+                                             title=rfm_record['filename'],
+                                             replaces=rfm_record['url'])
+                log.info('re-registered existing minid {} with {} for filename'
+                         ' {}'.format(rfm_record['url'], m_resp['identifier'],
+                                      rfm_record['filename']))
+        else:
+            m_resp = (await self.register(checksums, test=test,
+                                          locations=locations,
+                                          title=rfm_record['filename'])).data
+            log.info('Replaced {} with minid'.format(rfm_record['url']))
+        new_manifest = rfm_record.copy()
+        new_manifest['url'] = m_resp['identifier']
+        return new_manifest
+
+    async def batch_register(self, manifest_filename, test,
+                             update_if_exists=False, max_workers=10):
+        """
+        Register all entries within a remote file manifest, with up to
+        ``max_workers`` records being registered at once. See
+        ``MinidClient.batch_register()`` for the parameters. The manifest is
+        read and parsed in the executor, READ_BATCH_SIZE records at a time,
+        so reading it never blocks the event loop.
+        ** Returns **
+          A list of records with the 'url' field replaced with the
+          identifier, in manifest order.
+        ** Raises **
+          BatchRegisterError if any records failed to register. Failed
+          records are left unchanged in its ``results``.
+        """
+        records = self.client.read_manifest_entries(manifest_filename)
+
+        async def register(record):
+            return await self.register_rfm(record, test,
+                                           update_if_exists=update_if_exists)
+
+        results, errors = [], []
+        try:
+            while True:
+                batch = await self._run(
+                    list, itertools.islice(records, self.READ_BATCH_SIZE))
+                if not batch:
+                    break
+                batch_results, batch_errors = await self._gather(
+                    register, batch, max_workers)
+                errors.extend((len(results) + position, record, error)
+                              for position, record, error in batch_errors)
+                results.extend(batch_results)
+        finally:
+            records.close()
+        if errors:
+            for position, record, error in errors:
+                log.error('Failed to register record {} ({}): {}'.format(
+                    position, record.get('filename'), error))
+                results[position] = record
+            raise BatchRegisterError(
+                '{} of {} records failed to register'.format(len(errors),
+                                                             len(results)),
+                errors=errors, results=results)
+        return results
+
+    @staticmethod
+    async def _gather(coroutine_function, items, concurrency):
+        """
+        Call ``coroutine_function`` on every item, running up to
+        ``concurrency`` at once. Returns a list of results in the order of
+        ``items``, with None for each item which failed, and a list of
+        (position, item, exception) tuples for the failures. LoginRequired is
+        raised immediately, since no item can succeed without a login.
+        """
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+        async def run(item):
+            async with semaphore:
+                return await coroutine_function(item)
+
+        outcomes = await asyncio.gather(*[run(item) for item in items],
+                                        return_exceptions=True)
+        results, errors = [], []
+        for position, (item, outcome) in enumerate(zip(items, outcomes)):
+            if isinstance(outcome, LoginRequired):
+                raise outcome
+            if isinstance(outcome, Exception):
+                errors.append((position, item, outcome))
+                outcome = None
+            elif isinstance(outcome, BaseException):
+                raise outcome
+            results.append(outcome)
+        return results, errors
@@ -0,0 +1,269 @@
+"""
+Copyright 2016 University of Chicago, University of Southern California
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import json
+import time
+import logging
+from collections import OrderedDict
+
+from minid.database import SQLiteDatabase
+
+log = logging.getLogger(__name__)
+
+
+class SQLiteCache(SQLiteDatabase):
+    """
+    Base for caches persisted in an SQLite database, holding at most
+    ``max_entries`` entries.
+    """
+
+    def __init__(self, filename, max_entries=100000, journal_mode='DELETE'):
+        super().__init__(filename, journal_mode=journal_mode)
+        self.max_entries = max_entries
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['max_entries'] = self.max_entries
+        return state
+
+
+class ChecksumCache(SQLiteCache):
+    """
+    A persistent cache of file checksums, stored in SQLite so it can be
+    shared safely by several processes at once. Checksums are keyed by the
+    identity of the file (device, inode, size and modification time) along
+    with the algorithm used, so any change to a file causes a cache miss
+    rather than a stale checksum. The least recently used entries are evicted
+    once the cache grows beyond ``max_entries``.
+
+    To keep cache hits from writing to the database, the times entries were
+    last used are held in memory and written a batch at a time, or when the
+    cache is closed. The entries in the cache are counted when it is first
+    written to, and the least recently used are only evicted once there
+    are 10% more than ``max_entries``, so eviction does not run on every
+    insert.
+    """
+    FILENAME = 'checksum-cache.sqlite'
+    # Cache hits held in memory before their last used times are written
+    LAST_USED_BATCH_SIZE = 100
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS checksums ('
+        'device INTEGER NOT NULL, '
+        'inode INTEGER NOT NULL, '
+        'size INTEGER NOT NULL, '
+        'mtime_ns INTEGER NOT NULL, '
+        'algorithm TEXT NOT NULL, '
+        'checksum TEXT NOT NULL, '
+        'last_used REAL NOT NULL, '
+        'PRIMARY KEY (device, inode, size, mtime_ns, algorithm))',
+        'CREATE INDEX IF NOT EXISTS checksums_last_used '
+        'ON checksums (last_used)',
+    )
+
+    def __init__(self, filename, max_entries=100000, journal_mode='DELETE'):
+        super().__init__(filename, max_entries=max_entries,
+                         journal_mode=journal_mode)
+        self._last_used = {}
+        # Entries in the database, counted on the first insert
+        self._entries = None
+
+    @staticmethod
+    def get_key(file_stat, algorithm):
+        """Returns the cache key for a file given its os.stat() result"""
+        return (file_stat.st_dev, file_stat.st_ino, file_stat.st_size,
+                file_stat.st_mtime_ns, algorithm)
+
+    @classmethod
+    def is_unchanged(cls, file_stat, file_path):
+        """Returns True if the file at ``file_path`` still has the identity
+        described by ``file_stat``"""
+        return (cls.get_key(os.stat(file_path), None) ==
+                cls.get_key(file_stat, None))
+
+    def get(self, file_stat, algorithm):
+        """Returns the cached checksum for the file described by
+        ``file_stat``, or None if it has not been cached."""
+        key = self.get_key(file_stat, algorithm)
+        where = ('device = ? AND inode = ? AND size = ? AND mtime_ns = ? '
+                 'AND algorithm = ?')
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT checksum FROM checksums WHERE {}'.format(where), key
+            ).fetchone()
+            if row is None:
+                return None
+            self._last_used[key] = time.time()
+            if len(self._last_used) >= self.LAST_USED_BATCH_SIZE:
+                self._flush()
+        return row[0]
+
+    def set(self, file_stat, algorithm, checksum):
+        """Cache the checksum for the file described by ``file_stat``, evicting
+        the least recently used entries if the cache is full."""
+        key = self.get_key(file_stat, algorithm)
+        with self._lock:
+            self._last_used.pop(key, None)
+            with self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO checksums (device, inode, size, '
+                    'mtime_ns, algorithm, checksum, last_used) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)', key + (checksum, time.time())
+                )
+            if self._entries is None:
+                self._entries = self.connection.execute(
+                    'SELECT COUNT(*) FROM checksums').fetchone()[0]
+            else:
+                self._entries += 1
+            if self._entries > self.max_entries + self.max_entries // 10:
+                self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries beyond max_entries. Called
+        with the lock held."""
+        self._flush()
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM checksums WHERE rowid IN ('
+                'SELECT rowid FROM checksums ORDER BY last_used DESC '
+                'LIMIT -1 OFFSET ?)', (self.max_entries,)
+            )
+        self._entries = self.max_entries
+
+    def _flush(self):
+        if not self._last_used:
+            return
+        with self.connection:
+            self.connection.executemany(
+                'UPDATE checksums SET last_used = ? WHERE device = ? AND '
+                'inode = ? AND size = ? AND mtime_ns = ? AND algorithm = ?',
+                [(last_used,) + key for key, last_used in self._last_used.items()])
+        self._last_used.clear()
+
+
+class CachedResponse(object):
+    """A response loaded from the on-disk tier of a ResponseCache. Like the
+    responses returned by the identifiers client, the response body is
+    available as ``data``, and its fields can be read directly."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+
+class ResponseCache(SQLiteCache):
+    """
+    A cache of identifiers service responses. Each entry expires ``ttl``
+    seconds after it is cached, and the least recently used entries are
+    evicted from memory once more than ``max_entries`` are held. If a
+    ``filename`` is given, responses are also kept in an SQLite database so
+    they can be shared across processes and CLI invocations, until they
+    expire.
+
+    Any object with the same get(), set(), invalidate() and clear() methods
+    can be given to a MinidClient in place of a ResponseCache.
+    """
+    FILENAME = 'response-cache.sqlite'
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS responses ('
+        'key TEXT PRIMARY KEY, '
+        'data TEXT NOT NULL, '
+        'expires REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)',
+    )
+
+    def __init__(self, filename=None, max_entries=1024, ttl=300,
+                 journal_mode='DELETE'):
+        super().__init__(filename, max_entries=max_entries,
+                         journal_mode=journal_mode)
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['ttl'] = self.ttl
+        return state
+
+    def get(self, key):
+        """Returns the cached response for ``key``, or None if it is not
+        cached or has expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, response = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    return response
+                del self._entries[key]
+            if self.filename is None:
+                return None
+            row = self.connection.execute(
+                'SELECT data, expires FROM responses '
+                'WHERE key = ? AND expires > ?', (key, now)).fetchone()
+            if row is None:
+                return None
+            response = CachedResponse(json.loads(row[0]))
+            self._set_entry(key, response, row[1])
+            return response
+
+    def set(self, key, response, ttl=None):
+        """Cache ``response`` under ``key`` for ``ttl`` seconds, or the
+        cache's default ttl if none is given"""
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._set_entry(key, response, expires)
+            if self.filename is None:
+                return
+            with self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO responses (key, data, expires) '
+                    'VALUES (?, ?, ?)',
+                    (key, json.dumps(response.data), expires))
+                self.connection.execute(
+                    'DELETE FROM responses WHERE expires <= ?', (time.time(),))
+
+    def invalidate(self, key):
+        """Remove the response for ``key``. A key ending in '*' removes every
+        response with a key starting with the rest of it."""
+        with self._lock:
+            if key.endswith('*'):
+                prefix = key[:-1]
+                for cached_key in [k for k in self._entries
+                                   if k.startswith(prefix)]:
+                    del self._entries[cached_key]
+                query = ('DELETE FROM responses WHERE substr(key, 1, ?) = ?',
+                         (len(prefix), prefix))
+            else:
+                self._entries.pop(key, None)
+                query = ('DELETE FROM responses WHERE key = ?', (key,))
+            if self.filename is not None:
+                with self.connection:
+                    self.connection.execute(*query)
+
+    def clear(self):
+        """Remove every cached response"""
+        self.invalidate('*')
+
+    def _set_entry(self, key, response, expires):
+        self._entries[key] = (expires, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
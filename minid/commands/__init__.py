@@ -16,5 +16,5 @@ limitations under the License.
 import minid
 
 
-def get_client():
-    return minid.MinidClient()
+def get_client(**kwargs):
+    return minid.MinidClient(checksum_cache=True, **kwargs)
@@ -14,8 +14,6 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import datetime
-import pytz
-import tzlocal
 
 SERVICE_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
 DATE_FORMAT = '%A, %B %d, %Y %H:%M:%S %Z'
@@ -29,6 +27,9 @@ def get_local_datetime(iso_datestring):
     """Parse an UTC iso datetime string into a python local datetime."""
     if not iso_datestring:
         return ''
+    # pytz and tzlocal are slow to import, and only needed to display dates
+    import pytz
+    import tzlocal
     dt = datetime.datetime.strptime(iso_datestring, SERVICE_DATE_FORMAT)
     user_tz = pytz.timezone(tzlocal.get_localzone().zone)
     dt_local = user_tz.fromutc(dt)
@@ -59,8 +59,11 @@ cli.add_command(auth.login)
 cli.add_command(auth.logout)
 cli.add_command(minid_ops.register)
 cli.add_command(minid_ops.batch_register)
+cli.add_command(minid_ops.merge_results)
+cli.add_command(minid_ops.batch_worker)
 cli.add_command(minid_ops.update)
 cli.add_command(minid_ops.check)
+cli.add_command(minid_ops.translate)
 cli.add_command(minid_ops.version)
 
 
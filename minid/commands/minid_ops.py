@@ -14,9 +14,12 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import logging
+import itertools
 import json
+import csv
 import click
 import sys
+import minid
 from minid import commands
 from minid.commands import formatting
 from minid.version import __VERSION__
@@ -63,6 +66,52 @@ def print_minids(identifier_response, output_json=False):
     click.echo(output)
 
 
+def write_records(records, output, output_format='json'):
+    """
+    Write each record to ``output`` as soon as it is available, so long running
+    commands show progress and never hold every record in memory. 'jsonl'
+    writes one record per line, while 'json' writes the same indented list
+    as json.dumps(records, indent=2). The list is closed even if producing
+    the records raises, so output stays valid JSON up to the failure.
+    """
+    if output_format == 'jsonl':
+        for record in records:
+            output.write(json.dumps(record) + '\n')
+            output.flush()
+        return
+
+    output.write('[')
+    written = False
+    try:
+        for record in records:
+            output.write(',\n  ' if written else '\n  ')
+            output.write(json.dumps(record, indent=2).replace('\n', '\n  '))
+            output.flush()
+            written = True
+    finally:
+        output.write('\n]\n' if written else ']\n')
+        output.flush()
+
+
+def parse_shard(ctx, param, value):
+    """Parse a shard given as INDEX/COUNT, such as 0/32 for the first of 32"""
+    if value is None:
+        return None
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise click.BadParameter('must be INDEX/COUNT, such as 0/32')
+    if not 0 <= index < count:
+        raise click.BadParameter('INDEX must be from 0 to COUNT - 1')
+    return index, count
+
+
+def prefetch_option(func):
+    return click.option('--prefetch', type=click.IntRange(min=0),
+                        help='When updating existing minids, look them up this many records ahead. '
+                             'Defaults to twice --jobs')(func)
+
+
 def json_option(func):
     return click.option('--json/--no-json', '-j', is_flag=True, help='Output as JSON')(func)
 
@@ -72,37 +121,148 @@ def test_option(func):
 
 
 @click.command()
-@click.argument('filename', type=click.Path())
+@click.argument('filenames', nargs=-1, required=True, type=click.Path())
 @click.option('--title', help='Add a title for the Minid.')
 @click.option('--locations', help='Remote locations where files can be retrieved')
 @click.option('--replaces', help='Replace another Minid with this Minid')
+@click.option('--algorithms', help='Comma separated checksum algorithms to register, or "all" for '
+                                   'every supported algorithm. Defaults to sha256')
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='Number of files to checksum and register in parallel')
 @test_option
 @json_option
-def register(filename, title, locations, replaces, test, json):
-    """Register a Minid for a file. """
+def register(filenames, title, locations, replaces, algorithms, jobs, test, json):
+    """Register a Minid for each file.
+
+    Several files may be given at once, and each Minid is printed as soon as
+    its file has been registered.
+    """
     mc = commands.get_client()
     kwargs = parse_none_values([
         ('replaces', replaces, None),
         ('locations', locations.split(',') if locations else None, []),
     ])
-    minid = mc.register_file(filename, title=title, test=test, **kwargs)
-    print_minids(minid.data, output_json=json)
+    if algorithms == 'all':
+        kwargs['algorithms'] = mc.get_supported_algorithms()
+    elif algorithms:
+        kwargs['algorithms'] = algorithms.split(',')
+    if len(filenames) == 1:
+        minid = mc.register_file(filenames[0], title=title, test=test, **kwargs)
+        print_minids(minid.data, output_json=json)
+        return
+
+    if title or replaces:
+        raise click.UsageError('--title and --replaces can only be used when registering a single file')
+    for _, minid in mc.register_files(filenames, test=test, jobs=jobs, **kwargs):
+        print_minids(minid.data, output_json=json)
 
 
 @click.command(help='Register a batch of Minids from an RFM or file stream')
-@click.argument('filename', type=click.Path())
+@click.argument('filename', type=click.Path(allow_dash=True))
 @test_option
 @click.option('--update-if-exists/--no-update-if-exists',
               default=False, help='Update existing minids in RFM url field')
-def batch_register(filename, test, update_if_exists):
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='Number of records to register in parallel')
+@click.option('--output', '-o', default='-', type=click.File('w'),
+              help='File to write registered records to. Defaults to stdout')
+@click.option('--format', 'output_format', default='json',
+              type=click.Choice(['json', 'jsonl']),
+              help='Write records as a JSON list, or one JSON record per line')
+@click.option('--journal', is_flag=True,
+              help='Journal each registered record, so an interrupted run can be continued with --resume')
+@click.option('--resume', is_flag=True,
+              help='Skip records already registered by an interrupted --journal run on this manifest')
+@click.option('--rate-limit', type=click.FloatRange(min=0, min_open=True),
+              help='Most requests per second to send to the identifiers service')
+@click.option('--shard', callback=parse_shard, metavar='INDEX/COUNT',
+              help='Only register records assigned to shard INDEX of COUNT, such as 0/32')
+@click.option('--queue', type=click.Path(dir_okay=False),
+              help='Load records into this work queue on a shared filesystem, so batch-worker '
+                   'processes on other nodes can help register them')
+@prefetch_option
+@click.option('--dedup', is_flag=True,
+              help='Register records with the same checksums once, with the urls of all of them as locations')
+def batch_register(filename, test, update_if_exists, jobs, output, output_format, journal, resume, rate_limit,
+                   shard, queue, prefetch, dedup):
     """Register a batch of Minids from an RFM or file stream
 
     Batch Register can either be passed a file to a Remote File Manifest JSON
     file, or streamed where each entry in the stream is an RFM formatted dict.
+    Manifests compressed with gzip, bzip2, xz or zstd are read directly, and
+    a FILENAME of "-" reads the manifest from stdin.
+    Registered records are written as soon as each one completes, and a
+    summary of the batch is printed to stderr once it finishes. With
+    --journal, they are also journaled so an interrupted run can be
+    continued with --resume, which journals the records it registers too.
+    Each journaled run of a manifest replaces the journal of the last one.
+
+    A large manifest can be split across nodes with --shard, running
+    0/COUNT through COUNT-1/COUNT, and the outputs combined with
+    merge-results. Alternatively, --queue lets any number of batch-worker
+    processes pull records from a shared queue, and the results of every
+    worker are written once all records are done.
+
+    With --dedup, records listing the same content under several filenames
+    or urls are registered once, and each of them gets the same Minid.
     """
-    batch_register = commands.get_client().batch_register(filename, test,
-                                                          update_if_exists=update_if_exists)
-    click.echo(json.dumps(batch_register, indent=2))
+    if queue and (shard or resume or dedup):
+        raise click.UsageError('--queue cannot be used with --shard, --resume or --dedup')
+    if dedup and filename == '-':
+        raise click.UsageError('--dedup reads the manifest twice, so it cannot be read from stdin')
+    mc = commands.get_client(rate_limit=rate_limit, pool_size=max(jobs, 10))
+    stats = {}
+    records = mc.iter_batch_register(filename, test, update_if_exists=update_if_exists,
+                                     max_workers=jobs, journal=journal, resume=resume, shard=shard,
+                                     queue=queue, prefetch=prefetch, dedup=dedup, stats=stats)
+    try:
+        write_records(records, output, output_format)
+    finally:
+        # Records are written to stdout by default, so the summary goes to stderr
+        if stats:
+            click.echo('Registered {registered} records, {failed} failed, {unchanged} already up to date'
+                       ''.format(**stats), err=True)
+
+
+@click.command('batch-worker')
+@click.argument('queue', type=click.Path(exists=True, dir_okay=False))
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='Number of records to register in parallel')
+@click.option('--lease-seconds', default=600, type=click.IntRange(min=1),
+              help='Seconds a record may be held by a stopped worker before it is given to another worker')
+@click.option('--rate-limit', type=click.FloatRange(min=0, min_open=True),
+              help='Most requests per second to send to the identifiers service')
+@prefetch_option
+def batch_worker(queue, jobs, lease_seconds, rate_limit, prefetch):
+    """Register records from a batch-register --queue
+
+    Pulls records from QUEUE until every record is done, so any number of
+    workers may be started on any node which can reach QUEUE. Records held
+    by a worker which stops are given to another worker once their lease
+    expires. Running workers renew their leases until they finish.
+    """
+    mc = commands.get_client(rate_limit=rate_limit, pool_size=max(jobs, 10))
+    stats = mc.work_queue(queue, max_workers=jobs, lease_seconds=lease_seconds, prefetch=prefetch)
+    click.echo('Registered {registered} records, {failed} failed, {unchanged} already up to date'.format(**stats))
+
+
+@click.command('merge-results')
+@click.argument('manifest', type=click.Path(allow_dash=True))
+@click.argument('results', nargs=-1, required=True, type=click.Path())
+@click.option('--output', '-o', default='-', type=click.File('w'),
+              help='File to write merged records to. Defaults to stdout')
+@click.option('--format', 'output_format', default='json',
+              type=click.Choice(['json', 'jsonl']),
+              help='Write records as a JSON list, or one JSON record per line')
+def merge_results(manifest, results, output, output_format):
+    """Merge the outputs of a sharded batch-register
+
+    RESULTS are the outputs of batch-register --shard for every shard of
+    MANIFEST, given in shard order. Records are written in the order of the
+    original MANIFEST.
+    """
+    records = minid.MinidClient.merge_shard_results(manifest, results)
+    write_records(records, output, output_format)
 
 
 @click.command(help='Update an existing Minid')
@@ -129,15 +289,106 @@ def update(minid, title, locations, replaces, replaced_by, set_active, set_inact
     print_minids(minid.data, output_json=json)
 
 
+def read_check_entities(entity_file):
+    """
+    Read entities to check from a file, one per line. A line may also hold a
+    filename followed by whitespace and an identifier, to verify the file
+    matches that identifier. Blank lines and lines starting with '#' are
+    skipped.
+    """
+    mc = commands.get_client()
+    for line in entity_file:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = line.rsplit(None, 1)
+        if len(parts) == 2 and mc.is_valid_identifier(parts[1]):
+            yield tuple(parts)
+        else:
+            yield line
+
+
 @click.command()
-@click.argument('entity')
+@click.argument('entity', required=False)
 @click.option('--function', default='sha256', help='function used to generate the checksum, if provided')
+@click.option('--from-file', type=click.File('r'),
+              help='Check every minid or file listed in this file, one per line, '
+                   'writing a JSON result for each line. Use "-" for stdin')
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='Number of entries to check in parallel with --from-file')
 @json_option
-def check(entity, function, json):
-    """Lookup a minid or check if a given file has been registered"""
+def check(entity, function, from_file, jobs, json):
+    """Lookup a minid or check if a given file has been registered
+
+    With --from-file, each line may also be a file followed by the minid it
+    should match. Results are written as JSON lines as each check finishes,
+    with a status of found, missing, mismatched or error.
+    """
+    if from_file is not None:
+        results = commands.get_client().check_many(read_check_entities(from_file), algorithm=function,
+                                                   jobs=jobs)
+        write_records(results, sys.stdout, 'jsonl')
+        return
+    if entity is None:
+        raise click.UsageError('Either ENTITY or --from-file is required')
     print_minids(commands.get_client().check(entity, function).data, output_json=json)
 
 
+def translate_rows(rows, fields, identifier_type, chunk_size=10000):
+    """
+    Translate the identifiers in the given ``fields`` of each row, which may
+    hold a single identifier or a list of them. Rows are translated a chunk
+    at a time so each chunk is a single call to translate_many, and values
+    which are not known identifiers are left unchanged.
+    """
+    translate_many = minid.MinidClient.translate_many
+    rows = iter(rows)
+    for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+        slots, values = [], []
+        for row in chunk:
+            for field in fields:
+                value = row.get(field)
+                if isinstance(value, str):
+                    slots.append((row, field))
+                    values.append(value)
+                elif isinstance(value, list):
+                    row[field] = translate_many(value, identifier_type, strict=False)
+        translated = translate_many(values, identifier_type, strict=False)
+        for (row, field), value in zip(slots, translated):
+            row[field] = value
+        yield from chunk
+
+
+@click.command()
+@click.argument('input_file', default='-', type=click.File('r'))
+@click.option('--output', '-o', default='-', type=click.File('w'),
+              help='File to write translated records to. Defaults to stdout')
+@click.option('--to', 'identifier_type', default='hdl',
+              type=click.Choice(sorted(minid.MinidClient.PREFIXES)),
+              help='Identifier type to translate to')
+@click.option('--format', 'input_format', default='jsonl',
+              type=click.Choice(['jsonl', 'csv']),
+              help='Read and write one JSON record per line, or CSV with a header row')
+@click.option('--field', 'fields', multiple=True, default=['url'],
+              help='Field holding identifiers to translate. May be given more than once. Defaults to url')
+def translate(input_file, output, identifier_type, input_format, fields):
+    """Translate identifiers in a JSONL or CSV stream to another type
+
+    Reads INPUT_FILE, or stdin if not given, and rewrites the prefix of each
+    identifier in the chosen fields, such as minid.test:foo to
+    hdl:20.500.12633/foo. Other values and fields are written unchanged.
+    """
+    if input_format == 'csv':
+        reader = csv.DictReader(input_file)
+        writer = csv.DictWriter(output, fieldnames=reader.fieldnames or [])
+        if reader.fieldnames:
+            writer.writeheader()
+        writer.writerows(translate_rows(reader, fields, identifier_type))
+        return
+    records = (json.loads(line) for line in input_file if line.strip())
+    output.writelines(json.dumps(record) + '\n' for record in translate_rows(records, fields, identifier_type))
+
+
 @click.command()
 def version():
     """Print version and exit"""
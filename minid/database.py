@@ -0,0 +1,92 @@
+"""
+Copyright 2016 University of Chicago, University of Southern California
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import atexit
+import logging
+import sqlite3
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class SQLiteDatabase(object):
+    """
+    Base for state persisted in an SQLite database, which can be shared
+    safely by several threads and processes at once. The database, and the
+    directory holding it, are only created when it is first used. Subclasses
+    list the statements creating their tables in SCHEMA, and hold ``_lock``
+    while using the connection. Databases still open when the interpreter
+    exits are closed, so changes held in memory are written.
+
+    The database uses SQLite's rollback journal by default, since the minid
+    config directory may be in a home directory shared by several machines
+    over a network filesystem, where WAL does not work. A ``journal_mode`` of
+    'WAL' may be given for databases which are only used on one machine.
+    """
+    SCHEMA = ()
+    # Seconds to wait for another process to finish writing
+    TIMEOUT = 60
+
+    def __init__(self, filename, journal_mode='DELETE'):
+        self.filename = filename
+        self.journal_mode = journal_mode
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Connections cannot be shared between processes, each process
+        # opens its own on first use.
+        return {'filename': self.filename, 'journal_mode': self.journal_mode}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def connect(self):
+        """Returns a new connection to the database"""
+        return sqlite3.connect(self.filename, timeout=self.TIMEOUT,
+                               check_same_thread=False)
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            database_dir = os.path.dirname(self.filename)
+            if database_dir and not os.path.exists(database_dir):
+                os.mkdir(database_dir)
+            self._connection = self.connect()
+            self._connection.execute(
+                'PRAGMA journal_mode={}'.format(self.journal_mode))
+            for statement in self.SCHEMA:
+                self._connection.execute(statement)
+            self._connection.commit()
+            atexit.register(self._close_at_exit)
+        return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                atexit.unregister(self._close_at_exit)
+                self._flush()
+                self._connection.close()
+                self._connection = None
+
+    def _close_at_exit(self):
+        try:
+            self.close()
+        except sqlite3.Error as e:
+            log.warning('Failed to close {}: {}'.format(self.filename, e))
+
+    def _flush(self):
+        """Write any changes held in memory. Called with the lock held."""
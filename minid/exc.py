@@ -13,3 +13,26 @@ class LoginRequired(MinidException):
 class UnknownIdentifier(MinidException):
     """The given identifier is not a known type in the Minid ecosystem."""
     pass
+
+
+class BatchRegisterError(MinidException):
+    """One or more records failed during a batch registration. ``errors``
+    holds a (position, record, exception) tuple for each failed record, and
+    ``results`` holds every record in manifest order, with failed records left
+    unchanged."""
+
+    def __init__(self, message, errors=None, results=None):
+        super().__init__(message)
+        self.errors = errors or []
+        self.results = results
+
+
+class IdentifierServiceError(MinidException):
+    """The identifiers service responded to a request with an error.
+    ``http_status`` holds the status code of the response, and ``data`` its
+    body, if there was one."""
+
+    def __init__(self, message, http_status=None, data=None):
+        super().__init__(message)
+        self.http_status = http_status
+        self.data = data
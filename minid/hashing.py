@@ -0,0 +1,206 @@
+"""
+Copyright 2016 University of Chicago, University of Southern California
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import mmap
+import time
+import queue
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# Reads smaller than this leave parallel filesystems such as Lustre or GPFS
+# well short of their bandwidth, while larger ones barely help local disks.
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+MAX_BLOCK_SIZE = 16 * 1024 * 1024
+# Candidate block sizes tried by calibrate_block_size()
+CALIBRATION_BLOCK_SIZES = (256 * 1024, 1024 * 1024, 4 * 1024 * 1024,
+                           16 * 1024 * 1024)
+CALIBRATION_SAMPLE_SIZE = 32 * 1024 * 1024
+
+# Calibrated block sizes by device, so each filesystem is only measured once
+_calibrated_block_sizes = {}
+
+
+def get_block_size(file_stat):
+    """
+    Returns the block size to use when reading a file, based on the preferred
+    I/O size its filesystem reports. Parallel filesystems report their stripe
+    size, which is typically several MiB. The result is a multiple of the
+    preferred size, and at least DEFAULT_BLOCK_SIZE.
+    """
+    preferred = getattr(file_stat, 'st_blksize', 0) or DEFAULT_BLOCK_SIZE
+    block_size = max(preferred, DEFAULT_BLOCK_SIZE)
+    block_size -= block_size % preferred
+    return min(block_size, max(MAX_BLOCK_SIZE, preferred))
+
+
+def calibrate_block_size(file_path, candidates=CALIBRATION_BLOCK_SIZES,
+                         sample_size=CALIBRATION_SAMPLE_SIZE):
+    """
+    Measure read throughput of the file at ``file_path`` with each of the
+    ``candidates`` block sizes, and return the fastest. Each candidate reads
+    its own ``sample_size`` region of the file so earlier candidates do not
+    warm the page cache for later ones. Files too small to sample fall back to
+    get_block_size(). The result is remembered for the file's device.
+    """
+    file_stat = os.stat(file_path)
+    if file_stat.st_dev in _calibrated_block_sizes:
+        return _calibrated_block_sizes[file_stat.st_dev]
+    if file_stat.st_size < sample_size * len(candidates):
+        return get_block_size(file_stat)
+
+    throughput = {}
+    buf = bytearray(max(candidates))
+    with open(file_path, 'rb', buffering=0) as open_file:
+        for index, block_size in enumerate(candidates):
+            view = memoryview(buf)[:block_size]
+            open_file.seek(index * sample_size)
+            remaining = sample_size
+            start = time.perf_counter()
+            while remaining > 0:
+                read = open_file.readinto(view)
+                if not read:
+                    break
+                remaining -= read
+            elapsed = max(time.perf_counter() - start, 1e-9)
+            throughput[block_size] = (sample_size - remaining) / elapsed
+            view.release()
+    block_size = max(throughput, key=throughput.get)
+    log.debug('Calibrated block size for device {}: {} bytes'.format(
+        file_stat.st_dev, block_size))
+    _calibrated_block_sizes[file_stat.st_dev] = block_size
+    return block_size
+
+
+def hash_file(file_path, hashers, block_size=None, use_mmap=False,
+              pipeline_depth=0):
+    """
+    Feed the contents of ``file_path`` to every hashlib object in ``hashers``
+    from a single pass over the file. Data is read with readinto() into one
+    reused buffer, so no new bytes object is allocated per block.
+    ** Parameters **
+      ``hashers`` (*list*)
+      hashlib objects to update with the file contents
+      ``block_size`` (*int* or *string*)
+      Number of bytes to read at a time. None picks a size based on the
+      filesystem, 'auto' measures the fastest size with
+      calibrate_block_size().
+      ``use_mmap`` (*bool*)
+      Map files larger than a single block into memory and hash them in
+      place instead of reading them into a buffer.
+      ``pipeline_depth`` (*int*)
+      Overlap reading and hashing for files larger than a single block. Up to
+      this many blocks are read ahead while each hasher consumes them on its
+      own thread, so the disk and every hasher stay busy at once. 2 gives
+      double buffering, 0 disables the pipeline. Takes precedence over
+      ``use_mmap``.
+    """
+    if block_size == 'auto':
+        block_size = calibrate_block_size(file_path)
+    with open(file_path, 'rb', buffering=0) as open_file:
+        file_stat = os.fstat(open_file.fileno())
+        block_size = block_size or get_block_size(file_stat)
+        if pipeline_depth and file_stat.st_size > block_size:
+            _hash_pipelined(open_file, hashers, block_size, pipeline_depth)
+        elif use_mmap and file_stat.st_size > block_size:
+            _hash_mmap(open_file, file_stat.st_size, hashers, block_size)
+        else:
+            _hash_readinto(open_file, hashers, block_size)
+
+
+def _hash_readinto(open_file, hashers, block_size):
+    buf = bytearray(block_size)
+    with memoryview(buf) as view:
+        while True:
+            read = open_file.readinto(buf)
+            if not read:
+                break
+            with view[:read] as block:
+                for hasher in hashers:
+                    hasher.update(block)
+
+
+def _hash_mmap(open_file, size, hashers, block_size):
+    with mmap.mmap(open_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        with memoryview(mapped) as view:
+            for offset in range(0, size, block_size):
+                with view[offset:offset + block_size] as block:
+                    for hasher in hashers:
+                        hasher.update(block)
+
+
+def _hash_pipelined(open_file, hashers, block_size, depth):
+    """
+    Read blocks into a ring of ``depth`` buffers on the calling thread, while a
+    thread per hasher consumes them. hashlib releases the GIL while hashing
+    large blocks, so reads and every hasher run concurrently. A buffer is
+    reused only once every hasher has finished with it.
+    """
+    buffers = [bytearray(block_size) for _ in range(depth)]
+    views = [memoryview(buf) for buf in buffers]
+    free = queue.Queue()
+    for index in range(depth):
+        free.put(index)
+    users = [0] * depth
+    users_lock = threading.Lock()
+    blocks = [queue.Queue() for _ in hashers]
+    errors = []
+
+    def consume(hasher, hasher_blocks):
+        while True:
+            item = hasher_blocks.get()
+            if item is None:
+                return
+            index, length = item
+            # Keep releasing buffers after an error, so the reader never stalls
+            if not errors:
+                try:
+                    with views[index][:length] as block:
+                        hasher.update(block)
+                except Exception as e:
+                    errors.append(e)
+            with users_lock:
+                users[index] -= 1
+                if users[index] == 0:
+                    free.put(index)
+
+    threads = [threading.Thread(target=consume, args=(hasher, hasher_blocks),
+                                daemon=True)
+               for hasher, hasher_blocks in zip(hashers, blocks)]
+    for thread in threads:
+        thread.start()
+    try:
+        while not errors:
+            index = free.get()
+            length = open_file.readinto(buffers[index])
+            if not length:
+                break
+            with users_lock:
+                users[index] = len(hashers)
+            for hasher_blocks in blocks:
+                hasher_blocks.put((index, length))
+    finally:
+        for hasher_blocks in blocks:
+            hasher_blocks.put(None)
+        for thread in threads:
+            thread.join()
+        for view in views:
+            view.release()
+    if errors:
+        raise errors[0]
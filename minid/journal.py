@@ -0,0 +1,91 @@
+"""
+Copyright 2016 University of Chicago, University of Southern California
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import json
+import hashlib
+import logging
+
+from minid.database import SQLiteDatabase
+
+log = logging.getLogger(__name__)
+
+
+class BatchJournal(SQLiteDatabase):
+    """
+    An SQLite journal of records completed during a batch registration. Each
+    result is keyed by the manifest it came from, its position within the
+    manifest, and a fingerprint of the record's contents, so a resumed batch
+    only replays results for records that have not changed since they were
+    registered.
+    """
+    FILENAME = 'batch-journal.sqlite'
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS batch_journal ('
+        'manifest TEXT NOT NULL, '
+        'position INTEGER NOT NULL, '
+        'fingerprint TEXT NOT NULL, '
+        'result TEXT NOT NULL, '
+        'PRIMARY KEY (manifest, position, fingerprint))',
+    )
+
+    @staticmethod
+    def get_manifest_key(manifest_filename, shard=None):
+        """Returns the key used to journal records for the given manifest, or
+        for one (index, count) shard of it, so each shard of a manifest can
+        be cleared and resumed separately."""
+        key = manifest_filename
+        if manifest_filename != '-':
+            key = os.path.abspath(manifest_filename)
+        if shard is not None:
+            key = '{}#shard={}/{}'.format(key, *shard)
+        return key
+
+    @staticmethod
+    def fingerprint(record):
+        """Returns a digest of the contents of a single manifest record"""
+        serialized = json.dumps(record, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(serialized).hexdigest()
+
+    def clear(self, manifest_filename, shard=None):
+        """Forget all journaled records for the given manifest"""
+        with self._lock, self.connection:
+            self.connection.execute(
+                'DELETE FROM batch_journal WHERE manifest = ?',
+                (self.get_manifest_key(manifest_filename, shard),))
+
+    def get(self, manifest_filename, position, record, shard=None):
+        """Returns the journaled result for the record at ``position`` in the
+        given manifest, or None if that record has not been registered."""
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT result FROM batch_journal '
+                'WHERE manifest = ? AND position = ? AND fingerprint = ?',
+                (self.get_manifest_key(manifest_filename, shard), position,
+                 self.fingerprint(record))
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add(self, manifest_filename, position, record, result, shard=None):
+        """Journal the result of registering the record at ``position``. The
+        result is committed immediately, so it survives a crash."""
+        with self._lock, self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO batch_journal '
+                '(manifest, position, fingerprint, result) '
+                'VALUES (?, ?, ?, ?)',
+                (self.get_manifest_key(manifest_filename, shard), position,
+                 self.fingerprint(record), json.dumps(result))
+            )
@@ -0,0 +1,271 @@
+"""
+Copyright 2016 University of Chicago, University of Southern California
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import io
+import re
+import sys
+import json
+import logging
+import contextlib
+
+from minid.exc import MinidException
+
+log = logging.getLogger(__name__)
+
+# Characters read from a manifest at a time. Memory use is bounded by this
+# plus the size of the largest single record.
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# Leading bytes of each supported compression format
+COMPRESSION_MAGIC = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+)
+
+
+class _RawReader(io.RawIOBase):
+    """Adapts any readable binary file, such as a pipe or stdin replaced in
+    tests, so it can be buffered. Closing it leaves the file open."""
+
+    def __init__(self, file_handle):
+        self.file_handle = file_handle
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.file_handle.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def get_compression(head):
+    """Returns the compression format of a file starting with the bytes
+    ``head``, or None if it is not compressed"""
+    for magic, compression in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def _open_zstd(file_handle):
+    try:
+        # Part of the standard library from Python 3.14
+        from compression import zstd
+        return zstd.ZstdFile(file_handle)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise MinidException('Reading zstd compressed manifests requires the '
+                             'zstandard package: pip install minid[zstd]')
+    reader = zstandard.ZstdDecompressor().stream_reader(file_handle,
+                                                        closefd=False)
+    return io.BufferedReader(reader, buffer_size=DEFAULT_CHUNK_SIZE)
+
+
+@contextlib.contextmanager
+def open_manifest(filename):
+    """
+    Open a manifest for reading, and yield a binary file handle of its
+    decompressed contents which supports peek(). Manifests compressed with
+    gzip, bzip2, xz or zstd are decompressed as they are read, and are
+    detected by their contents rather than their file extension. Reading
+    zstd requires Python 3.14 or the zstandard package.
+    ** Parameters **
+      ``filename`` (*string*)
+      Path to the manifest, or '-' to read it from stdin
+    """
+    if filename == '-':
+        source = getattr(sys.stdin, 'buffer', sys.stdin)
+    else:
+        source = open(filename, 'rb')
+    layers = []
+    try:
+        if not hasattr(source, 'peek'):
+            layers.append(io.BufferedReader(_RawReader(source),
+                                            buffer_size=DEFAULT_CHUNK_SIZE))
+        manifest = layers[-1] if layers else source
+        compression = get_compression(manifest.peek(8))
+        if compression == 'gzip':
+            import gzip
+            layers.append(gzip.GzipFile(fileobj=manifest))
+        elif compression == 'bz2':
+            import bz2
+            layers.append(bz2.BZ2File(manifest))
+        elif compression == 'xz':
+            import lzma
+            layers.append(lzma.LZMAFile(manifest))
+        elif compression == 'zstd':
+            layers.append(_open_zstd(manifest))
+        if compression:
+            log.debug('Decompressing {} manifest {}'.format(compression,
+                                                            filename))
+        yield layers[-1] if layers else source
+    finally:
+        for layer in reversed(layers):
+            layer.close()
+        if source is not getattr(sys.stdin, 'buffer', sys.stdin):
+            source.close()
+
+
+def _is_truncated(error, buffer):
+    """Returns True if decoding ``buffer`` may have failed with ``error`` only
+    because the value is cut short by the end of the buffer, rather than
+    because it is malformed"""
+    if error.msg.startswith('Unterminated string'):
+        return True
+    # The longest literal a value can be cut short in, such as '-Infinit'
+    return len(buffer) - error.pos < len('-Infinity')
+
+
+def iter_json_array(file_handle, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield each element of the JSON array in ``file_handle`` as soon as it has
+    been decoded, without reading the whole array into memory. Objects are
+    decoded as plain dicts. Raises json.JSONDecodeError if the file is not a
+    valid JSON array, after yielding any elements before the error. A
+    malformed element raises as soon as it is read, so the rest of the file
+    is never read into memory.
+    ** Parameters **
+      ``file_handle`` (*file*)
+      A text file handle positioned at the start of the array
+      ``chunk_size`` (*int*)
+      Number of characters to read at a time
+    """
+    decode = json.JSONDecoder().raw_decode
+    buffer, pos, eof = '', 0, False
+    read_size = chunk_size
+    # One of 'start', 'first', 'value', 'next' or 'done'
+    state = 'start'
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos == len(buffer) and not eof:
+            buffer, pos = file_handle.read(chunk_size), 0
+            eof = not buffer
+            continue
+        if state == 'done':
+            if pos != len(buffer):
+                raise json.JSONDecodeError('Extra data', buffer, pos)
+            return
+        if pos == len(buffer):
+            raise json.JSONDecodeError('Unexpected end of manifest', buffer, pos)
+
+        char = buffer[pos]
+        if state == 'start':
+            if char != '[':
+                raise json.JSONDecodeError('Expecting a JSON array', buffer, pos)
+            pos += 1
+            state = 'first'
+        elif state == 'next':
+            if char not in ',]':
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+            pos += 1
+            state = 'value' if char == ',' else 'done'
+        elif state == 'first' and char == ']':
+            pos += 1
+            state = 'done'
+        else:
+            try:
+                value, end = decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if eof or not _is_truncated(e, buffer):
+                    raise
+                end = None
+            # A value ending at the end of the buffer may be a number cut
+            # short, so it is only trusted once more has been read.
+            if end is None or (end == len(buffer) and not eof):
+                chunk = file_handle.read(read_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                # Grow reads while a record spans several chunks, so huge
+                # records are not decoded from the start too many times.
+                read_size *= 2
+                continue
+            yield value
+            pos, read_size = end, chunk_size
+            state = 'next'
+
+
+def benchmark(num_records=200000, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Compare reading a generated manifest of ``num_records`` remote file
+    manifest records with iter_json_array() against json.load(). Returns a
+    dict with the records per second and peak memory of each.
+    """
+    import os
+    import time
+    import tempfile
+    import tracemalloc
+    from collections import OrderedDict
+
+    def parse_with_json_load(manifest):
+        for _ in json.load(manifest, object_pairs_hook=OrderedDict):
+            pass
+
+    def parse_incrementally(manifest):
+        for _ in iter_json_array(manifest, chunk_size):
+            pass
+
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as manifest:
+        manifest.write('[\n')
+        for position in range(num_records):
+            record = {
+                'filename': 'data/file_{:09d}.txt'.format(position),
+                'length': position,
+                'sha256': '{:064x}'.format(position),
+                'url': 'https://example.com/data/file_{:09d}.txt'.format(position),
+            }
+            manifest.write(('  ' if position == 0 else ',\n  ') + json.dumps(record))
+        manifest.write('\n]\n')
+    try:
+        results = {'records': num_records,
+                   'size': os.path.getsize(manifest.name)}
+        for name, parse in (('json.load', parse_with_json_load),
+                            ('iter_json_array', parse_incrementally)):
+            with open(manifest.name) as handle:
+                start = time.perf_counter()
+                parse(handle)
+                elapsed = time.perf_counter() - start
+            with open(manifest.name) as handle:
+                tracemalloc.start()
+                parse(handle)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            results[name] = {'records_per_second': num_records / elapsed,
+                             'peak_memory': peak}
+        return results
+    finally:
+        os.unlink(manifest.name)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark reading large JSON array manifests')
+    parser.add_argument('--records', type=int, default=200000, help='Number of records to generate')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='Characters read at a time by iter_json_array')
+    args = parser.parse_args()
+    results = benchmark(args.records, args.chunk_size)
+    print('{records} records, {size:,} bytes'.format(**results))
+    for name in ('json.load', 'iter_json_array'):
+        print('{:16} {:>12,.0f} records/s {:>10.1f} MiB peak'.format(
+            name, results[name]['records_per_second'],
+            results[name]['peak_memory'] / (1024 * 1024)))
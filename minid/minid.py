@@ -13,20 +13,63 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import io
 import os
+import re
+import time
 import logging
 import json
-from collections import OrderedDict
+import sqlite3
+import threading
+import configparser
+import tempfile
+import contextlib
+from collections import OrderedDict, Counter, deque
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 import hashlib
 import datetime
 
-import fair_research_login
-import globus_sdk
-from fair_identifiers_client.identifiers_api import IdentifierClient
-from fair_identifiers_client.main import SUPPORTED_CHECKSUMS
-from minid.exc import MinidException, LoginRequired, UnknownIdentifier
+from minid.exc import (MinidException, LoginRequired, UnknownIdentifier,
+                       BatchRegisterError)
+from minid.journal import BatchJournal
+from minid.workqueue import WorkQueue
+from minid.cache import ChecksumCache, ResponseCache, CachedResponse
+from minid import hashing
+from minid.retry import RetryPolicy, RateLimiter
 log = logging.getLogger(__name__)
 
+# The Globus SDK, Fair Research Login and the Identifiers Client take most of
+# the time spent importing minid, so they are imported by the code paths which
+# use them instead of here. Commands which never reach the network, such as
+# 'minid version', start without loading them at all.
+
+
+def _supported_checksums():
+    """Returns the names of checksum algorithms accepted by the
+    Identifiers Service"""
+    from fair_identifiers_client.main import SUPPORTED_CHECKSUMS
+    return SUPPORTED_CHECKSUMS
+
+
+# Checksum options of a hash pool worker process, see MinidClient._hash_pool()
+_hash_worker_options = None
+
+
+def _init_hash_worker(checksum_options):
+    global _hash_worker_options
+    _hash_worker_options = checksum_options
+    cache = checksum_options['cache']
+    if cache is not None:
+        # Worker processes exit without running atexit hooks, so the cache is
+        # closed by multiprocessing instead.
+        from multiprocessing import util
+        util.Finalize(cache, cache.close, exitpriority=10)
+
+
+def _hash_in_worker(filename, algorithms):
+    return MinidClient.compute_checksums(filename, algorithms,
+                                         **_hash_worker_options)
+
 
 class MinidClient(object):
     CLIENT_ID = 'fa63f71e-4b8c-4032-b78e-0fc6214efd0b'
@@ -39,6 +82,18 @@ class MinidClient(object):
     IDENTIFIERS_NAMESPACE = 'minid'
     IDENTIFIERS_NAMESPACE_TEST = 'minid-test'
 
+    # Most seconds an authorizer loaded from the config is reused before
+    # tokens are loaded again. It is reused for less time if its access token
+    # expires sooner. Authorizers which refresh their own tokens are reused
+    # until the user logs in or out.
+    AUTHORIZER_CACHE_TTL = 300
+    # Seconds the user's name is saved in the config for 'created_by'
+    CREATED_BY_TTL = 7 * 24 * 60 * 60
+    USERINFO_SECTION = 'userinfo'
+    # Stands in for the result of a duplicate record during a batch, until the
+    # record it duplicates has been registered
+    DUPLICATE_RECORD = object()
+
     # Common prefixes associated with MINID
     PREFIXES = {
         'minid': 'minid:',
@@ -53,25 +108,98 @@ class MinidClient(object):
 
     def __init__(self, authorizer=None, app_name=None, native_client=None,
                  config=None,
-                 base_url='https://identifiers.fair-research.org/'):
+                 base_url='https://identifiers.fair-research.org/',
+                 checksum_cache=None, block_size=None, use_mmap=False,
+                 pipeline_depth=0, response_cache=None, pool_size=10,
+                 retry_policy=None, rate_limit=None):
+        """
+        ** Parameters **
+          ``checksum_cache`` (*bool* or *ChecksumCache*)
+          Cache file checksums on disk, so unchanged files are not hashed
+          again. True stores the cache alongside the minid config, a
+          ChecksumCache may be given to store it elsewhere. Disabled by
+          default.
+          ``block_size`` (*int* or *string*)
+          Number of bytes read at a time when checksumming files. Defaults to
+          a size suited to the filesystem, 'auto' measures the fastest size.
+          ``use_mmap`` (*bool*)
+          Checksum large files by mapping them into memory.
+          ``pipeline_depth`` (*int*)
+          Read up to this many blocks ahead of hashing when checksumming large
+          files, hashing each algorithm on its own thread. 0 disables it.
+          ``response_cache`` (*bool* or *ResponseCache*)
+          Cache identifier lookups made by ``check()``, so resolving the same
+          minid or checksum again does not go to the network. True caches
+          responses in memory for five minutes, a ResponseCache may be given
+          to change the expiry, size or add an on-disk tier. Entries are
+          invalidated when this client updates or replaces an identifier.
+          Disabled by default.
+          ``pool_size`` (*int*)
+          The number of keep-alive connections to the identifiers service
+          kept open for reuse. Set this to at least the number of threads
+          sharing the client, such as the ``max_workers`` of a batch.
+          ``retry_policy`` (*RetryPolicy*)
+          Decides which failed requests to the identifiers service are
+          retried, and how long to back off between attempts. Defaults to
+          a RetryPolicy() which never repeats a request that may have created
+          an identifier.
+          ``rate_limit`` (*float* or *RateLimiter*)
+          The most requests per second sent to the identifiers service,
+          shared by every thread using the client. Unlimited by default.
+        """
         self.app_name = app_name or self.NAME
         self.config = config or self.CONFIG
         self.base_url = base_url
         self._authorizer = authorizer
         self._identifiers_client = None
+        self._identifiers_client_lock = threading.Lock()
+        self.pool_size = pool_size
+        self._batch_journal = None
+        self._checksum_cache = checksum_cache
+        self.block_size = block_size
+        self.use_mmap = use_mmap
+        self.pipeline_depth = pipeline_depth
+        self.response_cache = (ResponseCache() if response_cache is True
+                               else response_cache or None)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = (rate_limit if isinstance(rate_limit, RateLimiter)
+                             else RateLimiter(rate_limit) if rate_limit
+                             else None)
+        self._native_client = native_client
+        self._native_client_lock = threading.Lock()
+        self._loaded_authorizer = None
+        self._loaded_authorizer_expires = 0
+        self._loaded_authorizer_lock = threading.Lock()
+        # Updates skipped by each thread, see _skip_update()
+        self._skipped_updates = threading.local()
+
+    @property
+    def native_client(self):
+        """The Fair Research Login client which stores tokens in the minid
+        config. It is only built once tokens are needed, so clients given an
+        authorizer, or only used to resolve identifiers anonymously, never
+        touch the config."""
+        if self._native_client is None:
+            with self._native_client_lock:
+                if self._native_client is None:
+                    import fair_research_login
+                    storage = fair_research_login.ConfigParserTokenStorage(
+                        filename=self.config, section='tokens')
+                    self._native_client = fair_research_login.NativeClient(
+                        app_name=self.app_name, client_id=self.CLIENT_ID,
+                        default_scopes=self.SCOPES, token_storage=storage
+                    )
+        return self._native_client
 
+    @native_client.setter
+    def native_client(self, value):
+        self._native_client = value
+
+    def _make_config_dir(self):
         config_dir = os.path.dirname(self.config)
-        if not os.path.exists(config_dir):
+        if config_dir and not os.path.exists(config_dir):
             os.mkdir(config_dir)
 
-        if native_client is None:
-            storage = fair_research_login.ConfigParserTokenStorage(
-                filename=self.config, section='tokens')
-            self.native_client = fair_research_login.NativeClient(
-                app_name=self.app_name, client_id=self.CLIENT_ID,
-                default_scopes=self.SCOPES, token_storage=storage
-            )
-
     def login(self, refresh_tokens=False, no_local_server=True,
               no_browser=True, force=False):
         """
@@ -96,69 +224,248 @@ class MinidClient(object):
         ``force`` (*bool*)
           Force a login flow, even if loaded tokens are valid.
         """
+        # Tokens are saved in the config, so its directory must exist
+        self._make_config_dir()
         self.native_client.login(refresh_tokens=refresh_tokens,
                                  no_local_server=no_local_server,
                                  no_browser=no_browser,
                                  force=force)
+        self._clear_authorizer()
+        self._clear_userinfo()
 
     def logout(self):
         """
         Revoke local tokens and clear the token cache.
         """
+        import fair_research_login
         try:
             self.native_client.load_tokens()
             self.native_client.logout()
             return True
         except fair_research_login.LoadError:
             return False
+        finally:
+            self._clear_authorizer()
+            self._clear_userinfo()
 
     @property
     def authorizer(self):
+        """The authorizer for the identifiers service, or None if the user
+        is not logged in. Authorizers loaded from the config are kept in
+        memory, so checking the login does not read the config every time.
+        See AUTHORIZER_CACHE_TTL."""
         if self._authorizer is not None:
             return self._authorizer
+        if self._loaded_authorizer_expires > time.monotonic():
+            return self._loaded_authorizer
+        with self._loaded_authorizer_lock:
+            if self._loaded_authorizer_expires <= time.monotonic():
+                authorizer, expires_at = self._load_authorizer()
+                self._loaded_authorizer = authorizer
+                if hasattr(authorizer, 'ensure_valid_token'):
+                    # Refresh token authorizers renew their own tokens
+                    self._loaded_authorizer_expires = float('inf')
+                else:
+                    ttl = self.AUTHORIZER_CACHE_TTL
+                    if expires_at is not None:
+                        ttl = min(ttl, expires_at - time.time())
+                    self._loaded_authorizer_expires = time.monotonic() + ttl
+            return self._loaded_authorizer
+
+    @authorizer.setter
+    def authorizer(self, value):
+        self._authorizer = value
+        self._clear_authorizer()
+
+    def _load_authorizer(self):
+        """Returns the authorizer for the identifiers service loaded from the
+        user's tokens, along with the time its access token expires in
+        seconds since the epoch, or (None, None) if the user is not logged
+        in."""
+        import fair_research_login
         try:
-            return self.native_client.get_authorizers_by_scope()[
+            tokens = self.native_client.load_tokens_by_scope()[
                 'https://auth.globus.org/scopes/identifiers.fair-research.org/'
                 'writer'
             ]
         except fair_research_login.LoadError:
-            return None
+            return None, None
+        return (self.native_client.get_authorizer(tokens),
+                tokens.get('expires_at_seconds'))
 
-    @authorizer.setter
-    def authorizer(self, value):
-        self._authorizer = value
+    def _clear_authorizer(self):
+        """Forget the loaded authorizer, along with the identifiers client
+        built with it, after the user's tokens change."""
+        with self._loaded_authorizer_lock:
+            self._loaded_authorizer = None
+            self._loaded_authorizer_expires = 0
+        with self._identifiers_client_lock:
+            self._identifiers_client = None
 
     def is_logged_in(self):
         return bool(self.authorizer)
 
     @property
     def identifiers_client(self):
-        log.debug('Authorizer: {}'.format(self.authorizer))
-        if not self._identifiers_client:
-            self._identifiers_client = IdentifierClient(
-                base_url=self.base_url,
-                app_name=self.app_name,
-                authorizer=self.authorizer
-            )
+        """The client for the identifiers service. It is built once, and is
+        safe to share between threads. Its connections are kept alive and
+        reused by every request made through this client."""
+        if self._identifiers_client is None:
+            with self._identifiers_client_lock:
+                if self._identifiers_client is None:
+                    from fair_identifiers_client.identifiers_api import \
+                        IdentifierClient
+                    log.debug('Authorizer: {}'.format(self.authorizer))
+                    client = IdentifierClient(
+                        base_url=self.base_url,
+                        app_name=self.app_name,
+                        authorizer=self.authorizer
+                    )
+                    self._configure_connection_pool(client)
+                    self._identifiers_client = client
         return self._identifiers_client
 
+    def _configure_connection_pool(self, client):
+        """Size the keep-alive connection pool of the client's HTTP session,
+        and apply the client's rate limit and retry policy to it"""
+        transport = getattr(client, 'transport', None)
+        # Globus SDK v2 clients keep their session on the client itself
+        session = getattr(transport, 'session', None) or getattr(
+            client, '_session', None)
+        if session is None:
+            log.debug('Unable to configure the connection pool for {}'
+                      ''.format(client))
+            return
+        from requests.adapters import HTTPAdapter
+        from minid.adapters import RateLimitedAdapter
+        if self.rate_limiter is not None:
+            adapter = RateLimitedAdapter(self.rate_limiter,
+                                         pool_connections=self.pool_size,
+                                         pool_maxsize=self.pool_size)
+        else:
+            adapter = HTTPAdapter(pool_connections=self.pool_size,
+                                  pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if transport is not None:
+            self.retry_policy.configure_transport(transport)
+
+    @property
+    def batch_journal(self):
+        """The journal of completed batch registrations, stored alongside the
+        minid config."""
+        if self._batch_journal is None:
+            self._batch_journal = BatchJournal(os.path.join(
+                os.path.dirname(self.config), BatchJournal.FILENAME))
+        return self._batch_journal
+
+    @property
+    def checksum_cache(self):
+        """The ChecksumCache used when checksumming files, or None if checksums
+        are not cached."""
+        if self._checksum_cache is True:
+            self._checksum_cache = ChecksumCache(os.path.join(
+                os.path.dirname(self.config), ChecksumCache.FILENAME))
+        return self._checksum_cache or None
+
     def get_cached_created_by(self):
         """Get the 'created_by' field by pulling the current users name from
-        Globus Auth. The field is only fetched the first time after the client
-        has been instantiated. After that, the value is cached and returned
-        from memory. This speeds things up if calling register() multiple times
-        from the same client.
+        Globus Auth. The name is saved in the minid config along with a digest
+        of the token it was fetched with, so later clients and CLI invocations
+        reuse it without contacting Globus Auth until it is CREATED_BY_TTL
+        seconds old, or the user logs in again. After the first call, the
+        value is also cached in memory on this client.
         """
         if getattr(self, '_cached_created_by', None):
             return self._cached_created_by
+        import globus_sdk
         authorizer = self.native_client.get_authorizers()['auth.globus.org']
-        ac = globus_sdk.AuthClient(authorizer=authorizer)
-        user_info = ac.oauth2_userinfo()
-        self._cached_created_by = user_info.data.get('name', '')
+        identity = self._get_token_identity(authorizer)
+        name = self._load_userinfo(identity)
+        if name is None:
+            ac = globus_sdk.AuthClient(authorizer=authorizer)
+            user_info = ac.oauth2_userinfo()
+            name = user_info.data.get('name', '')
+            self._save_userinfo(identity, name)
+        self._cached_created_by = name
         return self._cached_created_by
 
+    @staticmethod
+    def _get_token_identity(authorizer):
+        """Returns a digest identifying the tokens behind an authorizer, so
+        saved user info is never used with another user's tokens."""
+        token = (getattr(authorizer, 'refresh_token', None) or
+                 getattr(authorizer, 'access_token', None))
+        if not isinstance(token, str):
+            return None
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def _read_config(self):
+        config = configparser.ConfigParser(interpolation=None)
+        config.read(self.config)
+        return config
+
+    def _update_config(self, update):
+        """Apply ``update`` to the config and save it, if ``update`` returns
+        True. The config is re-read right before writing so changes saved by
+        other processes, such as new tokens, are kept. It is written to a
+        temporary file and moved into place, so the tokens it holds are never
+        truncated by a failed or concurrent write."""
+        config_dir = os.path.dirname(self.config) or '.'
+        temp_name = None
+        try:
+            config = self._read_config()
+            if not update(config):
+                return
+            # mkstemp creates the file readable only by the user, since the
+            # config also holds the user's tokens
+            fd, temp_name = tempfile.mkstemp(
+                dir=config_dir, prefix='.minid-config-', suffix='.tmp')
+            with os.fdopen(fd, 'w') as config_file:
+                config.write(config_file)
+            os.replace(temp_name, self.config)
+        except (OSError, configparser.Error) as error:
+            log.debug('Unable to save user info to {}: {}'.format(
+                self.config, error))
+            if temp_name is not None:
+                with contextlib.suppress(OSError):
+                    os.unlink(temp_name)
+
+    def _load_userinfo(self, identity):
+        if identity is None:
+            return None
+        config = self._read_config()
+        if not config.has_section(self.USERINFO_SECTION):
+            return None
+        userinfo = config[self.USERINFO_SECTION]
+        try:
+            expires = float(userinfo.get('expires', 0))
+        except ValueError:
+            return None
+        if userinfo.get('identity') != identity or expires < time.time():
+            return None
+        return userinfo.get('name')
+
+    def _save_userinfo(self, identity, name):
+        if identity is None or not isinstance(name, str):
+            return
+
+        def save(config):
+            config[self.USERINFO_SECTION] = {
+                'identity': identity,
+                'name': name,
+                'expires': str(time.time() + self.CREATED_BY_TTL),
+            }
+            return True
+        self._update_config(save)
+
+    def _clear_userinfo(self):
+        self._cached_created_by = None
+        self._update_config(
+            lambda config: config.remove_section(self.USERINFO_SECTION))
+
     def register_file(self, filename, title='', locations=None, test=False,
-                      replaces=None):
+                      replaces=None, algorithms=('sha256',)):
         """
         Register a file and produce an identifier. The file is automatically
         checksummed using sha256, and the checksum is sent to the identifiers
@@ -175,6 +482,10 @@ class MinidClient(object):
           Create the minid in a non-permanent test namespace
           ``replaces`` (* string *)
           ID of another identifier to replace
+          ``algorithms`` (* array of strings *)
+          Checksum algorithms to register the file with. All checksums are
+          computed from a single read of the file. Defaults to sha256, see
+          ``get_supported_algorithms()`` for everything which can be used.
         ** Returns **
         A dict describing attributes of the identifier.
         See ``register`` for an example of the output.
@@ -182,19 +493,129 @@ class MinidClient(object):
         if not self.is_logged_in():
             raise LoginRequired('The Minid Client did not have a valid '
                                 'authorizer.')
-        locations = locations or []
-        title = title or filename
-        metadata = {
+        self._check_algorithms(algorithms)
+        metadata = self._get_file_metadata(filename, title)
+        computed = self.compute_checksums(filename, algorithms,
+                                          **self._checksum_options())
+        checksums = [{'function': name, 'value': computed[name]}
+                     for name in algorithms]
+        return self.register(checksums, title=metadata['title'],
+                             locations=locations or [], test=test,
+                             metadata=metadata, replaces=replaces)
+
+    def register_files(self, filenames, test=False, locations=None,
+                       algorithms=('sha256',), jobs=1):
+        """
+        Register many files, yielding each result as soon as its file has
+        been registered. Files are checksummed in a pool of ``jobs``
+        processes, and registered by ``jobs`` threads sharing one connection
+        to the identifiers service. Each file is titled with its filename.
+        ** Parameters **
+          ``filenames`` (*list of strings*)
+          The files to register
+          ``test`` (* boolean *)
+          Create the minids in a non-permanent test namespace
+          ``locations`` (* array of strings *)
+          Network accessible locations shared by every file
+          ``algorithms`` (* array of strings *)
+          Checksum algorithms to register each file with. See
+          ``register_file``.
+          ``jobs`` (*int*)
+          The number of files to checksum and register in parallel
+        ** Yields **
+          A (filename, identifier) tuple for each file, in the order the files
+          finish registering. See ``register`` for the identifier response.
+        ** Raises **
+          BatchRegisterError after the last result has been yielded if any
+          files failed to register. Its ``errors`` holds (position, filename,
+          exception) tuples, where position is the index within filenames.
+        """
+        if not self.is_logged_in():
+            raise LoginRequired('The Minid Client did not have a valid '
+                                'authorizer.')
+        self._check_algorithms(algorithms)
+        filenames = list(filenames)
+        # Fetch the user's name once, before any workers need it
+        self.get_cached_created_by()
+        checksum_options = self._checksum_options()
+        errors = []
+
+        def register(filename, hash_pool):
+            metadata = self._get_file_metadata(filename)
+            if hash_pool is None:
+                computed = self.compute_checksums(filename, algorithms,
+                                                  **checksum_options)
+            else:
+                computed = hash_pool.submit(_hash_in_worker, filename,
+                                            algorithms).result()
+            checksums = [{'function': name, 'value': computed[name]}
+                         for name in algorithms]
+            return self.register(checksums, title=metadata['title'],
+                                 locations=locations or [], test=test,
+                                 metadata=metadata)
+
+        if jobs <= 1:
+            for position, filename in enumerate(filenames):
+                try:
+                    yield filename, register(filename, None)
+                except Exception as e:
+                    log.error('Failed to register {}: {}'.format(filename, e))
+                    errors.append((position, filename, e))
+        else:
+            with self._hash_pool(jobs, checksum_options) as hash_pool, \
+                    ThreadPoolExecutor(max_workers=jobs) as register_pool:
+                futures = {register_pool.submit(register, filename, hash_pool):
+                           (position, filename)
+                           for position, filename in enumerate(filenames)}
+                for future in as_completed(futures):
+                    position, filename = futures[future]
+                    try:
+                        yield filename, future.result()
+                    except Exception as e:
+                        log.error('Failed to register {}: {}'.format(filename,
+                                                                     e))
+                        errors.append((position, filename, e))
+        if errors:
+            raise BatchRegisterError(
+                '{} of {} files failed to register'.format(len(errors),
+                                                           len(filenames)),
+                errors=sorted(errors, key=lambda error: error[0]))
+
+    @staticmethod
+    def _check_algorithms(algorithms):
+        unsupported = set(algorithms).difference(_supported_checksums())
+        if unsupported:
+            raise MinidException('Checksum algorithms not supported by the '
+                                 'Identifiers Service: {}'.format(
+                                     ', '.join(sorted(unsupported))))
+
+    def _get_file_metadata(self, filename, title=''):
+        return {
             'title': title or filename,
             'length': os.path.getsize(filename),
             'created_by': self.get_cached_created_by(),
         }
-        checksums = [{
-            'function': 'sha256',
-            'value': self.compute_checksum(filename, hashlib.sha256())
-        }]
-        return self.register(checksums, title=title, locations=locations,
-                             test=test, metadata=metadata, replaces=replaces)
+
+    @staticmethod
+    def _hash_pool(jobs, checksum_options):
+        """Returns a pool of ``jobs`` processes which checksum files with
+        _hash_in_worker(). The options, and so the checksum cache, are sent
+        to each process once rather than with every file, and each process
+        closes its cache when the pool shuts down."""
+        # Loading multiprocessing is slow, so only do it when needed
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(max_workers=jobs,
+                                   initializer=_init_hash_worker,
+                                   initargs=(checksum_options,))
+
+    def _checksum_options(self):
+        """Options used whenever this client checksums a file"""
+        return {
+            'block_size': self.block_size,
+            'cache': self.checksum_cache,
+            'use_mmap': self.use_mmap,
+            'pipeline_depth': self.pipeline_depth,
+        }
 
     def register(self, checksums, title='', locations=None, test=False,
                  metadata=None, **kwargs):
@@ -247,23 +668,36 @@ class MinidClient(object):
         if not self.is_logged_in():
             raise LoginRequired('The Minid Client did not have a valid '
                                 'authorizer.')
+        create_args = self._get_register_args(checksums, title=title,
+                                              locations=locations, test=test,
+                                              metadata=metadata, **kwargs)
+        response = self.identifiers_client.create_identifier(**create_args)
+        self._invalidate_cached_responses(create_args.get('replaces'))
+        return response
+
+    @classmethod
+    def _get_register_args(cls, checksums, title='', locations=None,
+                           test=False, metadata=None, **kwargs):
+        """Build the fields sent to the identifiers service to create an
+        identifier. See ``register()`` for the parameters."""
         locations = locations or []
+        supported = _supported_checksums()
         unsupported = [c for c in checksums
-                       if c['function'] not in SUPPORTED_CHECKSUMS]
+                       if c['function'] not in supported]
         if unsupported:
             log.warning('The following checksums for {} are unsupported and '
                         'will not be included: {}'.format(title,
                                                           unsupported))
         supported_ck = [c for c in checksums
-                        if c['function'] in SUPPORTED_CHECKSUMS]
+                        if c['function'] in supported]
         metadata = metadata or {}
         metadata['title'] = title
-        namespace = (self.IDENTIFIERS_NAMESPACE_TEST if test is True
-                     else self.IDENTIFIERS_NAMESPACE)
+        namespace = (cls.IDENTIFIERS_NAMESPACE_TEST if test is True
+                     else cls.IDENTIFIERS_NAMESPACE)
         if kwargs.get('replaces'):
-            kwargs['replaces'] = self.to_identifier(kwargs['replaces'],
-                                                    identifier_type='hdl')
-        return self.identifiers_client.create_identifier(
+            kwargs['replaces'] = cls.to_identifier(kwargs['replaces'],
+                                                   identifier_type='hdl')
+        return dict(
             namespace=namespace,
             visible_to=['public'],
             metadata=metadata,
@@ -272,7 +706,7 @@ class MinidClient(object):
             **kwargs
         )
 
-    def update(self, minid, title=None, **kwargs):
+    def update(self, minid, title=None, existing=None, **kwargs):
         """
         ** Parameters **
           ``minid`` (*string*)
@@ -293,35 +727,104 @@ class MinidClient(object):
           ``replaced_by`` (*string*)
           The id of the identifier that replaces this identifier. None will
           clear an existing `replaces` value.
+          ``existing`` (*dict*)
+          The current record of the minid, such as from ``check()``. If
+          given, only fields which differ from it are sent, and nothing is
+          sent if no fields differ, in which case ``existing`` is returned.
         """
+        self._check_update_args(kwargs)
+        if not self.is_logged_in():
+            raise LoginRequired('The Minid Client did not have a valid '
+                                'authorizer.')
+        identifier, kwargs = self._get_update_args(minid, title=title,
+                                                   **kwargs)
+        if existing is not None:
+            kwargs = self._diff_update_args(kwargs, existing)
+            if kwargs is None:
+                return self._skip_update(identifier, existing)
+        response = self.identifiers_client.update_identifier(
+            identifier, **kwargs)
+        self._invalidate_cached_responses(identifier, kwargs.get('replaces'),
+                                          kwargs.get('replaced_by'))
+        return response
+
+    @staticmethod
+    def _check_update_args(kwargs):
         allowed_kwargs = {'title', 'locations', 'metadata', 'active',
                           'replaces', 'replaced_by'}
         if not set(kwargs).issubset(allowed_kwargs):
             raise MinidException('Update args not allowed: {}'.format(
                 set(kwargs).difference(allowed_kwargs)
             ))
-        if not self.is_logged_in():
-            raise LoginRequired('The Minid Client did not have a valid '
-                                'authorizer.')
+
+    @classmethod
+    def _get_update_args(cls, minid, title=None, **kwargs):
+        """Build the identifier and fields sent to the identifiers service to
+        update a minid. See ``update()`` for the parameters."""
         # Ensure metadata is set, even if it doesn't have anything in it.
         kwargs['metadata'] = kwargs.get('metadata', {})
         # Set title if it is given
         if title:
             kwargs['metadata']['title'] = title
-        identifier = self.to_identifier(minid, identifier_type='hdl')
+        identifier = cls.to_identifier(minid, identifier_type='hdl')
         for ent in kwargs:
             if ent in ['replaces', 'replaced_by']:
                 # 'replaces' or 'replaced_by' MUST be either a vaild identifier
                 # or None to unset. to_identifier() will raise an exception if
                 # the identifier cannot resolve to hdl.
-                value = None if kwargs[ent] is None else self.to_identifier(
+                value = None if kwargs[ent] is None else cls.to_identifier(
                     kwargs[ent], identifier_type='hdl')
                 kwargs[ent] = value
         # The 'location' field in the service is not plural
         if 'locations' in kwargs.keys():
             kwargs['location'] = kwargs.pop('locations')
-        return self.identifiers_client.update_identifier(
-            identifier, **kwargs)
+        return identifier, kwargs
+
+    @staticmethod
+    def _diff_update_args(kwargs, existing):
+        """Returns the update fields built by ``_get_update_args()`` which
+        differ from the ``existing`` record of the minid, or None if none of
+        them differ. Only changed metadata keys are kept."""
+        changed = {}
+        existing_metadata = existing.get('metadata') or {}
+        metadata = {key: value
+                    for key, value in kwargs.get('metadata', {}).items()
+                    if existing_metadata.get(key) != value}
+        if metadata:
+            changed['metadata'] = metadata
+        for name, value in kwargs.items():
+            if name != 'metadata' and existing.get(name) != value:
+                changed[name] = value
+        if not changed:
+            return None
+        # The service expects metadata, even if it doesn't have anything in it
+        changed.setdefault('metadata', {})
+        return changed
+
+    def _skip_update(self, identifier, existing):
+        """Count an update which was not sent because nothing changed, and
+        return ``existing`` in place of the service's response. Skips are
+        counted per thread, so each registration can tell whether it skipped
+        an update while others run alongside it."""
+        log.debug('Skipping update of {}, it is already up to date'
+                  ''.format(identifier))
+        self._skipped_updates.count = self._get_skipped_updates() + 1
+        return CachedResponse(existing)
+
+    def _get_skipped_updates(self):
+        """Returns the number of updates skipped by the current thread"""
+        return getattr(self._skipped_updates, 'count', 0)
+
+    def _invalidate_cached_responses(self, *identifiers):
+        """Drop cached lookups that may be stale after an identifier was
+        created or changed. Checksum lookups list matching identifiers, so all
+        of them are dropped along with each of the given identifiers."""
+        if self.response_cache is None:
+            return
+        for identifier in identifiers:
+            if identifier:
+                self.response_cache.invalidate('identifier:' + identifier)
+        self.response_cache.invalidate('checksum:*')
 
     def check(self, entity, algorithm='sha256'):
         """
@@ -338,55 +841,171 @@ class MinidClient(object):
         """
         if self.is_valid_identifier(entity):
             hdl = self.to_identifier(entity, 'hdl')
-            return self.identifiers_client.get_identifier(hdl)
+            return self._cached_lookup('identifier:' + hdl,
+                                       self.identifiers_client.get_identifier,
+                                       hdl)
         else:
             alg = self.get_algorithm(algorithm)
-            checksum = self.compute_checksum(entity, alg)
-            log.debug('File lookup using ({}) {}'.format(algorithm, checksum))
-            return self.identifiers_client.get_identifier_by_checksum(checksum)
+            checksum = self.compute_checksum(entity, alg,
+                                             **self._checksum_options())
+            return self._check_checksum(checksum, algorithm)
+
+    def _check_checksum(self, checksum, algorithm):
+        log.debug('File lookup using ({}) {}'.format(algorithm, checksum))
+        return self._cached_lookup(
+            'checksum:{}:{}'.format(algorithm, checksum),
+            self.identifiers_client.get_identifier_by_checksum, checksum)
+
+    def check_many(self, entities, algorithm='sha256', jobs=1):
+        """
+        Check many files and identifiers at once, yielding a result for each
+        as soon as it has been checked. Duplicate entities are only checked
+        once. Files are checksummed in a pool of ``jobs`` processes, and
+        lookups run on ``jobs`` threads.
+        ** Parameters **
+          ``entities`` (*list*)
+          Each entity is a filename or an identifier, as accepted by
+          ``check()``, or a (filename, identifier) pair to verify that the
+          file matches the checksums registered for the identifier.
+          ``algorithm`` (*string*)
+          The algorithm used to checksum files
+          ``jobs`` (*int*)
+          The number of entities to check in parallel
+        ** Yields **
+          A dict for each entity, in the order they finish being checked:
+          {
+            "entity": "foo.txt",
+            "status": "found",
+            "identifiers": [{"identifier": "hdl:20.500.12633/1234567", ...}]
+          }
+          status is 'found', 'missing' if the identifier does not exist or no
+          identifier is registered for the file, 'mismatched' if a file does
+          not match the checksums of the identifier it was paired with, or
+          'error' along with an 'error' message. Pairs also include the
+          'identifier' they were checked against.
+        """
+        self.get_algorithm(algorithm)
+        entities = list(OrderedDict.fromkeys(
+            tuple(entity) if isinstance(entity, list) else entity
+            for entity in entities))
+        checksum_options = self._checksum_options()
+
+        def compute(filename, hash_pool):
+            if hash_pool is None:
+                return self.compute_checksums(filename, [algorithm],
+                                              **checksum_options)[algorithm]
+            return hash_pool.submit(_hash_in_worker, filename,
+                                    [algorithm]).result()[algorithm]
+
+        def lookup_identifier(identifier):
+            from fair_identifiers_client.identifiers_api import \
+                IdentifierClientError
+            try:
+                return self.check(identifier).data
+            except IdentifierClientError as ice:
+                if ice.http_status == 404:
+                    return None
+                raise
+
+        def check(entity, hash_pool):
+            if isinstance(entity, tuple):
+                filename, identifier = entity
+                result = {'entity': filename, 'identifier': identifier}
+            else:
+                result = {'entity': entity}
+            try:
+                if isinstance(entity, tuple):
+                    existing = lookup_identifier(identifier)
+                    if existing is None:
+                        result.update(status='missing', identifiers=[])
+                        return result
+                    checksums = [{'function': algorithm,
+                                  'value': compute(filename, hash_pool)}]
+                    matches = self.validate_checksums(existing['checksums'],
+                                                      checksums)
+                    result.update(status='found' if matches else 'mismatched',
+                                  identifiers=[existing])
+                elif self.is_valid_identifier(entity):
+                    existing = lookup_identifier(entity)
+                    result.update(status='found' if existing else 'missing',
+                                  identifiers=[existing] if existing else [])
+                else:
+                    checksum = compute(entity, hash_pool)
+                    found = self._check_checksum(checksum, algorithm).data
+                    identifiers = found.get('identifiers', [])
+                    result.update(status='found' if identifiers else 'missing',
+                                  identifiers=identifiers)
+            except Exception as e:
+                log.debug('Failed to check {}: {}'.format(entity, e))
+                result.update(status='error', error=str(e))
+            return result
+
+        if jobs <= 1:
+            for entity in entities:
+                yield check(entity, None)
+            return
+
+        with self._hash_pool(jobs, checksum_options) as hash_pool, \
+                ThreadPoolExecutor(max_workers=jobs) as check_pool:
+            futures = [check_pool.submit(check, entity, hash_pool)
+                       for entity in entities]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def _cached_lookup(self, key, lookup, *args):
+        """Return the cached response for ``key`` if there is one, otherwise
+        call ``lookup`` and cache its response."""
+        if self.response_cache is None:
+            return lookup(*args)
+        response = self.response_cache.get(key)
+        if response is None:
+            response = lookup(*args)
+            self.response_cache.set(key, response)
+        else:
+            log.debug('Using cached response for {}'.format(key))
+        return response
 
     @staticmethod
     def _is_stream(file_handle):
         """
-        Returns true if the given file handle is a stream of remote file
-        manifests, false if it is a file.
+        Returns true if the given binary file handle is a stream of remote
+        file manifests, false if it is a file. Only peeks at the start of the
+        file, so it also works on pipes which cannot seek.
         """
-        line = file_handle.readline().lstrip()
-        file_handle.seek(0)
-        is_json_stream = False
-        if line.startswith('{'):
-            is_json_stream = True
-        return is_json_stream
+        return file_handle.peek(4096).lstrip().startswith(b'{')
 
     @classmethod
     def read_manifest_entries(cls, manifest_filename):
         """
         Read a given filename and yield each entity in the manifest until
         there are no more manifests. Works if the manifest_filename is a stream
-        or a regular file.
+        or a regular file. Entities are yielded as soon as they are parsed, so
+        large manifests are never held in memory at once. Manifests may be
+        compressed with gzip, bzip2, xz or zstd, and '-' reads from stdin.
 
         """
-        with open(manifest_filename, 'r') as manifest:
+        # Imported here so `python -m minid.manifest` runs cleanly
+        from minid.manifest import open_manifest, iter_json_array
+        with open_manifest(manifest_filename) as manifest:
             is_stream = cls._is_stream(manifest)
             log.info('Parsing {} from filename {}'
                      ''.format('stream' if is_stream else 'file',
                                manifest_filename)
                      )
+            text = io.TextIOWrapper(manifest, encoding='utf-8')
+            try:
+                if not is_stream:
+                    yield from iter_json_array(text)
+                    return
+                for entity in text:
+                    if entity.strip():
+                        yield json.loads(entity)
+            finally:
+                # Closing the manifest is left to open_manifest()
+                text.detach()
 
-            # Fetch 'entities' to iterate upon.
-            if not is_stream:
-                entities = json.load(manifest, object_pairs_hook=OrderedDict)
-            else:
-                entities = manifest
-
-            # Iterate over the entities and yield each one until we run out.
-            for entity in entities:
-                if is_stream:
-                    yield json.loads(entity, object_pairs_hook=OrderedDict)
-                else:
-                    yield entity
-
-    def register_rfm(self, rfm_record, test, update_if_exists=False):
+    def register_rfm(self, rfm_record, test, update_if_exists=False,
+                     existing_minid=None, extra_locations=None):
         """
         Register a Minid for a given rfm record. Records will always be
         re-registered unless `update_if_exists` is True.
@@ -401,6 +1020,13 @@ class MinidClient(object):
           ``update_if_exists`` (*bool*) Default False. Attempt to keep an
             existing minid if one exists and the checksum matches. Otherwise
             re-register and replace the existing minid.
+          ``existing_minid`` (*dict*) Default None. The identifier in the
+            record's url, if it has already been looked up with check(), so
+            it is not looked up again.
+          ``extra_locations`` (*list*) Default None. More locations of the
+            same file, such as the urls of duplicate records, which are
+            registered along with the record's url. They are added whether
+            the minid is registered, updated or re-registered.
         ** Returns **
             A dict with 'url' replaced with the registered identifier
         ** Example **
@@ -419,25 +1045,19 @@ class MinidClient(object):
             "filename": "foo.txt"
           }
         """
-        checksums = [{'function': f, 'value': rfm_record.get(f)}
-                     for f in SUPPORTED_CHECKSUMS
-                     if f in rfm_record.keys()]
-        locations = (rfm_record['url']
-                     if isinstance(rfm_record['url'], list)
-                     else [rfm_record['url']]
-                     )
-        is_valid = self.is_valid_identifier(rfm_record['url'])
-        matches_namespace = self.is_test(rfm_record['url']) is test
-        log.debug('{}, URL is minid: {}, matches namespace: {}'
-                  ''.format(rfm_record['url'], is_valid, matches_namespace))
-        if update_if_exists and is_valid and matches_namespace:
-            existing_minid = self.check(rfm_record['url']).data
+        checksums, locations, updatable = self._get_rfm_args(rfm_record, test)
+        locations = locations + [location for location in extra_locations or []
+                                 if location not in locations]
+        if update_if_exists and updatable:
+            if existing_minid is None:
+                existing_minid = self._lookup_rfm(rfm_record)
             # Update the existing minids locations if it exists
             if existing_minid and self.validate_checksums(
                     existing_minid['checksums'], checksums):
                 m_resp = self.update(rfm_record['url'],
                                      title=rfm_record['filename'],
-                                     locations=locations).data
+                                     locations=locations,
+                                     existing=existing_minid).data
                 log.info('Updating existing minid {} for filename {}'
                          ''.format(rfm_record['url'], rfm_record['filename']))
             # Otherwise, re-register and replace the the existing minid
@@ -458,7 +1078,269 @@ class MinidClient(object):
         new_manifest['url'] = m_resp['identifier']
         return new_manifest
 
-    def batch_register(self, manifest_filename, test, update_if_exists=False):
+    @classmethod
+    def _get_rfm_args(cls, rfm_record, test):
+        """Returns the checksums and locations to register for a remote file
+        manifest record, and whether its url is an existing minid in the
+        namespace being registered which may be updated instead."""
+        checksums = [{'function': f, 'value': rfm_record.get(f)}
+                     for f in _supported_checksums()
+                     if f in rfm_record.keys()]
+        locations = (rfm_record['url']
+                     if isinstance(rfm_record['url'], list)
+                     else [rfm_record['url']]
+                     )
+        is_valid = cls.is_valid_identifier(rfm_record['url'])
+        matches_namespace = cls.is_test(rfm_record['url']) is test
+        log.debug('{}, URL is minid: {}, matches namespace: {}'
+                  ''.format(rfm_record['url'], is_valid, matches_namespace))
+        return checksums, locations, is_valid and matches_namespace
+
+    def _lookup_rfm(self, rfm_record):
+        """Returns the existing identifier in the url of a manifest record"""
+        return self.check(rfm_record['url']).data
+
+    def _iter_register_rfm(self, records, test, update_if_exists=False,
+                           max_workers=1, prefetch=None, stats=None):
+        """
+        Call register_rfm() on each record, running up to ``max_workers``
+        registrations at a time. ``records`` yields (record, result,
+        extra_locations) tuples, where a result that is not None has already
+        been registered and is passed through untouched, and extra_locations
+        are given to register_rfm() if there are any. Yields a (record, result, error) tuple for
+        each record in the same order as ``records``, where exactly one of
+        result or error is set. At most 2 * max_workers records are read ahead
+        of the record being yielded, so ``records`` may be arbitrarily large.
+        LoginRequired is raised immediately, since no record can succeed
+        without a login. If ``stats`` is given, the records whose minids were
+        already up to date are counted in its 'unchanged' entry as they are
+        yielded, so concurrent batches on one client are counted separately.
+
+        With update_if_exists, existing identifiers are looked up up to
+        ``prefetch`` records ahead of the records being registered, so
+        registrations do not wait on lookups. Lookups share the registration
+        threads, so no more than ``max_workers`` requests are sent at once
+        and the client's connection pool need only hold ``max_workers``
+        connections. With a single worker, one lookup may run alongside the
+        registration. ``prefetch`` defaults to 2 * max_workers, and 0 looks up
+        each identifier only when its record is registered.
+
+        A record whose url is the same identifier as an earlier record still
+        being registered is not prefetched, and is only registered once the
+        earlier record has finished, so it never sees the identifier as it
+        was before the earlier update.
+        """
+        if prefetch is None:
+            prefetch = max_workers * 2
+        if not update_if_exists:
+            prefetch = 0
+
+        def register(record, lookup=None, extra_locations=None):
+            # Returns the updates this record skipped along with its outcome,
+            # so they are added to stats by the thread consuming the results
+            skipped = self._get_skipped_updates()
+            try:
+                kwargs = {}
+                if lookup is not None:
+                    kwargs['existing_minid'] = lookup.result()
+                if extra_locations:
+                    kwargs['extra_locations'] = extra_locations
+                result = self.register_rfm(record, test,
+                                           update_if_exists=update_if_exists,
+                                           **kwargs)
+                return result, None, self._get_skipped_updates() - skipped
+            except Exception as e:
+                return None, e, self._get_skipped_updates() - skipped
+
+        # Identifiers which records read but not yet yielded will update
+        unfinished = Counter()
+
+        def get_identifier(record, result):
+            if (update_if_exists and result is None and
+                    self._get_rfm_args(record, test)[2]):
+                return record['url']
+            return None
+
+        def check_result(record, identifier, result, error, skipped):
+            if stats is not None and skipped:
+                stats['unchanged'] = stats.get('unchanged', 0) + skipped
+            if identifier is not None:
+                unfinished[identifier] -= 1
+                if not unfinished[identifier]:
+                    del unfinished[identifier]
+            if isinstance(error, LoginRequired):
+                raise error
+            return record, result, error
+
+        def prefetched(lookup_executor):
+            window = deque()
+            for record, result, extra_locations in records:
+                lookup = None
+                identifier = get_identifier(record, result)
+                if identifier is not None:
+                    if lookup_executor is not None and not unfinished[identifier]:
+                        lookup = lookup_executor.submit(self._lookup_rfm, record)
+                    unfinished[identifier] += 1
+                window.append((record, result, extra_locations, lookup,
+                               identifier))
+                if len(window) > prefetch:
+                    yield window.popleft()
+            yield from window
+
+        with contextlib.ExitStack() as stack:
+            executor = stack.enter_context(
+                ThreadPoolExecutor(max_workers=max(max_workers, 1)))
+            # Each lookup is queued before its record's registration, so a
+            # registration waiting on its lookup never blocks the lookup.
+            lookup_executor = executor if prefetch > 0 else None
+            if max_workers <= 1:
+                for (record, result, extra_locations, lookup,
+                     identifier) in prefetched(lookup_executor):
+                    if result is not None:
+                        yield record, result, None
+                    else:
+                        yield check_result(
+                            record, identifier,
+                            *register(record, lookup, extra_locations))
+                return
+
+            pending = deque()
+            for (record, result, extra_locations, lookup,
+                 identifier) in prefetched(lookup_executor):
+                if result is not None:
+                    future = Future()
+                    future.set_result((result, None, 0))
+                else:
+                    # Finish any earlier update of the same identifier first
+                    while identifier is not None and any(
+                            identifier == i for _, i, _ in pending):
+                        earlier, earlier_identifier, done = pending.popleft()
+                        yield check_result(earlier, earlier_identifier,
+                                           *done.result())
+                    future = executor.submit(register, record, lookup,
+                                             extra_locations)
+                pending.append((record, identifier, future))
+                if len(pending) >= max_workers * 2:
+                    record, identifier, future = pending.popleft()
+                    yield check_result(record, identifier, *future.result())
+            while pending:
+                record, identifier, future = pending.popleft()
+                yield check_result(record, identifier, *future.result())
+
+    def iter_batch_register(self, manifest_filename, test,
+                            update_if_exists=False, max_workers=1,
+                            journal=False, resume=False, shard=None,
+                            queue=None, prefetch=None, dedup=False,
+                            stats=None):
+        """
+        Register all entries within a remote file manifest, yielding each
+        record with its 'url' replaced by an identifier as soon as it has
+        been registered. Records are yielded in manifest order, and memory use
+        stays constant regardless of the size of the manifest. See
+        batch_register() for a description of the parameters.
+        ** Raises **
+          BatchRegisterError after the last record has been yielded, if any
+          records failed to register. Failed records are yielded unchanged.
+        """
+        if queue is not None:
+            if shard is not None or resume or dedup:
+                raise MinidException('A work queue cannot be combined with '
+                                     'shard, resume or dedup')
+            self.load_work_queue(queue, manifest_filename, test,
+                                 update_if_exists=update_if_exists)
+            worker_stats = self.work_queue(queue, max_workers=max_workers,
+                                           prefetch=prefetch)
+            if stats is not None:
+                stats.update(worker_stats)
+            yield from self.iter_queue_results(queue)
+            return
+        log.info("Processing batch registrations...")
+        start = datetime.datetime.now()
+        if stats is None:
+            stats = {}
+        stats.update({'registered': 0, 'failed': 0, 'unchanged': 0})
+        errors = []
+        count = 0
+        batch_journal = self.batch_journal if journal or resume else None
+        if shard is not None:
+            self._check_shard(shard)
+            log.info('Registering shard {} of {}'.format(*shard))
+        duplicates, duplicate_urls = {}, {}
+        if dedup:
+            if manifest_filename == '-':
+                raise MinidException('Deduplicating reads the manifest twice, '
+                                     'so it cannot be read from stdin')
+            duplicates, duplicate_urls = self._find_duplicates(
+                manifest_filename, shard=shard)
+        # Identifiers registered for records which have duplicates
+        shared_identifiers = {}
+        if batch_journal and not resume:
+            batch_journal.clear(manifest_filename, shard=shard)
+        # Manifest positions and records read but not yet yielded, since a
+        # shard skips the records of other shards
+        positions = deque()
+
+        def entries():
+            for position, record in self._iter_manifest_shard(
+                    manifest_filename, shard):
+                positions.append((position, record))
+                if position in duplicates:
+                    # Passed through, and given the identifier of the first
+                    # record with the same contents once it is registered
+                    yield record, self.DUPLICATE_RECORD, None
+                    continue
+                result = None
+                if resume:
+                    result = batch_journal.get(manifest_filename, position,
+                                               record, shard=shard)
+                    if result is not None:
+                        log.debug('Replaying record {} ({}) from journal'
+                                  ''.format(position, record.get('filename')))
+                # The first of several records with the same contents is
+                # registered at the locations of them all
+                yield record, result, duplicate_urls.get(position)
+
+        registrations = self._iter_register_rfm(
+            entries(), test, update_if_exists=update_if_exists,
+            max_workers=max_workers, prefetch=prefetch, stats=stats)
+        for _, result, error in registrations:
+            position, record = positions.popleft()
+            count += 1
+            if position in duplicates:
+                first = duplicates.pop(position)
+                if first in shared_identifiers:
+                    result = dict(record, url=shared_identifiers[first])
+                else:
+                    result, error = None, MinidException(
+                        'Record {} with the same contents failed to '
+                        'register'.format(first))
+            elif error is None and position in duplicate_urls:
+                shared_identifiers[position] = result['url']
+            if error is not None:
+                log.error('Failed to register record {} ({}): {}'.format(
+                    position, record.get('filename'), error))
+                errors.append((position, record, error))
+                stats['failed'] += 1
+                result = record
+            else:
+                stats['registered'] += 1
+                if batch_journal:
+                    batch_journal.add(manifest_filename, position, record,
+                                      result, shard=shard)
+            yield result
+        elapsed = datetime.datetime.now() - start
+        log.info("Batch register processed {} entries in {}, skipping {} "
+                 "updates with no changes".format(count, elapsed,
+                                                  stats['unchanged']))
+        if errors:
+            raise BatchRegisterError(
+                '{} of {} records failed to register'.format(len(errors),
+                                                             count),
+                errors=errors)
+
+    def batch_register(self, manifest_filename, test, update_if_exists=False,
+                       max_workers=1, journal=False, resume=False, shard=None,
+                       queue=None, prefetch=None, dedup=False, stats=None):
         """
         Register All entries within a remote file manifest, and replace the
         'url' on each record with an identifier. Existing identifiers will
@@ -479,19 +1361,292 @@ class MinidClient(object):
           ``update_if_exists`` (*bool*) Default False. Attempt to keep an
             existing minid if one exists and the checksum matches. Otherwise
             re-register and replace the existing minid.
+          ``max_workers`` (*int*) Default 1. The number of records to register
+            in parallel. Results are always returned in manifest order.
+          ``journal`` (*bool*) Default False. Record each registered record in
+            the batch journal, so an interrupted batch can later be resumed.
+            Any records journaled by a previous batch of the same manifest are
+            forgotten.
+          ``resume`` (*bool*) Default False. Resume a previous journaled batch
+            of the same manifest. Records registered by the previous batch are
+            not registered again, and their journaled results are returned in
+            their place. Newly registered records are added to the journal.
+          ``shard`` (*tuple*) Default None. An (index, count) pair, to only
+            register the records assigned to shard ``index`` of ``count``, such
+            as (0, 32) on the first of 32 nodes. Records are assigned by
+            get_record_shard(), so every run assigns them the same way. Use
+            merge_shard_results() to combine the results of every shard.
+          ``queue`` (*string*) Default None. Path of a work queue to load the
+            manifest into, which should be on a filesystem shared with every
+            node taking part. Records are registered by this client and by any
+            other workers running work_queue() on the same queue, and the
+            results of every worker are returned. The queue keeps track of
+            finished records itself, so running the batch again with the same
+            queue only registers records which are not yet done.
+          ``prefetch`` (*int*) Default 2 * max_workers. With update_if_exists,
+            how many records ahead to look up existing minids, so each
+            record's lookup has finished by the time it is registered. 0 looks
+            up each minid just before its record is registered.
+          ``dedup`` (*bool*) Default False. Register records with the same
+            supported checksums only once. The first such record is registered
+            with the urls of all of them as its locations, and every one of
+            them is given its identifier. If the first record's url is an
+            existing minid, the other urls are added to its locations when it
+            is updated or re-registered. The manifest is read twice, so it
+            cannot be stdin, and the position of every record with unique
+            contents is held in memory while the batch runs.
+          ``stats`` (*dict*) Default None. If given, set to the number of
+            records 'registered' and 'failed' by this batch, and how many of
+            the registered records were 'unchanged' because their minid was
+            already up to date. The counts are updated as each record is
+            returned. With ``queue``, they are the counts of work_queue() for
+            the records registered by this client.
         ** Returns **
           A list of records with 'url' field replaced with the identifier. See
-          get_or_register_rfm() above for more details.
+          get_or_register_rfm() above for more details. Use
+          iter_batch_register() instead to avoid holding every record in
+          memory.
+        ** Raises **
+          BatchRegisterError if any records failed to register. Records which
+          succeeded are still registered, and the full list of results is
+          available on the exception as ``results``.
         """
-        log.info("Processing batch registrations...")
-        start = datetime.datetime.now()
-        results = [self.register_rfm(record, test,
-                                     update_if_exists=update_if_exists)
-                   for record in self.read_manifest_entries(manifest_filename)]
-        elapsed = datetime.datetime.now() - start
-        log.info("Batch register processed {} entries in {}".format(len(results), elapsed))
+        results = []
+        try:
+            for result in self.iter_batch_register(
+                    manifest_filename, test, update_if_exists=update_if_exists,
+                    max_workers=max_workers, journal=journal, resume=resume,
+                    shard=shard, queue=queue, prefetch=prefetch,
+                    dedup=dedup, stats=stats):
+                results.append(result)
+        except BatchRegisterError as bre:
+            bre.results = results
+            raise
         return results
 
+    def load_work_queue(self, queue_filename, manifest_filename, test,
+                        update_if_exists=False):
+        """
+        Load every record of a manifest into the work queue at
+        ``queue_filename``, along with the options workers should register
+        them with. Records already done in the queue are kept, and failed
+        records are queued again. Returns the number of records in the
+        manifest.
+        """
+        queue = WorkQueue(queue_filename)
+        try:
+            return queue.load(self.read_manifest_entries(manifest_filename),
+                              test=test, update_if_exists=update_if_exists)
+        finally:
+            queue.close()
+
+    def work_queue(self, queue_filename, max_workers=1, lease_seconds=600,
+                   poll_interval=5, prefetch=None):
+        """
+        Register records leased from a work queue loaded by load_work_queue(),
+        until every record in the queue is done or has failed. Any number of
+        workers may work the same queue at once. Once nothing is left to
+        lease, the worker polls every ``poll_interval`` seconds for records
+        whose lease expired before their worker finished them. While it runs,
+        the worker renews its leases every quarter of ``lease_seconds``, so
+        records waiting behind slow or retried requests are not leased to
+        another worker and registered twice.
+        ** Parameters **
+          ``queue_filename`` (*string*) Path to the work queue
+          ``max_workers`` (*int*) The number of records to register in
+            parallel
+          ``lease_seconds`` (*int*) How long a worker which has stopped
+            renewing its leases may hold a record before it is leased to
+            another worker
+          ``poll_interval`` (*int*) Seconds to wait between checks for
+            expired leases
+          ``prefetch`` (*int*) How many records ahead to look up existing
+            minids. See batch_register()
+        ** Returns **
+          A dict with the number of records this worker registered and
+          failed, and how many of the registered records were already up to
+          date so no update was sent
+        """
+        queue = WorkQueue(queue_filename)
+        options = queue.get_options()
+        if not options:
+            raise MinidException('Work queue {} has not been loaded with a '
+                                 'manifest'.format(queue_filename))
+        worker_id = queue.get_worker_id()
+        lease_size = max(max_workers * 2, 10)
+        stats = {'registered': 0, 'failed': 0, 'unchanged': 0}
+        positions = deque()
+        stopped = threading.Event()
+
+        def heartbeat():
+            while not stopped.wait(lease_seconds / 4):
+                try:
+                    queue.renew(worker_id, lease_seconds)
+                except sqlite3.Error as e:
+                    log.warning('Failed to renew leases on queue {}: {}'.format(
+                        queue_filename, e))
+
+        def leased():
+            while True:
+                records = queue.lease(worker_id, lease_size, lease_seconds)
+                if not records:
+                    return
+                for position, record, token in records:
+                    positions.append((position, token))
+                    yield record, None, None
+
+        log.info('Worker {} working queue {}'.format(worker_id, queue_filename))
+        renewer = threading.Thread(target=heartbeat, daemon=True)
+        renewer.start()
+        try:
+            while True:
+                registrations = self._iter_register_rfm(
+                    leased(), options['test'],
+                    update_if_exists=options['update_if_exists'],
+                    max_workers=max_workers, prefetch=prefetch, stats=stats)
+                for record, result, error in registrations:
+                    position, token = positions.popleft()
+                    if error is not None:
+                        log.error('Failed to register record {} ({}): {}'.format(
+                            position, record.get('filename'), error))
+                        if queue.fail(position, token, error):
+                            stats['failed'] += 1
+                    elif queue.complete(position, token, result):
+                        stats['registered'] += 1
+                if queue.is_finished():
+                    break
+                log.debug('Waiting on records leased by other workers')
+                time.sleep(poll_interval)
+        finally:
+            stopped.set()
+            renewer.join()
+            queue.release(worker_id)
+            queue.close()
+        log.info('Worker {} registered {registered} records, {failed} failed, '
+                 '{unchanged} already up to date'.format(worker_id, **stats))
+        return stats
+
+    @staticmethod
+    def iter_queue_results(queue_filename):
+        """
+        Yield the result of every record in a finished work queue, in
+        manifest order. Records which failed are yielded unchanged.
+        ** Raises **
+          BatchRegisterError after the last record has been yielded, if any
+          records failed to register.
+        """
+        errors = []
+        count = 0
+        for position, (record, result, error) in enumerate(
+                WorkQueue(queue_filename).iter_results()):
+            count += 1
+            if result is None:
+                errors.append((position, record, MinidException(
+                    error or 'Record has not been registered')))
+                result = record
+            yield result
+        if errors:
+            raise BatchRegisterError(
+                '{} of {} records failed to register'.format(len(errors),
+                                                             count),
+                errors=errors)
+
+    def _iter_manifest_shard(self, manifest_filename, shard=None):
+        """Yield the (position, record) of each record of the manifest in the
+        given shard, or every record if shard is None"""
+        manifest = self.read_manifest_entries(manifest_filename)
+        for position, record in enumerate(manifest):
+            if shard is None or self.get_record_shard(record, shard[1]) == shard[0]:
+                yield position, record
+
+    @staticmethod
+    def get_content_key(record):
+        """Returns a key which is the same for manifest records with the same
+        supported checksums, or None if the record has no checksums."""
+        checksums = sorted((f, record[f]) for f in _supported_checksums()
+                           if f in record)
+        if not checksums:
+            return None
+        return hashlib.sha256(json.dumps(checksums).encode('utf-8')).digest()
+
+    def _find_duplicates(self, manifest_filename, shard=None):
+        """
+        Find records in a manifest with the same contents as an earlier
+        record. Returns a dict mapping the position of each duplicate to the
+        position of the first record with its contents, and a dict mapping the
+        position of each of those first records to the urls of its duplicates
+        which are not identifiers.
+        """
+        first_positions = {}
+        duplicates, duplicate_urls = {}, {}
+        for position, record in self._iter_manifest_shard(manifest_filename,
+                                                          shard):
+            key = self.get_content_key(record)
+            if key is None:
+                continue
+            first = first_positions.setdefault(key, position)
+            if first == position:
+                continue
+            duplicates[position] = first
+            urls = (record['url'] if isinstance(record['url'], list)
+                    else [record['url']])
+            locations = duplicate_urls.setdefault(first, [])
+            locations.extend(url for url in urls
+                             if not self.is_valid_identifier(url) and
+                             url not in locations)
+        log.info('Found {} records which duplicate the contents of {} others'
+                 ''.format(len(duplicates), len(duplicate_urls)))
+        return duplicates, duplicate_urls
+
+    @staticmethod
+    def _check_shard(shard):
+        index, count = shard
+        if not 0 <= index < count:
+            raise MinidException('Invalid shard {}/{}, the index must be from '
+                                 '0 to {}'.format(index, count, count - 1))
+
+    @classmethod
+    def get_record_shard(cls, record, count):
+        """
+        Returns which of ``count`` shards a manifest record is assigned to. The
+        assignment hashes the record's first supported checksum, or its
+        filename if it has none, so it is the same on every run and every
+        machine, and records with the same contents land on the same shard.
+        """
+        key = next((record[f] for f in _supported_checksums() if f in record),
+                   record.get('filename'))
+        digest = hashlib.sha256(str(key).encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big') % count
+
+    @classmethod
+    def merge_shard_results(cls, manifest_filename, result_filenames):
+        """
+        Yield the registered records from the results of every shard of a
+        manifest, in the order of the original manifest.
+        ** Parameters **
+          ``manifest_filename`` (*string*) The manifest which was sharded
+          ``result_filenames`` (*list*) The results of each shard, in shard
+            order, as written by batch_register in either json or jsonl format.
+            The number of results is the number of shards.
+        ** Raises **
+          MinidException if the results do not match the manifest.
+        """
+        count = len(result_filenames)
+        shards = [cls.read_manifest_entries(f) for f in result_filenames]
+        for position, record in enumerate(cls.read_manifest_entries(manifest_filename)):
+            index = cls.get_record_shard(record, count)
+            result = next(shards[index], None)
+            if result is None or result.get('filename') != record.get('filename'):
+                raise MinidException(
+                    'Record {} ({}) is missing from the results of shard {}, '
+                    '{}'.format(position, record.get('filename'), index,
+                                result_filenames[index]))
+            yield result
+        for index, results in enumerate(shards):
+            if next(results, None) is not None:
+                raise MinidException('Shard results {} have records which are '
+                                     'not in the manifest'.format(result_filenames[index]))
+
     @staticmethod
     def get_algorithm(algorithm_name):
         """
@@ -516,32 +1671,119 @@ class MinidClient(object):
 
         return all(by_key1[alg] == by_key2[alg] for alg in common_algorithms)
 
-    @staticmethod
-    def compute_checksum(file_path, algorithm=None, block_size=65536):
+    @classmethod
+    def get_supported_algorithms(cls):
+        """Returns the names of checksum algorithms which are both supported
+        by the Identifiers Service and available in hashlib."""
+        return [alg for alg in _supported_checksums() if hasattr(hashlib, alg)]
+
+    @classmethod
+    def compute_checksum(cls, file_path, algorithm=None, block_size=None,
+                         cache=None, use_mmap=False, pipeline_depth=0):
+        """
+        Checksum the file at ``file_path`` with the hashlib ``algorithm``
+        object, sha256 by default. If a ChecksumCache is given as ``cache``,
+        the cached checksum is returned if the file has not changed since it
+        was last checksummed. Otherwise the file is read and the result is
+        cached. See ``compute_checksums`` for the remaining parameters.
+        """
         if not algorithm:
             algorithm = hashlib.sha256()
             log.debug("Using hash algorithm: {}".format(algorithm))
+        checksums = cls._compute_checksums(file_path, {algorithm.name: algorithm},
+                                           block_size=block_size, cache=cache,
+                                           use_mmap=use_mmap,
+                                           pipeline_depth=pipeline_depth)
+        return checksums[algorithm.name]
+
+    @classmethod
+    def compute_checksums(cls, file_path, algorithms=('sha256',),
+                          block_size=None, cache=None, use_mmap=False,
+                          pipeline_depth=0):
+        """
+        Checksum the file at ``file_path`` with each of the named
+        ``algorithms``, reading the file only once.
+        ** Parameters **
+          ``file_path`` (*string*)
+          The file to checksum
+          ``algorithms`` (*list of strings*)
+          Names of hashlib algorithms, such as ['md5', 'sha256']
+          ``block_size`` (*int* or *string*)
+          Number of bytes read at a time. Defaults to a size suited to the
+          filesystem, 'auto' measures the fastest size for the filesystem.
+          ``cache`` (*ChecksumCache*)
+          Return cached checksums for unchanged files, and cache new ones.
+          The file is only read if one or more checksums are not cached.
+          ``use_mmap`` (*bool*)
+          Hash large files in place by mapping them into memory.
+          ``pipeline_depth`` (*int*)
+          Read up to this many blocks ahead of hashing, hashing each
+          algorithm on its own thread, so reads and hashing overlap. 2 gives
+          double buffering, 0 reads and hashes in turn.
+        ** Returns **
+        A dict mapping each algorithm name to its checksum
+        """
+        hashers = {name: cls.get_algorithm(name) for name in algorithms}
+        return cls._compute_checksums(file_path, hashers,
+                                      block_size=block_size, cache=cache,
+                                      use_mmap=use_mmap,
+                                      pipeline_depth=pipeline_depth)
+
+    @staticmethod
+    def _compute_checksums(file_path, hashers, block_size=None, cache=None,
+                           use_mmap=False, pipeline_depth=0):
+        """Feed every hashlib object in the ``hashers`` dict from a single read
+        of ``file_path``, and return a dict of their hex digests."""
         if os.path.isdir(file_path):
             raise MinidException(f'Directories are not supported by Minid: {file_path}')
 
-        log.debug('Computing checksum for {} using {}'.format(file_path,
-                                                              algorithm))
+        log.debug('Computing checksum for {} using {}'.format(
+            file_path, ', '.join(str(name) for name in hashers)))
         if not os.path.exists(file_path):
             raise MinidException('File not Found: {}'.format(file_path))
 
+        checksums = {}
+        if cache is not None:
+            file_stat = os.stat(file_path)
+            try:
+                for name in hashers:
+                    checksum = cache.get(file_stat, name)
+                    if checksum is not None:
+                        log.debug('Using cached {} checksum for {}'.format(
+                            name, file_path))
+                        checksums[name] = checksum
+            except (sqlite3.Error, OSError) as e:
+                # The cache only saves time, so checksum the file without it
+                log.warning('Unable to use the checksum cache {}: {}'.format(
+                    cache.filename, e))
+                cache = None
+        hashers = {name: hasher for name, hasher in hashers.items()
+                   if name not in checksums}
+        if not hashers:
+            return checksums
+
         try:
-            with open(os.path.abspath(file_path), 'rb') as open_file:
-                buf = open_file.read(block_size)
-                while len(buf) > 0:
-                    algorithm.update(buf)
-                    buf = open_file.read(block_size)
-            open_file.close()
-            return algorithm.hexdigest()
+            hashing.hash_file(os.path.abspath(file_path),
+                              list(hashers.values()), block_size=block_size,
+                              use_mmap=use_mmap, pipeline_depth=pipeline_depth)
+            computed = {name: hasher.hexdigest()
+                        for name, hasher in hashers.items()}
         except Exception:
             raise MinidException('Unable to checksum file {}'.format(
                 file_path)
             )
 
+        # Only cache the checksums if the file did not change while reading it
+        try:
+            if cache is not None and cache.is_unchanged(file_stat, file_path):
+                for name, checksum in computed.items():
+                    cache.set(file_stat, name, checksum)
+        except (sqlite3.Error, OSError) as e:
+            log.warning('Unable to update the checksum cache {}: {}'.format(
+                cache.filename, e))
+        checksums.update(computed)
+        return checksums
+
     @classmethod
     def is_valid_identifier(cls, identifier):
         """Returns True if the identifier is known and can be resolved by Minid
@@ -555,6 +1797,29 @@ class MinidClient(object):
             return False
         return bool(entity.startswith(cls.PREFIXES['minid']) or entity.startswith(cls.PREFIXES_TEST['minid']))
 
+    @classmethod
+    def _get_prefix_matcher(cls):
+        """
+        Returns a compiled regex matching any known prefix at the start of an
+        identifier, and a dict mapping each prefix to a dict of the prefix to
+        use for each identifier type within the same namespace. Both are built
+        once per class from PREFIXES and PREFIXES_TEST.
+        """
+        matcher = cls.__dict__.get('_prefix_matcher')
+        if matcher is None:
+            translations = {}
+            for prefixes in (cls.PREFIXES, cls.PREFIXES_TEST):
+                for prefix in prefixes.values():
+                    translations[prefix] = prefixes
+            # Try longer prefixes first, so a prefix is never cut short by
+            # another prefix it starts with
+            pattern = re.compile('|'.join(
+                re.escape(prefix) for prefix in
+                sorted(translations, key=len, reverse=True)))
+            matcher = pattern, translations
+            cls._prefix_matcher = matcher
+        return matcher
+
     @classmethod
     def get_identifier_prefix(cls, identifier):
         """Returns the prefix for the given identifier. Checks in both the
@@ -569,16 +1834,16 @@ class MinidClient(object):
           * "hdl:20.500.12633"
           * "hld:20.500.12582"
         """
-        prefixes = (list(cls.PREFIXES.values()) +
-                    list(cls.PREFIXES_TEST.values()))
-        prefix = list(filter(lambda pfx: identifier.startswith(pfx), prefixes))
-        return prefix[0] if prefix else None
+        if not isinstance(identifier, str):
+            return None
+        match = cls._get_prefix_matcher()[0].match(identifier)
+        return match.group() if match else None
 
     @classmethod
     def is_test(cls, identifier):
         """Returns true if the identifier exists within the test namespace"""
-        return any([identifier.startswith(idpx)
-                    for idpx in cls.PREFIXES_TEST.values()])
+        prefix = cls.get_identifier_prefix(identifier)
+        return prefix is not None and prefix in cls.PREFIXES_TEST.values()
 
     @classmethod
     def to_identifier(cls, identifier, identifier_type='hdl'):
@@ -596,16 +1861,43 @@ class MinidClient(object):
           * "hdl:20.500.12633/foobarbaz"
           * "hld:20.500.12582/foobarbaz"
         """
+        return cls.translate_many([identifier], identifier_type)[0]
+
+    @classmethod
+    def translate_many(cls, identifiers, identifier_type='hdl', strict=True):
+        """
+        Translate many identifiers to the same identifier type at once. The
+        prefix lookup is compiled once per class, and only the prefix of each
+        identifier is rewritten.
+        ** Parameters **
+          ``identifiers`` (*iterable of strings*) Minid compatible
+          identifiers, such as minid:foobarbaz
+          ``identifier_type`` (*string*) The type of identifier to translate
+          each identifier to. See PREFIXES for the supported types.
+          ``strict`` (*bool*) Raise UnknownIdentifier for any identifier which
+          is not supported by Minid. If False, they are returned unchanged.
+        ** Returns **
+        A list of translated identifiers, in the same order as
+        ``identifiers``.
+        """
         if identifier_type not in cls.PREFIXES:
             raise UnknownIdentifier(f'Identifier type "{identifier_type}" is not supported by Minid.')
-        prefix = cls.get_identifier_prefix(identifier)
-        if prefix is None:
-            raise UnknownIdentifier(f'Given identifier "{identifier}" is not supported by Minid.')
-        if cls.is_test(identifier):
-            identifier_prefix = cls.PREFIXES_TEST[identifier_type]
-        else:
-            identifier_prefix = cls.PREFIXES[identifier_type]
-        return identifier.replace(prefix, identifier_prefix)
+        pattern, translations = cls._get_prefix_matcher()
+        targets = {prefix: prefixes[identifier_type]
+                   for prefix, prefixes in translations.items()}
+        match = pattern.match
+        translated = []
+        append = translated.append
+        for identifier in identifiers:
+            found = match(identifier) if isinstance(identifier, str) else None
+            if found is None:
+                if strict:
+                    raise UnknownIdentifier(f'Given identifier "{identifier}" is not supported by Minid.')
+                append(identifier)
+            else:
+                end = found.end()
+                append(targets[identifier[:end]] + identifier[end:])
+        return translated
 
     @classmethod
     def to_minid(cls, identifier):
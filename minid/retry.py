@@ -0,0 +1,182 @@
+"""
+Copyright 2016 University of Chicago, University of Southern California
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import time
+import random
+import logging
+import datetime
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class RetryPolicy(object):
+    """
+    Decides which failed requests to the identifiers service are retried, and
+    how long to wait before each retry. Waits grow exponentially with
+    ``backoff`` seconds as the base, up to ``max_backoff``, and are jittered
+    so that many workers throttled at once do not retry in lockstep. A
+    Retry-After sent by the service is always honored, up to
+    ``max_retry_after`` seconds.
+
+    Requests which are safe to repeat, such as lookups and updates, are
+    retried after network errors and transient error responses. Requests
+    which create identifiers are only retried when the service certainly did
+    not act on them, since repeating them could mint duplicate identifiers.
+    """
+    # Responses which may succeed if the same request is sent again
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+    # Responses which mean the service refused the request without acting on
+    # it, so even requests which are not idempotent may be sent again
+    REJECTED_STATUS_CODES = (429,)
+    IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT',
+                                    'DELETE'])
+
+    def __init__(self, max_retries=5, backoff=0.5, max_backoff=30,
+                 max_retry_after=300, jitter=True):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.jitter = jitter
+
+    def is_retryable(self, method, status_code=None, error=None, sent=True):
+        """
+        Returns True if a request which failed may be retried.
+        ** Parameters **
+          ``method`` (*string*)
+          The HTTP method of the request
+          ``status_code`` (*int*)
+          The status of the response, if there was one
+          ``error`` (*Exception*)
+          The network error raised instead of a response, if any
+          ``sent`` (*bool*)
+          False if the error happened before the request reached the service
+        """
+        idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        if error is not None:
+            return idempotent or not sent
+        if idempotent:
+            return status_code in self.RETRY_STATUS_CODES
+        return status_code in self.REJECTED_STATUS_CODES
+
+    def get_delay(self, attempt, retry_after=None):
+        """Returns the number of seconds to wait before retry number
+        ``attempt``, counting from 0. A ``retry_after`` sent by the service
+        takes precedence over the backoff."""
+        if retry_after is not None:
+            return min(max(retry_after, 0), self.max_retry_after)
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return random.uniform(0, delay) if self.jitter else delay
+
+    @staticmethod
+    def parse_retry_after(value):
+        """Returns the number of seconds given by a Retry-After header, which
+        may be a number of seconds or an HTTP date, or None if it is missing
+        or invalid."""
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        import email.utils
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return max((retry_at - now).total_seconds(), 0)
+
+    @staticmethod
+    def is_unsent(error):
+        """Returns True if a requests error happened before the request
+        reached the service"""
+        import requests
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return (isinstance(error, requests.exceptions.ConnectionError) and
+                type(reason).__name__ == 'NewConnectionError')
+
+    def configure_transport(self, transport):
+        """Apply this policy to the RequestsTransport of a Globus SDK client,
+        in place of its own retry rules. Refreshing an expired token is still
+        handled by the transport."""
+        from globus_sdk.transport import RetryCheckResult
+
+        def check(ctx):
+            if ctx.response is not None:
+                method = ctx.response.request.method
+                status_code = ctx.response.status_code
+                if status_code < 400:
+                    return RetryCheckResult.no_decision
+                retryable = self.is_retryable(method, status_code=status_code)
+                retry_after = self.parse_retry_after(
+                    ctx.response.headers.get('Retry-After'))
+            else:
+                request = getattr(ctx.exception, 'request', None)
+                method = getattr(request, 'method', None) or 'POST'
+                retryable = self.is_retryable(
+                    method, error=ctx.exception,
+                    sent=not self.is_unsent(ctx.exception))
+                retry_after = None
+            if not retryable:
+                return RetryCheckResult.do_not_retry
+            ctx.backoff = self.get_delay(ctx.attempt, retry_after)
+            log.debug('Retrying {} request in {:.2f}s (attempt {})'.format(
+                method, ctx.backoff, ctx.attempt + 1))
+            return RetryCheckResult.do_retry
+
+        transport.max_retries = self.max_retries
+        transport.max_sleep = max(self.max_backoff, self.max_retry_after)
+        transport.retry_backoff = lambda ctx: ctx.backoff or 0
+        transport.retry_checks = [
+            transport.default_check_expired_authorization, check]
+
+
+class RateLimiter(object):
+    """
+    A token bucket which allows ``rate`` requests per second on average, and
+    bursts of up to ``burst`` requests at once. It is safe to share between
+    threads, so every worker of a batch draws from the same quota.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(int(self.rate), 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token, and return the number of seconds to wait before the
+        request it allows may be sent. Reservations are queued in order, so
+        callers waiting on an async event loop can sleep without blocking."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,246 @@
+"""
+Copyright 2016 University of Chicago, University of Southern California
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import socket
+import logging
+import itertools
+
+from minid.exc import MinidException
+from minid.database import SQLiteDatabase
+
+log = logging.getLogger(__name__)
+
+
+class WorkQueue(SQLiteDatabase):
+    """
+    An SQLite queue of manifest records to register, shared by any number of
+    worker processes on any number of nodes. Workers lease a few records at a
+    time, and acknowledge each one as it is registered or fails. Records
+    leased by a worker which has stopped are leased again to another worker
+    once their lease expires, so a slow or crashed worker never holds up the
+    batch. Each lease has its own token, which the worker gives when it
+    acknowledges a record, so a worker whose lease expired cannot finish a
+    record now leased to another worker.
+
+    Lease expiry uses wall clock time, so nodes need reasonably synchronized
+    clocks.
+    """
+    PENDING = 'pending'
+    LEASED = 'leased'
+    DONE = 'done'
+    FAILED = 'failed'
+    # Records inserted per statement when loading a manifest
+    LOAD_CHUNK_SIZE = 10000
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS queue_options ('
+        'name TEXT PRIMARY KEY, value TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS queue_manifest ('
+        'fingerprint TEXT PRIMARY KEY)',
+        'CREATE TABLE IF NOT EXISTS work_queue ('
+        'position INTEGER PRIMARY KEY, '
+        'record TEXT NOT NULL, '
+        'status TEXT NOT NULL, '
+        'lease_owner TEXT, '
+        'lease_token TEXT, '
+        'lease_expires REAL, '
+        'attempts INTEGER NOT NULL DEFAULT 0, '
+        'result TEXT, '
+        'error TEXT)',
+        'CREATE INDEX IF NOT EXISTS work_queue_status '
+        'ON work_queue (status, position)',
+    )
+
+    @staticmethod
+    def get_worker_id():
+        """Returns an id for a worker which is unique across nodes"""
+        return '{}:{}:{}'.format(socket.gethostname(), os.getpid(),
+                                 uuid.uuid4().hex[:8])
+
+    def get_options(self):
+        """Returns the options stored when the queue was loaded"""
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT name, value FROM queue_options').fetchall()
+        return {name: json.loads(value) for name, value in rows}
+
+    def load(self, records, **options):
+        """
+        Add each record to the queue, along with the batch ``options`` every
+        worker should use, such as test. Loading the same manifest into the
+        same queue again keeps the records already done, and queues failed
+        records to be registered again.
+        ** Raises **
+          MinidException if the queue was loaded with different options or
+          different records. Nothing is loaded in either case.
+        """
+        existing = self.get_options()
+        if existing and existing != options:
+            raise MinidException('Queue {} was loaded with different options: '
+                                 '{}'.format(self.filename, existing))
+        records = enumerate(records)
+        count = 0
+        fingerprint = hashlib.sha256()
+        with self._lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO queue_options (name, value) '
+                'VALUES (?, ?)',
+                [(name, json.dumps(value)) for name, value in options.items()])
+            while True:
+                chunk = [(position, json.dumps(record), self.PENDING)
+                         for position, record in
+                         itertools.islice(records, self.LOAD_CHUNK_SIZE)]
+                if not chunk:
+                    break
+                for _, record, _ in chunk:
+                    fingerprint.update(record.encode('utf-8') + b'\n')
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO work_queue (position, record, status) '
+                    'VALUES (?, ?, ?)', chunk)
+                count += len(chunk)
+            # Records are kept by position, so loading another manifest
+            # would silently keep the first manifest's records.
+            row = self.connection.execute(
+                'SELECT fingerprint FROM queue_manifest').fetchone()
+            if row is not None and row[0] != fingerprint.hexdigest():
+                raise MinidException('Queue {} was loaded with a different '
+                                     'manifest'.format(self.filename))
+            self.connection.execute(
+                'INSERT OR IGNORE INTO queue_manifest (fingerprint) '
+                'VALUES (?)', (fingerprint.hexdigest(),))
+            self.connection.execute(
+                'UPDATE work_queue SET status = ?, error = NULL WHERE status = ?',
+                (self.PENDING, self.FAILED))
+        log.info('Loaded {} records into queue {}'.format(count, self.filename))
+        return count
+
+    def lease(self, worker_id, count, lease_seconds):
+        """
+        Lease up to ``count`` records to the worker for ``lease_seconds``.
+        Records which are pending, or whose lease has expired, are leased in
+        manifest order. Returns a list of (position, record, token) tuples,
+        which is empty if nothing can be leased right now. The token must be
+        given to acknowledge the record with complete() or fail().
+        """
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self._lock, self.connection:
+            # A single statement, so two workers can never lease one record
+            self.connection.execute(
+                'UPDATE work_queue SET status = ?, lease_owner = ?, '
+                'lease_token = ?, lease_expires = ?, attempts = attempts + 1 '
+                'WHERE position IN (SELECT position FROM work_queue '
+                'WHERE status = ? OR (status = ? AND lease_expires < ?) '
+                'ORDER BY position LIMIT ?)',
+                (self.LEASED, worker_id, token, now + lease_seconds,
+                 self.PENDING, self.LEASED, now, count))
+            rows = self.connection.execute(
+                'SELECT position, record, attempts FROM work_queue '
+                'WHERE lease_token = ? ORDER BY position', (token,)).fetchall()
+        for position, _, attempts in rows:
+            if attempts > 1:
+                log.warning('Leasing record {} again after an expired lease'
+                            ''.format(position))
+        return [(position, json.loads(record), token)
+                for position, record, _ in rows]
+
+    def complete(self, position, token, result):
+        """Acknowledge the record at ``position``, leased with ``token``, was
+        registered. Returns False, and the acknowledgement is ignored, if the
+        lease expired and the record has since been leased again."""
+        return self._acknowledge(position, token, self.DONE,
+                                 result=json.dumps(result))
+
+    def fail(self, position, token, error):
+        """Acknowledge the record at ``position``, leased with ``token``,
+        failed to register. Returns False, and the acknowledgement is
+        ignored, if the lease expired and the record has since been leased
+        again."""
+        return self._acknowledge(position, token, self.FAILED,
+                                 error=str(error))
+
+    def _acknowledge(self, position, token, status, result=None, error=None):
+        with self._lock, self.connection:
+            cursor = self.connection.execute(
+                'UPDATE work_queue SET status = ?, result = ?, error = ?, '
+                'lease_owner = NULL, lease_token = NULL '
+                'WHERE position = ? AND status = ? AND lease_token = ?',
+                (status, result, error, position, self.LEASED, token))
+        if cursor.rowcount == 0:
+            log.warning('Ignoring result of record {}, its lease expired and '
+                        'it was leased again'.format(position))
+            return False
+        return True
+
+    def renew(self, worker_id, lease_seconds):
+        """Extend every lease still held by the worker by ``lease_seconds``
+        from now, so a live worker keeps records it is waiting to register.
+        Returns the number of records renewed."""
+        with self._lock, self.connection:
+            cursor = self.connection.execute(
+                'UPDATE work_queue SET lease_expires = ? '
+                'WHERE status = ? AND lease_owner = ?',
+                (time.time() + lease_seconds, self.LEASED, worker_id))
+        return cursor.rowcount
+
+    def release(self, worker_id):
+        """Return every record still leased by the worker to the queue, so
+        other workers need not wait for the leases to expire."""
+        with self._lock, self.connection:
+            self.connection.execute(
+                'UPDATE work_queue SET status = ?, lease_owner = NULL, '
+                'lease_token = NULL WHERE status = ? AND lease_owner = ?',
+                (self.PENDING, self.LEASED, worker_id))
+
+    def get_counts(self):
+        """Returns the number of records with each status"""
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT status, COUNT(*) FROM work_queue GROUP BY status'
+            ).fetchall()
+        counts = {status: 0 for status in (self.PENDING, self.LEASED,
+                                           self.DONE, self.FAILED)}
+        counts.update(rows)
+        return counts
+
+    def is_finished(self):
+        """Returns True once every record is done or has failed"""
+        counts = self.get_counts()
+        return counts[self.PENDING] == 0 and counts[self.LEASED] == 0
+
+    def iter_results(self):
+        """
+        Yield a (record, result, error) tuple for every record in manifest
+        order. Exactly one of result or error is set for finished records,
+        and neither is set for records which are not yet finished.
+        """
+        # A separate cursor and connection, so workers sharing this queue
+        # object are not blocked while results are read
+        connection = self.connect()
+        try:
+            rows = connection.execute(
+                'SELECT record, result, error FROM work_queue '
+                'ORDER BY position')
+            for record, result, error in rows:
+                yield (json.loads(record),
+                       json.loads(result) if result is not None else None,
+                       error)
+        finally:
+            connection.close()
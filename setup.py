@@ -28,6 +28,10 @@ setup(
     author="FAIR Research Team",
     packages=find_packages(),
     install_requires=install_requires,
+    extras_require={
+        'async': ['httpx'],
+        'zstd': ['zstandard'],
+    },
     license='Apache 2.0',
     entry_points={
         'console_scripts': [
@@ -1,8 +1,9 @@
 import pytest
 import os
 import json
+import time
 
-from unittest.mock import Mock, mock_open, patch
+from unittest.mock import Mock
 
 import fair_research_login
 import globus_sdk
@@ -24,7 +25,11 @@ def mock_fair_research_login(monkeypatch):
     monkeypatch.setattr(fair_research_login.NativeClient, 'load_tokens', load_mock)
     auths = {name: globus_sdk.AccessTokenAuthorizer(token) for name, token in tokens.items()}
     monkeypatch.setattr(fair_research_login.NativeClient, 'get_authorizers', Mock(return_value=auths))
-    monkeypatch.setattr(fair_research_login.NativeClient, 'get_authorizers_by_scope', Mock(return_value=auths))
+    token_groups = {name: {'access_token': token, 'expires_at_seconds': int(time.time()) + 3600}
+                    for name, token in tokens.items()}
+    monkeypatch.setattr(fair_research_login.NativeClient, 'load_tokens_by_scope', Mock(return_value=token_groups))
+    monkeypatch.setattr(fair_research_login.NativeClient, 'get_authorizer',
+                        Mock(side_effect=lambda group: globus_sdk.AccessTokenAuthorizer(group['access_token'])))
     return fair_research_login.NativeClient
 
 
@@ -45,6 +50,12 @@ def logged_out(monkeypatch):
     return mock_load
 
 
+@pytest.fixture
+def mock_config_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(minid.MinidClient, 'CONFIG', str(tmp_path / 'minid-config.cfg'))
+    return tmp_path
+
+
 @pytest.fixture
 def mock_cli(monkeypatch, mock_identifiers_client):
     cli = Mock()
@@ -127,6 +138,9 @@ def mock_gcs_get_by_checksum(mock_identifiers_client, mock_globus_response):
 def mocked_checksum(monkeypatch):
     mock_cc = Mock(return_value='mock_checksum')
     monkeypatch.setattr(minid.MinidClient, 'compute_checksum', mock_cc)
+    mock_ccs = Mock(side_effect=lambda path, algorithms=('sha256',), **kwargs: {
+        alg: 'mock_checksum' for alg in algorithms})
+    monkeypatch.setattr(minid.MinidClient, 'compute_checksums', mock_ccs)
     return mock_cc
 
 
@@ -157,8 +171,8 @@ def mock_globus_response():
     return MockGlobusSDKResponse
 
 
-@pytest.yield_fixture
-def mock_streamed_rfm(mock_rfm):
-    text = '\n'.join([json.dumps(rfm) for rfm in mock_rfm])
-    with patch('builtins.open', mock_open(read_data=text)) as mocked_open:
-        yield mocked_open
+@pytest.fixture
+def mock_streamed_rfm(mock_rfm, tmp_path):
+    streamed_rfm = tmp_path / 'rfm.jsonl'
+    streamed_rfm.write_text('\n'.join([json.dumps(rfm) for rfm in mock_rfm]))
+    return str(streamed_rfm)
@@ -0,0 +1,242 @@
+import pytest
+import asyncio
+import json
+import os
+import threading
+
+import globus_sdk
+
+from minid.minid import MinidClient
+from minid.cache import ResponseCache
+from minid.async_client import AsyncMinidClient
+from fair_identifiers_client.identifiers_api import IdentifierClientError
+from minid.retry import RetryPolicy
+from minid.exc import (BatchRegisterError, LoginRequired,
+                       IdentifierServiceError)
+
+httpx = pytest.importorskip('httpx')
+
+FILES_DIR = os.path.join(os.path.dirname(__file__), 'files')
+TEST_CHECKSUM_FILE = os.path.join(FILES_DIR, 'test_compute_checksum.txt')
+TEST_CHECKSUM_VALUE = ('5994471abb01112afcc18159f6cc74b4'
+                       'f511b99806da59b3caf5a9c173cacfc5')
+TEST_RFM = os.path.join(FILES_DIR, 'mock_remote_file_manifest.json')
+
+
+class MockService(object):
+    """Stands in for the identifiers service, recording each request"""
+
+    def __init__(self, status_code=200, fail_paths=()):
+        self.requests = []
+        self.status_code = status_code
+        self.fail_paths = fail_paths
+
+    def __call__(self, request):
+        body = json.loads(request.content) if request.content else None
+        self.requests.append((request.method, request.url.path, body,
+                              request.headers.get('Authorization')))
+        if any(p in request.url.path for p in self.fail_paths):
+            return httpx.Response(500, json={'message': 'Mock failure'})
+        if request.method == 'GET':
+            return httpx.Response(self.status_code, json={
+                'identifier': request.url.path.lstrip('/'),
+                'checksums': [{'function': 'sha256', 'value': 'mock'}],
+            })
+        return httpx.Response(self.status_code, json={
+            'identifier': 'hdl:20.500.12633/{}'.format(len(self.requests)),
+            'metadata': (body or {}).get('metadata', {}),
+        })
+
+
+@pytest.fixture
+def service():
+    return MockService()
+
+
+@pytest.fixture
+def async_client(mock_config_dir, service):
+    return AsyncMinidClient(client=MinidClient(),
+                            transport=httpx.MockTransport(service))
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_async_register(logged_in, async_client, service):
+    checksums = [{'function': 'sha256', 'value': 'mock_checksum'}]
+
+    async def register():
+        async with async_client:
+            return await async_client.register(checksums, title='foo.txt',
+                                               test=True)
+
+    response = run(register())
+    assert response['identifier'] == 'hdl:20.500.12633/1'
+    method, path, body, authorization = service.requests[0]
+    assert method == 'POST'
+    assert path == '/namespace/minid-test/identifier'
+    assert body == {'checksums': checksums, 'metadata': {'title': 'foo.txt'},
+                    'location': [], 'visible_to': ['public']}
+    assert authorization == 'Bearer mock_identifiers'
+
+
+def test_async_register_file(logged_in, async_client, service):
+    response = run(async_client.register_file(TEST_CHECKSUM_FILE))
+    body = service.requests[0][2]
+    assert body['checksums'] == [{'function': 'sha256',
+                                  'value': TEST_CHECKSUM_VALUE}]
+    assert body['metadata']['created_by'] == 'test_user@example.com'
+    assert response['metadata']['title'] == TEST_CHECKSUM_FILE
+
+
+def test_async_register_requires_login(logged_out, async_client, service):
+    with pytest.raises(LoginRequired):
+        run(async_client.register([]))
+    assert service.requests == []
+
+
+def test_async_update_sends_nullable_fields(logged_in, async_client, service):
+    run(async_client.update('hdl:20.500.12633/foo', replaces=None,
+                            locations=['https://example.com/foo']))
+    method, path, body, _ = service.requests[0]
+    assert method == 'PUT'
+    assert path == '/hdl:20.500.12633/foo'
+    assert body == {'metadata': {}, 'replaces': None,
+                    'location': ['https://example.com/foo']}
+
+
+def test_async_update_skips_unchanged(logged_in, async_client, service):
+    existing = {'identifier': 'hdl:20.500.12633/foo', 'metadata': {'title': 'foo.txt'},
+                'location': ['https://example.com/foo']}
+    response = run(async_client.update('hdl:20.500.12633/foo', title='foo.txt',
+                                       locations=['https://example.com/foo'], existing=existing))
+    assert response.data == existing
+    assert service.requests == []
+    run(async_client.update('hdl:20.500.12633/foo', title='bar.txt', existing=existing))
+    assert service.requests[0][2] == {'metadata': {'title': 'bar.txt'}}
+
+
+def test_async_check_identifier_uses_response_cache(logged_in, service,
+                                                    mock_config_dir):
+    client = AsyncMinidClient(transport=httpx.MockTransport(service),
+                              response_cache=True)
+
+    async def check_twice():
+        await client.check('hdl:20.500.12633/foo')
+        return await client.check('minid.test:foo')
+
+    response = run(check_twice())
+    assert response['identifier'] == 'hdl:20.500.12633/foo'
+    assert len(service.requests) == 1
+
+
+def test_async_blocking_calls_leave_event_loop(logged_in, service, mock_config_dir, monkeypatch):
+    threads = []
+
+    def off_loop(func):
+        def wrapper(*args, **kwargs):
+            threads.append(threading.get_ident())
+            return func(*args, **kwargs)
+        return wrapper
+
+    authorizer = MinidClient.authorizer
+    monkeypatch.setattr(MinidClient, 'authorizer', property(off_loop(authorizer.fget), authorizer.fset))
+    monkeypatch.setattr(MinidClient, 'is_logged_in', off_loop(MinidClient.is_logged_in))
+    monkeypatch.setattr(globus_sdk.AccessTokenAuthorizer, 'get_authorization_header',
+                        off_loop(globus_sdk.AccessTokenAuthorizer.get_authorization_header))
+    for name in ('get', 'set', 'invalidate'):
+        monkeypatch.setattr(ResponseCache, name, off_loop(getattr(ResponseCache, name)))
+    response_cache = ResponseCache(str(mock_config_dir / ResponseCache.FILENAME))
+    client = AsyncMinidClient(transport=httpx.MockTransport(service), response_cache=response_cache)
+
+    async def check_and_update():
+        await client.check('hdl:20.500.12633/foo')
+        await client.update('hdl:20.500.12633/foo', title='foo.txt')
+        return threading.get_ident()
+
+    loop_thread = run(check_and_update())
+    assert len(threads) > 4
+    assert loop_thread not in threads
+
+
+def test_async_check_file(logged_in, async_client, service):
+    run(async_client.check(TEST_CHECKSUM_FILE))
+    assert service.requests[0][1] == '/checksum/' + TEST_CHECKSUM_VALUE
+
+
+def test_async_service_error(logged_in, mock_config_dir):
+    service = MockService(status_code=404)
+    client = AsyncMinidClient(transport=httpx.MockTransport(service))
+    with pytest.raises(IdentifierServiceError) as exc_info:
+        run(client.check('hdl:20.500.12633/foo'))
+    assert exc_info.value.http_status == 404
+    # The same error type as the MinidClient raises
+    assert isinstance(exc_info.value, IdentifierClientError)
+    assert 'failed (404)' in str(exc_info.value)
+
+
+def test_async_register_files(logged_in, async_client, service):
+    filenames = [TEST_CHECKSUM_FILE] * 5
+    results = run(async_client.register_files(filenames, jobs=2))
+    assert [filename for filename, _ in results] == filenames
+    assert len(service.requests) == 5
+
+
+def test_async_batch_register_keeps_manifest_order(logged_in, async_client,
+                                                   service):
+    results = run(async_client.batch_register(TEST_RFM, True, max_workers=4))
+    assert [r['filename'] for r in results] == ['foo.txt', 'bar.txt']
+    assert all(r['url'].startswith('hdl:20.500.12633/') for r in results)
+
+
+def test_async_batch_register_reads_manifest_off_event_loop(logged_in, async_client, service, monkeypatch):
+    read_manifest_entries, threads = MinidClient.read_manifest_entries, []
+
+    def read_entries(manifest_filename):
+        for record in read_manifest_entries(manifest_filename):
+            threads.append(threading.get_ident())
+            yield record
+
+    async def batch_register():
+        results = await async_client.batch_register(TEST_RFM, True)
+        return results, threading.get_ident()
+
+    monkeypatch.setattr(MinidClient, 'read_manifest_entries', staticmethod(read_entries))
+    monkeypatch.setattr(AsyncMinidClient, 'READ_BATCH_SIZE', 1)
+    results, loop_thread = run(batch_register())
+    assert [r['filename'] for r in results] == ['foo.txt', 'bar.txt']
+    assert len(threads) == 2
+    assert loop_thread not in threads
+
+
+def test_async_batch_register_collects_failures(logged_in, mock_config_dir):
+    service = MockService(fail_paths=['minid-test'])
+    client = AsyncMinidClient(transport=httpx.MockTransport(service))
+    with pytest.raises(BatchRegisterError) as exc_info:
+        run(client.batch_register(TEST_RFM, True))
+    assert len(exc_info.value.errors) == 2
+    assert [r['url'] for r in exc_info.value.results] == [
+        'https://example.com/foo.txt', 'https://example.com/bar.txt']
+
+
+def test_async_retries_throttled_requests(logged_in, mock_config_dir):
+    responses = [httpx.Response(429, headers={'Retry-After': '0'}),
+                 httpx.Response(200, json={'identifier': 'hdl:20.500.12633/1'})]
+    client = AsyncMinidClient(
+        transport=httpx.MockTransport(lambda request: responses.pop(0)))
+    response = run(client.register([], test=True))
+    assert response['identifier'] == 'hdl:20.500.12633/1'
+    assert responses == []
+
+
+def test_async_does_not_retry_ambiguous_create(logged_in, mock_config_dir):
+    service = MockService(status_code=502)
+    client = AsyncMinidClient(transport=httpx.MockTransport(service),
+                              retry_policy=RetryPolicy(backoff=0))
+    with pytest.raises(IdentifierServiceError):
+        run(client.register([], test=True))
+    assert len(service.requests) == 1
+    with pytest.raises(IdentifierServiceError):
+        run(client.check('hdl:20.500.12633/foo'))
+    assert len(service.requests) == 1 + 1 + RetryPolicy().max_retries
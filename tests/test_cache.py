@@ -0,0 +1,199 @@
+import os
+import sys
+import time
+import subprocess
+import builtins
+import pytest
+from unittest.mock import Mock
+
+from minid.cache import ChecksumCache, ResponseCache, CachedResponse
+from minid.minid import MinidClient
+
+FILES_DIR = os.path.join(os.path.dirname(__file__), 'files')
+TEST_CHECKSUM_FILE = os.path.join(FILES_DIR, 'test_compute_checksum.txt')
+TEST_CHECKSUM_VALUE = ('5994471abb01112afcc18159f6cc74b4'
+                       'f511b99806da59b3caf5a9c173cacfc5')
+
+
+def test_checksum_cache_miss(tmp_path):
+    cache = ChecksumCache(str(tmp_path / 'cache.sqlite'))
+    assert cache.get(os.stat(TEST_CHECKSUM_FILE), 'sha256') is None
+
+
+def test_checksum_cache_set_get(tmp_path):
+    cache = ChecksumCache(str(tmp_path / 'cache.sqlite'))
+    file_stat = os.stat(TEST_CHECKSUM_FILE)
+    cache.set(file_stat, 'sha256', 'mock_checksum')
+    assert cache.get(file_stat, 'sha256') == 'mock_checksum'
+    assert cache.get(file_stat, 'md5') is None
+
+
+def test_checksum_cache_shared_between_instances(tmp_path):
+    filename = str(tmp_path / 'cache.sqlite')
+    file_stat = os.stat(TEST_CHECKSUM_FILE)
+    ChecksumCache(filename).set(file_stat, 'sha256', 'mock_checksum')
+    assert ChecksumCache(filename).get(file_stat, 'sha256') == 'mock_checksum'
+
+
+def test_checksum_cache_misses_modified_file(tmp_path):
+    cache = ChecksumCache(str(tmp_path / 'cache.sqlite'))
+    tmp_file = tmp_path / 'foo.txt'
+    tmp_file.write_text('foo')
+    cache.set(os.stat(str(tmp_file)), 'sha256', 'mock_checksum')
+    os.utime(str(tmp_file), ns=(0, 0))
+    assert cache.get(os.stat(str(tmp_file)), 'sha256') is None
+
+
+def test_checksum_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(time, 'time', Mock(side_effect=range(100)))
+    cache = ChecksumCache(str(tmp_path / 'cache.sqlite'), max_entries=2)
+    file_stat = os.stat(TEST_CHECKSUM_FILE)
+    cache.set(file_stat, 'md5', 'md5_checksum')
+    cache.set(file_stat, 'sha1', 'sha1_checksum')
+    cache.get(file_stat, 'md5')
+    cache.set(file_stat, 'sha256', 'sha256_checksum')
+    assert cache.get(file_stat, 'sha1') is None
+    assert cache.get(file_stat, 'md5') == 'md5_checksum'
+    assert cache.get(file_stat, 'sha256') == 'sha256_checksum'
+
+
+def test_checksum_cache_evicts_periodically(tmp_path):
+    cache = ChecksumCache(str(tmp_path / 'cache.sqlite'), max_entries=20)
+    count = 'SELECT COUNT(*) FROM checksums'
+    for number in range(22):
+        cache.set(os.stat(TEST_CHECKSUM_FILE), str(number), 'mock_checksum')
+    assert cache.connection.execute(count).fetchone()[0] == 22
+    cache.set(os.stat(TEST_CHECKSUM_FILE), '22', 'mock_checksum')
+    assert cache.connection.execute(count).fetchone()[0] == 20
+
+
+def test_checksum_cache_evicts_across_instances(tmp_path):
+    filename = str(tmp_path / 'cache.sqlite')
+    for number in range(30):
+        cache = ChecksumCache(filename, max_entries=10)
+        cache.set(os.stat(TEST_CHECKSUM_FILE), str(number), 'mock_checksum')
+        cache.close()
+    rows = ChecksumCache(filename).connection.execute('SELECT COUNT(*) FROM checksums').fetchone()[0]
+    assert rows <= 11
+
+
+def test_checksum_cache_writes_last_used_on_close(tmp_path, monkeypatch):
+    monkeypatch.setattr(time, 'time', Mock(side_effect=range(100)))
+    filename = str(tmp_path / 'cache.sqlite')
+    file_stat = os.stat(TEST_CHECKSUM_FILE)
+    cache = ChecksumCache(filename)
+    cache.set(file_stat, 'sha256', 'mock_checksum')
+    cache.get(file_stat, 'sha256')
+    query = 'SELECT last_used FROM checksums'
+    assert ChecksumCache(filename).connection.execute(query).fetchone() == (0,)
+    cache.close()
+    assert ChecksumCache(filename).connection.execute(query).fetchone() == (1,)
+
+
+def test_checksum_cache_writes_last_used_at_exit(tmp_path):
+    filename = str(tmp_path / 'cache.sqlite')
+    file_stat = os.stat(TEST_CHECKSUM_FILE)
+    ChecksumCache(filename).set(file_stat, 'sha256', 'mock_checksum')
+    query = 'SELECT last_used FROM checksums'
+    cached = ChecksumCache(filename).connection.execute(query).fetchone()[0]
+    script = ('import os, sys; from minid.cache import ChecksumCache; '
+              'ChecksumCache(sys.argv[1]).get(os.stat(sys.argv[2]), "sha256")')
+    subprocess.run([sys.executable, '-c', script, filename, TEST_CHECKSUM_FILE], check=True)
+    assert ChecksumCache(filename).connection.execute(query).fetchone()[0] > cached
+
+
+def test_compute_checksum_uses_cache(tmp_path, monkeypatch):
+    cache = ChecksumCache(str(tmp_path / 'cache.sqlite'))
+    assert MinidClient.compute_checksum(TEST_CHECKSUM_FILE, cache=cache) == TEST_CHECKSUM_VALUE
+    monkeypatch.setattr(builtins, 'open', Mock(side_effect=AssertionError('File was read')))
+    assert MinidClient.compute_checksum(TEST_CHECKSUM_FILE, cache=cache) == TEST_CHECKSUM_VALUE
+
+
+@pytest.mark.parametrize('cache_path', ['cache_dir', 'missing/parent/cache.sqlite'])
+def test_compute_checksum_without_usable_cache(tmp_path, cache_path):
+    # A directory in place of the database, or a parent which can't be made
+    (tmp_path / 'cache_dir').mkdir()
+    cache = ChecksumCache(str(tmp_path / cache_path))
+    assert MinidClient.compute_checksum(TEST_CHECKSUM_FILE, cache=cache) == TEST_CHECKSUM_VALUE
+
+
+def test_client_checksum_cache(mock_config_dir):
+    assert MinidClient().checksum_cache is None
+    cache = MinidClient(checksum_cache=True).checksum_cache
+    assert cache.filename == str(mock_config_dir / ChecksumCache.FILENAME)
+
+
+def mock_response(data):
+    return CachedResponse(data)
+
+
+def test_response_cache_get_set():
+    cache = ResponseCache()
+    assert cache.get('identifier:foo') is None
+    response = mock_response({'identifier': 'foo'})
+    cache.set('identifier:foo', response)
+    assert cache.get('identifier:foo') is response
+
+
+def test_response_cache_expires(monkeypatch):
+    now = [1000]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    cache = ResponseCache(ttl=10)
+    cache.set('identifier:foo', mock_response({}))
+    cache.set('identifier:bar', mock_response({}), ttl=100)
+    now[0] += 11
+    assert cache.get('identifier:foo') is None
+    assert cache.get('identifier:bar') is not None
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    cache.set('a', mock_response({}))
+    cache.set('b', mock_response({}))
+    cache.get('a')
+    cache.set('c', mock_response({}))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+
+def test_response_cache_disk_tier(tmp_path):
+    filename = str(tmp_path / 'responses.sqlite')
+    ResponseCache(filename).set('identifier:foo', mock_response({'identifier': 'foo'}))
+    response = ResponseCache(filename).get('identifier:foo')
+    assert response.data == {'identifier': 'foo'}
+    assert response['identifier'] == 'foo'
+
+
+@pytest.mark.parametrize('filename', [None, 'responses.sqlite'])
+def test_response_cache_invalidate(tmp_path, filename):
+    cache = ResponseCache(filename and str(tmp_path / filename))
+    for key in ['identifier:foo', 'checksum:sha256:a', 'checksum:md5:b']:
+        cache.set(key, mock_response({}))
+    cache.invalidate('checksum:*')
+    assert cache.get('checksum:sha256:a') is None
+    assert cache.get('checksum:md5:b') is None
+    assert cache.get('identifier:foo') is not None
+    cache.invalidate('identifier:foo')
+    assert cache.get('identifier:foo') is None
+
+
+def test_client_check_uses_response_cache(mock_identifiers_client):
+    cli = MinidClient(response_cache=True)
+    cli.check('hdl:20.500.12633/mock-hdl')
+    cli.check('minid.test:mock-hdl')
+    assert mock_identifiers_client.get_identifier.call_count == 1
+    cli.check(TEST_CHECKSUM_FILE)
+    cli.check(TEST_CHECKSUM_FILE)
+    assert mock_identifiers_client.get_identifier_by_checksum.call_count == 1
+
+
+def test_client_update_invalidates_response_cache(mock_identifiers_client, logged_in):
+    cli = MinidClient(response_cache=True)
+    cli.check('hdl:20.500.12633/mock-hdl')
+    cli.check(TEST_CHECKSUM_FILE)
+    cli.update('hdl:20.500.12633/mock-hdl', title='foo.txt')
+    cli.check('hdl:20.500.12633/mock-hdl')
+    cli.check(TEST_CHECKSUM_FILE)
+    assert mock_identifiers_client.get_identifier.call_count == 2
+    assert mock_identifiers_client.get_identifier_by_checksum.call_count == 2
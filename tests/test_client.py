@@ -1,10 +1,21 @@
 import pytest
+import gzip
+import importlib
+import io
+import json
 import hashlib
 import os
 import sys
+import time
+import threading
+import globus_sdk
 import fair_research_login
+from concurrent.futures import ThreadPoolExecutor
+from fair_identifiers_client import identifiers_api
+from fair_identifiers_client.identifiers_api import IdentifierClientError
 from minid.minid import MinidClient
-from minid.exc import MinidException
+from minid.cache import ChecksumCache
+from minid.exc import MinidException, BatchRegisterError, LoginRequired
 
 from unittest.mock import Mock, call
 
@@ -19,9 +30,18 @@ def test_load_logged_out_authorizer(logged_out):
     assert MinidClient().identifiers_client.authorizer is None
 
 
+def mock_tokens(mc, authorizer, expires_in=3600):
+    """Have a mock native client load ``authorizer`` for the identifiers
+    service, with an access token expiring in ``expires_in`` seconds"""
+    load = mc.native_client.load_tokens_by_scope
+    load.return_value = {MinidClient.SCOPES[0]: {'expires_at_seconds': int(time.time()) + expires_in}}
+    mc.native_client.get_authorizer.return_value = authorizer
+    return load
+
+
 def test_is_logged_in(monkeypatch):
     mc = MinidClient()
-    monkeypatch.setattr(mc.native_client, 'get_authorizers_by_scope',
+    monkeypatch.setattr(mc.native_client, 'load_tokens_by_scope',
                         Mock(side_effect=fair_research_login.LoadError()))
     mc._authorizer = None
     assert mc.is_logged_in() is False
@@ -29,12 +49,101 @@ def test_is_logged_in(monkeypatch):
     assert mc.is_logged_in() is True
 
 
-def test_client_creates_config_dir_if_not_exists(monkeypatch):
+def test_authorizer_loaded_once(mock_config_dir, monkeypatch):
+    mc = MinidClient(native_client=Mock())
+    load = mock_tokens(mc, globus_sdk.AccessTokenAuthorizer('token'))
+    for _ in range(10):
+        mc.is_logged_in()
+    assert load.call_count == 1
+
+
+def test_authorizer_reloaded_after_ttl(mock_config_dir, monkeypatch):
+    mc = MinidClient(native_client=Mock())
+    load = mock_tokens(mc, globus_sdk.AccessTokenAuthorizer('token'))
+    mc.authorizer
+    monotonic = time.monotonic() + MinidClient.AUTHORIZER_CACHE_TTL + 1
+    monkeypatch.setattr(time, 'monotonic', lambda: monotonic)
+    mc.authorizer
+    assert load.call_count == 2
+
+
+def test_authorizer_reloaded_when_token_expires(mock_config_dir, monkeypatch):
+    mc = MinidClient(native_client=Mock())
+    load = mock_tokens(mc, globus_sdk.AccessTokenAuthorizer('token'), expires_in=60)
+    mc.authorizer
+    monotonic = time.monotonic() + 61
+    monkeypatch.setattr(time, 'monotonic', lambda: monotonic)
+    mc.authorizer
+    assert load.call_count == 2
+
+
+def test_refresh_token_authorizer_kept_until_logout(mock_config_dir, monkeypatch):
+    mc = MinidClient(native_client=Mock())
+    authorizer = Mock(spec=globus_sdk.RefreshTokenAuthorizer)
+    load = mock_tokens(mc, authorizer)
+    assert mc.authorizer is authorizer
+    monotonic = time.monotonic() + MinidClient.AUTHORIZER_CACHE_TTL + 1
+    monkeypatch.setattr(time, 'monotonic', lambda: monotonic)
+    assert mc.authorizer is authorizer
+    assert load.call_count == 1
+    mc.logout()
+    mc.authorizer
+    assert load.call_count == 2
+
+
+def test_login_clears_authorizer(mock_config_dir):
+    mc = MinidClient(native_client=Mock())
+    load = mock_tokens(mc, globus_sdk.AccessTokenAuthorizer('token'))
+    mc.identifiers_client
+    mc.login()
+    mc.identifiers_client
+    assert load.call_count == 2
+
+
+def test_identifiers_client_built_once_across_threads(logged_out, monkeypatch):
+    mc = MinidClient()
+    build = Mock(wraps=identifiers_api.IdentifierClient)
+    monkeypatch.setattr(identifiers_api, 'IdentifierClient', build)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(executor.map(lambda _: mc.identifiers_client, range(32)))
+    assert build.call_count == 1
+    assert all(client is clients[0] for client in clients)
+
+
+def test_identifiers_client_connection_pool_size(logged_out):
+    mc = MinidClient(pool_size=32)
+    adapter = mc.identifiers_client.transport.session.get_adapter(mc.base_url)
+    assert adapter._pool_maxsize == 32
+
+
+def test_client_creates_config_dir_on_login(monkeypatch):
     mkdir = Mock()
     monkeypatch.setattr(os, 'mkdir', mkdir)
     monkeypatch.setattr(os.path, 'exists', Mock(return_value=False))
-    MinidClient()
+    mc = MinidClient(native_client=Mock())
+    assert not mkdir.called
+    mc.login()
     assert mkdir.called
+    assert mc.native_client.login.called
+
+
+def test_client_construction_has_no_side_effects(monkeypatch, tmp_path):
+    native_client = Mock()
+    monkeypatch.setattr(fair_research_login, 'NativeClient', native_client)
+    config = tmp_path / 'minid' / 'minid-config.cfg'
+    mc = MinidClient(config=str(config))
+    assert not native_client.called
+    assert not config.parent.exists()
+    MinidClient(config=str(config), authorizer=Mock()).is_logged_in()
+    assert not native_client.called
+    assert mc.native_client is native_client.return_value
+    assert native_client.call_count == 1
+    assert not config.parent.exists()
+
+
+def test_client_uses_given_native_client():
+    native_client = Mock()
+    assert MinidClient(native_client=native_client).native_client is native_client
 
 
 def test_register(mock_identifiers_client, mocked_checksum, logged_in,
@@ -60,6 +169,59 @@ def test_register(mock_identifiers_client, mocked_checksum, logged_in,
     assert expected in mock_identifiers_client.create_identifier.call_args
 
 
+def test_register_file_multiple_algorithms(mock_identifiers_client, logged_in, mock_get_cached_created_by):
+    cli = MinidClient()
+    cli.register_file(TEST_CHECKSUM_FILE, algorithms=['md5', 'sha256'])
+    _, kwargs = mock_identifiers_client.create_identifier.call_args
+    assert kwargs['checksums'] == [
+        {'function': 'md5', 'value': '827ccb0eea8a706c4c34a16891f84e7b'},
+        {'function': 'sha256', 'value': TEST_CHECKSUM_VALUE},
+    ]
+
+
+def test_register_file_unsupported_algorithm(mock_identifiers_client, logged_in, mock_get_cached_created_by):
+    cli = MinidClient()
+    with pytest.raises(MinidException):
+        cli.register_file(TEST_CHECKSUM_FILE, algorithms=['blake2b'])
+
+
+@pytest.fixture
+def register_files(tmp_path):
+    files = []
+    for name in ['a.txt', 'b.txt', 'c.txt']:
+        path = tmp_path / name
+        path.write_text(name)
+        files.append(str(path))
+    return files
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_register_files(mock_gcs_register, logged_in, mock_get_cached_created_by, register_files, jobs):
+    cli = MinidClient()
+    results = dict(cli.register_files(register_files, test=True, jobs=jobs, algorithms=['md5', 'sha256']))
+    assert set(results) == set(register_files)
+    assert mock_gcs_register.call_count == len(register_files)
+    registered = {kwargs['metadata']['title']: kwargs['checksums'] for _, kwargs in mock_gcs_register.call_args_list}
+    for filename in register_files:
+        contents = os.path.basename(filename).encode('utf-8')
+        assert registered[filename] == [
+            {'function': 'md5', 'value': hashlib.md5(contents).hexdigest()},
+            {'function': 'sha256', 'value': hashlib.sha256(contents).hexdigest()},
+        ]
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_register_files_keeps_going_after_failure(mock_gcs_register, logged_in, mock_get_cached_created_by,
+                                                  register_files, jobs):
+    cli = MinidClient()
+    results = []
+    with pytest.raises(BatchRegisterError) as bre:
+        for result in cli.register_files(['does_not_exist.txt'] + register_files, jobs=jobs):
+            results.append(result)
+    assert len(results) == len(register_files)
+    assert [(position, filename) for position, filename, _ in bre.value.errors] == [(0, 'does_not_exist.txt')]
+
+
 def test_register_unsupported_checksum(mock_identifiers_client, logged_in):
     cli = MinidClient()
     checksums = [{'function': 'sha256', 'value': 'mock_checksum'},
@@ -103,6 +265,257 @@ def test_batch_register(logged_in, mock_rfm, mock_rfm_filename, mock_gcs_registe
     assert mock_gcs_register.call_count == len(mock_rfm)
 
 
+def test_batch_register_parallel_keeps_manifest_order(logged_in, mock_rfm, mock_rfm_filename, monkeypatch):
+    def register_rfm(record, test, update_if_exists=False):
+        return dict(record, url='minid:' + record['filename'])
+    monkeypatch.setattr(MinidClient, 'register_rfm', Mock(side_effect=register_rfm))
+    cli = MinidClient()
+    results = cli.batch_register(mock_rfm_filename, True, max_workers=4)
+    assert [r['url'] for r in results] == ['minid:' + r['filename'] for r in mock_rfm]
+
+
+def test_batch_register_keeps_results_after_failure(logged_in, mock_rfm, mock_rfm_filename, monkeypatch):
+    def register_rfm(record, test, update_if_exists=False):
+        if record['filename'] == mock_rfm[0]['filename']:
+            raise MinidException('Bad record')
+        return dict(record, url='minid:' + record['filename'])
+    monkeypatch.setattr(MinidClient, 'register_rfm', Mock(side_effect=register_rfm))
+    cli = MinidClient()
+    with pytest.raises(BatchRegisterError) as bre:
+        cli.batch_register(mock_rfm_filename, True, max_workers=2)
+    assert len(bre.value.errors) == 1
+    assert bre.value.errors[0][0] == 0
+    assert bre.value.results[0] == mock_rfm[0]
+    assert bre.value.results[1]['url'] == 'minid:' + mock_rfm[1]['filename']
+
+
+def test_iter_batch_register(logged_in, mock_rfm, mock_rfm_filename, mock_gcs_register):
+    cli = MinidClient()
+    records = cli.iter_batch_register(mock_rfm_filename, True)
+    first = next(records)
+    assert mock_gcs_register.call_count == 1
+    assert first == dict(mock_rfm[0], url='newly_minted_identifier')
+    assert len(list(records)) == len(mock_rfm) - 1
+
+
+def test_batch_register_resume(logged_in, mock_config_dir, mock_rfm, mock_rfm_filename, monkeypatch):
+    def register_rfm(record, test, update_if_exists=False):
+        if record['filename'] == mock_rfm[1]['filename']:
+            raise MinidException('Interrupted')
+        return dict(record, url='minid:' + record['filename'])
+    register = Mock(side_effect=register_rfm)
+    monkeypatch.setattr(MinidClient, 'register_rfm', register)
+    cli = MinidClient()
+    with pytest.raises(BatchRegisterError):
+        cli.batch_register(mock_rfm_filename, True, journal=True)
+
+    register.reset_mock()
+    register.side_effect = lambda record, test, update_if_exists=False: dict(record, url='minid:new')
+    results = cli.batch_register(mock_rfm_filename, True, resume=True)
+    # Only the record which failed is registered again
+    assert register.call_count == 1
+    assert [r['url'] for r in results] == ['minid:' + mock_rfm[0]['filename'], 'minid:new']
+
+
+def test_batch_register_without_resume_clears_journal(logged_in, mock_config_dir, mock_rfm, mock_rfm_filename,
+                                                      mock_gcs_register):
+    cli = MinidClient()
+    cli.batch_register(mock_rfm_filename, True, journal=True)
+    cli.batch_register(mock_rfm_filename, True, journal=True)
+    assert mock_gcs_register.call_count == len(mock_rfm) * 2
+    cli.batch_register(mock_rfm_filename, True, resume=True)
+    assert mock_gcs_register.call_count == len(mock_rfm) * 2
+
+
+def register_by_filename(record, test, update_if_exists=False, existing_minid=None, extra_locations=None):
+    return dict(record, url='minid:' + record['filename'])
+
+
+@pytest.fixture
+def large_rfm_filename(tmp_path):
+    records = [{'filename': 'file_{}.txt'.format(i), 'length': i, 'url': 'https://example.com/file_{}'.format(i),
+                'sha256': hashlib.sha256(str(i).encode()).hexdigest()} for i in range(40)]
+    manifest = tmp_path / 'large_rfm.json'
+    manifest.write_text(json.dumps(records))
+    return str(manifest)
+
+
+def test_get_record_shard_is_stable(mock_rfm):
+    record = dict(mock_rfm[0])
+    shard = MinidClient.get_record_shard(record, 32)
+    assert 0 <= shard < 32
+    # Only the checksum decides the shard, so duplicate contents stay together
+    record.update(filename='renamed.txt', url='https://example.com/renamed.txt')
+    assert MinidClient.get_record_shard(record, 32) == shard
+    assert MinidClient.get_record_shard({'filename': 'foo.txt'}, 32) == \
+        MinidClient.get_record_shard({'filename': 'foo.txt'}, 32)
+
+
+def test_batch_register_shards(logged_in, large_rfm_filename, tmp_path, monkeypatch):
+    monkeypatch.setattr(MinidClient, 'register_rfm', Mock(side_effect=register_by_filename))
+    cli = MinidClient()
+    manifest = list(MinidClient.read_manifest_entries(large_rfm_filename))
+    result_filenames = []
+    for index in range(4):
+        results = cli.batch_register(large_rfm_filename, True, shard=(index, 4))
+        assert all(MinidClient.get_record_shard(r, 4) == index for r in results)
+        result_filenames.append(str(tmp_path / 'shard_{}.json'.format(index)))
+        with open(result_filenames[-1], 'w') as f:
+            json.dump(results, f)
+    assert MinidClient.register_rfm.call_count == len(manifest)
+    merged = list(MinidClient.merge_shard_results(large_rfm_filename, result_filenames))
+    assert merged == [dict(r, url='minid:' + r['filename']) for r in manifest]
+
+    with pytest.raises(MinidException):
+        list(MinidClient.merge_shard_results(large_rfm_filename, result_filenames[:3]))
+
+
+def test_batch_register_shard_resume(logged_in, mock_config_dir, large_rfm_filename, monkeypatch):
+    register = Mock(side_effect=register_by_filename)
+    monkeypatch.setattr(MinidClient, 'register_rfm', register)
+    cli = MinidClient()
+    first = cli.batch_register(large_rfm_filename, True, journal=True, shard=(0, 2))
+    second = cli.batch_register(large_rfm_filename, True, journal=True, shard=(1, 2))
+    register.reset_mock()
+    # Starting shard 1 did not clear the journal of shard 0
+    assert cli.batch_register(large_rfm_filename, True, resume=True, shard=(0, 2)) == first
+    assert cli.batch_register(large_rfm_filename, True, resume=True, shard=(1, 2)) == second
+    assert register.call_count == 0
+
+
+def test_batch_register_queue(logged_in, large_rfm_filename, tmp_path, monkeypatch):
+    monkeypatch.setattr(MinidClient, 'register_rfm', Mock(side_effect=register_by_filename))
+    queue = str(tmp_path / 'queue.sqlite')
+    manifest = list(MinidClient.read_manifest_entries(large_rfm_filename))
+    results = MinidClient().batch_register(large_rfm_filename, True, max_workers=4, queue=queue)
+    assert results == [dict(r, url='minid:' + r['filename']) for r in manifest]
+    # Running again with the same queue registers nothing new
+    assert MinidClient().batch_register(large_rfm_filename, True, queue=queue) == results
+    assert MinidClient.register_rfm.call_count == len(manifest)
+
+
+def test_work_queue_shared_by_workers(logged_in, large_rfm_filename, tmp_path, monkeypatch):
+    monkeypatch.setattr(MinidClient, 'register_rfm', Mock(side_effect=register_by_filename))
+    queue = str(tmp_path / 'queue.sqlite')
+    cli = MinidClient()
+    count = cli.load_work_queue(queue, large_rfm_filename, True)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        workers = [executor.submit(MinidClient().work_queue, queue, max_workers=2, poll_interval=0.01)
+                   for _ in range(3)]
+        stats = [worker.result() for worker in workers]
+    assert sum(s['registered'] for s in stats) == count
+    assert MinidClient.register_rfm.call_count == count
+    assert len(list(cli.iter_queue_results(queue))) == count
+
+
+def test_work_queue_renews_leases(logged_in, large_rfm_filename, tmp_path, monkeypatch):
+    def register_rfm(record, test, update_if_exists=False):
+        time.sleep(0.02)
+        return register_by_filename(record, test)
+    monkeypatch.setattr(MinidClient, 'register_rfm', Mock(side_effect=register_rfm))
+    queue = str(tmp_path / 'queue.sqlite')
+    count = MinidClient().load_work_queue(queue, large_rfm_filename, True)
+    # Each worker holds its leased records far longer than lease_seconds
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        workers = [executor.submit(MinidClient().work_queue, queue, lease_seconds=0.1, poll_interval=0.01)
+                   for _ in range(2)]
+        stats = [worker.result() for worker in workers]
+    assert sum(s['registered'] for s in stats) == count
+    assert MinidClient.register_rfm.call_count == count
+
+
+def test_work_queue_failures(logged_in, mock_rfm, mock_rfm_filename, tmp_path, monkeypatch):
+    def register_rfm(record, test, update_if_exists=False):
+        if record['filename'] == mock_rfm[0]['filename']:
+            raise MinidException('Bad record')
+        return register_by_filename(record, test)
+    monkeypatch.setattr(MinidClient, 'register_rfm', Mock(side_effect=register_rfm))
+    queue = str(tmp_path / 'queue.sqlite')
+    with pytest.raises(BatchRegisterError) as bre:
+        MinidClient().batch_register(mock_rfm_filename, True, queue=queue)
+    assert bre.value.errors[0][0] == 0
+    assert bre.value.results[0] == mock_rfm[0]
+
+
+def test_work_queue_requires_loaded_queue(logged_in, tmp_path):
+    with pytest.raises(MinidException):
+        MinidClient().work_queue(str(tmp_path / 'queue.sqlite'))
+
+
+def test_batch_register_invalid_shard(logged_in, mock_rfm_filename):
+    with pytest.raises(MinidException):
+        MinidClient().batch_register(mock_rfm_filename, True, shard=(2, 2))
+
+
+@pytest.fixture
+def duplicate_rfm_filename(tmp_path):
+    records = [
+        {'filename': 'a.txt', 'url': 'https://example.com/a.txt', 'sha256': 'aaa'},
+        {'filename': 'b.txt', 'url': 'https://example.com/b.txt', 'sha256': 'bbb'},
+        {'filename': 'a_copy.txt', 'url': 'https://mirror.example.com/a.txt', 'sha256': 'aaa'},
+        {'filename': 'no_checksum.txt', 'url': 'https://example.com/no_checksum.txt'},
+        {'filename': 'a_again.txt', 'url': 'https://example.com/a.txt', 'sha256': 'aaa'},
+        {'filename': 'a_md5.txt', 'url': 'https://example.com/a_md5.txt', 'sha256': 'aaa', 'md5': 'a'},
+    ]
+    manifest = tmp_path / 'duplicate_rfm.json'
+    manifest.write_text(json.dumps(records))
+    return str(manifest)
+
+
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_batch_register_dedup(logged_in, duplicate_rfm_filename, monkeypatch, max_workers):
+    monkeypatch.setattr(MinidClient, 'register_rfm', Mock(side_effect=register_by_filename))
+    results = MinidClient().batch_register(duplicate_rfm_filename, True, dedup=True, max_workers=max_workers)
+    registered = [c[0][0] for c in MinidClient.register_rfm.call_args_list]
+    assert [r['filename'] for r in registered] == ['a.txt', 'b.txt', 'no_checksum.txt', 'a_md5.txt']
+    assert registered[0]['url'] == 'https://example.com/a.txt'
+    assert MinidClient.register_rfm.call_args_list[0][1]['extra_locations'] == [
+        'https://mirror.example.com/a.txt', 'https://example.com/a.txt']
+    assert 'extra_locations' not in MinidClient.register_rfm.call_args_list[1][1]
+    assert [r['filename'] for r in results] == ['a.txt', 'b.txt', 'a_copy.txt', 'no_checksum.txt',
+                                                'a_again.txt', 'a_md5.txt']
+    assert [r['url'] for r in results] == ['minid:a.txt', 'minid:b.txt', 'minid:a.txt', 'minid:no_checksum.txt',
+                                           'minid:a.txt', 'minid:a_md5.txt']
+
+
+def test_batch_register_dedup_existing_identifier(logged_in, tmp_path, monkeypatch):
+    records = [
+        {'filename': 'a.txt', 'url': 'hdl:20.500.12633/a', 'sha256': 'aaa'},
+        {'filename': 'a_copy.txt', 'url': 'https://mirror.example.com/a.txt', 'sha256': 'aaa'},
+    ]
+    manifest = tmp_path / 'duplicate_rfm.json'
+    manifest.write_text(json.dumps(records))
+    monkeypatch.setattr(MinidClient, 'register_rfm', Mock(side_effect=register_by_filename))
+    results = MinidClient().batch_register(str(manifest), True, update_if_exists=True, dedup=True, prefetch=0)
+    (record, _), kwargs = MinidClient.register_rfm.call_args
+    assert record == records[0]
+    assert kwargs['extra_locations'] == ['https://mirror.example.com/a.txt']
+    assert [r['url'] for r in results] == ['minid:a.txt', 'minid:a.txt']
+
+
+def test_batch_register_dedup_failure(logged_in, duplicate_rfm_filename, monkeypatch):
+    def register_rfm(record, test, update_if_exists=False):
+        if record['filename'] == 'a.txt':
+            raise MinidException('Bad record')
+        return register_by_filename(record, test)
+    monkeypatch.setattr(MinidClient, 'register_rfm', Mock(side_effect=register_rfm))
+    with pytest.raises(BatchRegisterError) as bre:
+        MinidClient().batch_register(duplicate_rfm_filename, True, dedup=True)
+    assert [position for position, _, _ in bre.value.errors] == [0, 2, 4]
+    assert bre.value.results[2]['url'] == 'https://mirror.example.com/a.txt'
+
+
+def test_batch_register_dedup_requires_file(logged_in):
+    with pytest.raises(MinidException):
+        MinidClient().batch_register('-', True, dedup=True)
+
+
+def test_batch_register_login_required_stops_batch(logged_out, mock_rfm_filename):
+    cli = MinidClient()
+    with pytest.raises(LoginRequired):
+        cli.batch_register(mock_rfm_filename, True, max_workers=2)
+
+
 def test_rfm_register_updates_existing(logged_in, mock_get_identifier, mock_gcs_register,
                                        mock_identifier_response, mock_gcs_update):
     mock_identifier_response.data = mock_identifier_response.data['identifiers'][0]
@@ -137,6 +550,208 @@ def test_rfm_register_replaces_changed(logged_in, mock_get_identifier, mock_gcs_
     assert mock_gcs_update.call_count == 0
 
 
+@pytest.mark.parametrize('sha256, updated', [
+    ('f92d11e4316ac9f282571338dba4df819203639ff5cf8d32225d857828189998', True),
+    ('checksum_has_changed', False),
+])
+def test_rfm_register_extra_locations(logged_in, mock_get_identifier, mock_gcs_register, mock_identifier_response,
+                                      mock_gcs_update, sha256, updated):
+    mock_identifier_response.data = mock_identifier_response.data['identifiers'][0]
+    mock_get_identifier.get_identifier.return_value = mock_identifier_response
+    rfm_record = {'filename': 'test_document.txt', 'url': 'hdl:20.500.12633/foo-identifier', 'sha256': sha256}
+    MinidClient().register_rfm(rfm_record, True, update_if_exists=True,
+                               extra_locations=['https://mirror.example.com/foo.txt', rfm_record['url']])
+    request = mock_gcs_update if updated else mock_gcs_register
+    assert request.call_count == 1
+    assert request.call_args[1]['location'] == [rfm_record['url'], 'https://mirror.example.com/foo.txt']
+
+
+def test_rfm_register_uses_existing_minid(logged_in, mock_get_identifier, mock_gcs_register,
+                                          mock_identifier_response, mock_gcs_update):
+    rfm_record = {
+        "filename": "test_document.txt",
+        "url": "hdl:20.500.12633/foo-identifier",
+        "sha256": "f92d11e4316ac9f282571338dba4df819203639ff5cf8d32225d857828189998"
+    }
+    existing = mock_identifier_response.data['identifiers'][0]
+    MinidClient().register_rfm(rfm_record, True, update_if_exists=True, existing_minid=existing)
+    assert mock_get_identifier.get_identifier.call_count == 0
+    assert mock_gcs_update.call_count == 1
+
+
+@pytest.fixture
+def existing_rfm_filename(tmp_path):
+    records = [{'filename': 'file_{}.txt'.format(i), 'url': 'hdl:20.500.12633/file_{}'.format(i),
+                'sha256': 'abc'} for i in range(8)]
+    manifest = tmp_path / 'existing_rfm.json'
+    manifest.write_text(json.dumps(records))
+    return str(manifest)
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_batch_register_prefetches_lookups(logged_in, existing_rfm_filename, monkeypatch, max_workers):
+    prefetched = threading.Event()
+
+    def lookup(record):
+        if record['filename'] == 'file_3.txt':
+            prefetched.set()
+        return {'identifier': record['url']}
+
+    def register_rfm(record, test, update_if_exists=False, existing_minid=None):
+        assert existing_minid == {'identifier': record['url']}
+        if record['filename'] == 'file_0.txt':
+            # Record 3 is looked up while record 0 is still registering
+            assert prefetched.wait(timeout=5)
+        return dict(record, url=existing_minid['identifier'])
+
+    monkeypatch.setattr(MinidClient, '_lookup_rfm', Mock(side_effect=lookup))
+    monkeypatch.setattr(MinidClient, 'register_rfm', Mock(side_effect=register_rfm))
+    results = MinidClient().batch_register(existing_rfm_filename, True, update_if_exists=True,
+                                           max_workers=max_workers, prefetch=4)
+    assert [r['filename'] for r in results] == ['file_{}.txt'.format(i) for i in range(8)]
+    assert MinidClient._lookup_rfm.call_count == 8
+
+
+def test_batch_register_prefetch_shares_workers(logged_in, existing_rfm_filename, monkeypatch):
+    lock, running, most_running = threading.Lock(), [0], [0]
+
+    def request(result):
+        with lock:
+            running[0] += 1
+            most_running[0] = max(most_running[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return result
+
+    monkeypatch.setattr(MinidClient, '_lookup_rfm', Mock(side_effect=lambda record: request(None)))
+    monkeypatch.setattr(MinidClient, 'register_rfm',
+                        Mock(side_effect=lambda record, *args, **kwargs: request(register_by_filename(record, True))))
+    MinidClient().batch_register(existing_rfm_filename, True, update_if_exists=True, max_workers=2)
+    assert MinidClient._lookup_rfm.call_count == 8
+    assert most_running[0] == 2
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_batch_register_repeated_identifier_is_not_stale(logged_in, tmp_path, monkeypatch, max_workers):
+    records = [{'filename': 'file_{}.txt'.format(i), 'url': 'hdl:20.500.12633/file_{}'.format(i % 2),
+                'sha256': 'abc'} for i in range(8)]
+    manifest = tmp_path / 'repeated_rfm.json'
+    manifest.write_text(json.dumps(records))
+    titles, lock = {}, threading.Lock()
+
+    def lookup(record):
+        with lock:
+            return {'identifier': record['url'], 'title': titles.get(record['url'])}
+
+    def register_rfm(record, test, update_if_exists=False, existing_minid=None):
+        existing = existing_minid or MinidClient._lookup_rfm(record)
+        time.sleep(0.01)
+        with lock:
+            # Each update sees the title written by the one before it
+            assert existing['title'] == titles.get(record['url'])
+            titles[record['url']] = record['filename']
+        return dict(record, url=existing['identifier'])
+
+    monkeypatch.setattr(MinidClient, '_lookup_rfm', Mock(side_effect=lookup))
+    monkeypatch.setattr(MinidClient, 'register_rfm', Mock(side_effect=register_rfm))
+    results = MinidClient().batch_register(str(manifest), True, update_if_exists=True, max_workers=max_workers)
+    assert [r['filename'] for r in results] == [r['filename'] for r in records]
+    assert titles == {'hdl:20.500.12633/file_0': 'file_6.txt', 'hdl:20.500.12633/file_1': 'file_7.txt'}
+
+
+def test_batch_register_without_prefetch(logged_in, existing_rfm_filename, monkeypatch):
+    monkeypatch.setattr(MinidClient, '_lookup_rfm', Mock())
+    monkeypatch.setattr(MinidClient, 'register_rfm', Mock(side_effect=register_by_filename))
+    MinidClient().batch_register(existing_rfm_filename, True, update_if_exists=True, prefetch=0)
+    assert MinidClient._lookup_rfm.call_count == 0
+    assert 'existing_minid' not in MinidClient.register_rfm.call_args[1]
+
+
+def test_batch_register_prefetch_failure(logged_in, existing_rfm_filename, monkeypatch):
+    def lookup(record):
+        if record['filename'] == 'file_1.txt':
+            raise MinidException('Lookup failed')
+        return {'identifier': record['url']}
+    monkeypatch.setattr(MinidClient, '_lookup_rfm', Mock(side_effect=lookup))
+    monkeypatch.setattr(MinidClient, 'register_rfm', Mock(side_effect=register_by_filename))
+    with pytest.raises(BatchRegisterError) as bre:
+        MinidClient().batch_register(existing_rfm_filename, True, update_if_exists=True, max_workers=2)
+    assert [position for position, _, _ in bre.value.errors] == [1]
+
+
+EXISTING_MINID = {
+    'identifier': 'hdl:20.500.12633/foo',
+    'active': True,
+    'location': ['https://example.com/foo.txt'],
+    'metadata': {'title': 'foo.txt', 'created_by': 'Test User'},
+    'replaces': None,
+}
+
+
+@pytest.mark.parametrize('kwargs, expected', [
+    ({'title': 'foo.txt', 'locations': ['https://example.com/foo.txt']}, None),
+    ({'active': True, 'replaces': None}, None),
+    ({'title': 'bar.txt', 'locations': ['https://example.com/foo.txt']}, {'metadata': {'title': 'bar.txt'}}),
+    ({'title': 'foo.txt', 'locations': ['https://example.com/bar.txt']},
+     {'metadata': {}, 'location': ['https://example.com/bar.txt']}),
+    ({'active': False}, {'metadata': {}, 'active': False}),
+])
+def test_diff_update_args(kwargs, expected):
+    _, fields = MinidClient._get_update_args('minid.test:foo', **kwargs)
+    assert MinidClient._diff_update_args(fields, EXISTING_MINID) == expected
+
+
+def test_update_skips_unchanged(mock_identifiers_client, logged_in):
+    cli = MinidClient()
+    response = cli.update('minid.test:foo', title='foo.txt', locations=['https://example.com/foo.txt'],
+                          existing=EXISTING_MINID)
+    assert mock_identifiers_client.update_identifier.call_count == 0
+    assert response.data == EXISTING_MINID
+    cli.update('minid.test:foo', title='bar.txt', existing=EXISTING_MINID)
+    mock_identifiers_client.update_identifier.assert_called_with('hdl:20.500.12633/foo',
+                                                                 metadata={'title': 'bar.txt'})
+
+
+def test_batch_register_counts_unchanged_updates(logged_in, mock_identifiers_client, tmp_path, monkeypatch):
+    records = [{'filename': 'foo.txt', 'url': EXISTING_MINID['identifier'], 'sha256': 'abc'},
+               {'filename': 'bar.txt', 'url': EXISTING_MINID['identifier'], 'sha256': 'abc'}]
+    manifest = tmp_path / 'rfm.json'
+    manifest.write_text(json.dumps(records))
+    existing = dict(EXISTING_MINID, location=[EXISTING_MINID['identifier']],
+                    checksums=[{'function': 'sha256', 'value': 'abc'}])
+    monkeypatch.setattr(MinidClient, '_lookup_rfm', Mock(return_value=existing))
+    mock_identifiers_client.update_identifier.return_value = Mock(data=existing)
+    queue = str(tmp_path / 'queue.sqlite')
+    cli = MinidClient()
+    cli.load_work_queue(queue, str(manifest), True, update_if_exists=True)
+    stats = cli.work_queue(queue)
+    assert stats == {'registered': 2, 'failed': 0, 'unchanged': 1}
+    assert mock_identifiers_client.update_identifier.call_count == 1
+
+
+def test_batch_register_stats_per_batch(logged_in, mock_identifiers_client, tmp_path, monkeypatch):
+    existing = dict(EXISTING_MINID, location=[EXISTING_MINID['identifier']],
+                    checksums=[{'function': 'sha256', 'value': 'abc'}])
+    monkeypatch.setattr(MinidClient, '_lookup_rfm', Mock(return_value=existing))
+    mock_identifiers_client.update_identifier.return_value = Mock(data=existing)
+    manifests = []
+    for filename, count in [('foo.txt', 6), ('bar.txt', 4)]:
+        manifest = tmp_path / '{}.json'.format(filename)
+        manifest.write_text(json.dumps([{'filename': filename, 'url': EXISTING_MINID['identifier'],
+                                         'sha256': 'abc'}] * count))
+        manifests.append(str(manifest))
+    cli = MinidClient()
+    stats = [{}, {}]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for future in [executor.submit(cli.batch_register, manifest, True, update_if_exists=True,
+                                       max_workers=2, stats=batch_stats)
+                       for manifest, batch_stats in zip(manifests, stats)]:
+            future.result()
+    assert stats == [{'registered': 6, 'failed': 0, 'unchanged': 6},
+                     {'registered': 4, 'failed': 0, 'unchanged': 0}]
+
+
 def test_update(mock_identifiers_client, mocked_checksum, logged_in):
     cli = MinidClient()
     cli.update('hdl:20.500.12633/mock-hdl', title='foo.txt',
@@ -182,6 +797,68 @@ def test_check_by_checksum(mock_identifiers_client):
     )
 
 
+@pytest.fixture
+def mock_check_many(mock_identifiers_client, mock_identifier_response, mock_globus_response):
+    identifier = mock_identifier_response.data['identifiers'][0]
+
+    def get_identifier(hdl):
+        if hdl.endswith('missing'):
+            response = Mock(status_code=404, headers={'Content-Type': 'application/json'})
+            response.request.headers = response.headers
+            response.json.return_value = {'code': 'NotFound', 'message': 'Not Found'}
+            raise IdentifierClientError(response)
+        found = mock_globus_response()
+        found.data = dict(identifier, checksums=[{'function': 'sha256', 'value': TEST_CHECKSUM_VALUE}])
+        return found
+
+    def get_identifier_by_checksum(checksum):
+        found = mock_globus_response()
+        found.data = {'identifiers': [identifier] if checksum == TEST_CHECKSUM_VALUE else []}
+        return found
+    mock_identifiers_client.get_identifier.side_effect = get_identifier
+    mock_identifiers_client.get_identifier_by_checksum.side_effect = get_identifier_by_checksum
+    return mock_identifiers_client
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_check_many(mock_check_many, tmp_path, jobs):
+    other_file = tmp_path / 'other.txt'
+    other_file.write_text('not registered')
+    entities = [
+        'minid.test:found',
+        'minid.test:missing',
+        TEST_CHECKSUM_FILE,
+        str(other_file),
+        (TEST_CHECKSUM_FILE, 'minid.test:found'),
+        (str(other_file), 'minid.test:found'),
+        'does_not_exist.txt',
+        'minid.test:found',
+    ]
+    results = list(MinidClient().check_many(entities, jobs=jobs))
+    statuses = {(r['entity'], r.get('identifier')): r['status'] for r in results}
+    assert len(results) == len(entities) - 1
+    assert statuses == {
+        ('minid.test:found', None): 'found',
+        ('minid.test:missing', None): 'missing',
+        (TEST_CHECKSUM_FILE, None): 'found',
+        (str(other_file), None): 'missing',
+        (TEST_CHECKSUM_FILE, 'minid.test:found'): 'found',
+        (str(other_file), 'minid.test:found'): 'mismatched',
+        ('does_not_exist.txt', None): 'error',
+    }
+
+
+def test_check_many_hash_workers_share_cache(mock_check_many, tmp_path):
+    cache = ChecksumCache(str(tmp_path / 'cache.sqlite'))
+    query = 'SELECT last_used FROM checksums'
+    list(MinidClient(checksum_cache=cache).check_many([TEST_CHECKSUM_FILE], jobs=2))
+    (cached,), = cache.connection.execute(query).fetchall()
+    list(MinidClient(checksum_cache=cache).check_many([TEST_CHECKSUM_FILE], jobs=2))
+    # The worker which hit the cache wrote the time it was used as it exited
+    (used,), = cache.connection.execute(query).fetchall()
+    assert used > cached
+
+
 def test_checksumming_file_does_not_exist():
     cli = MinidClient()
     with pytest.raises(MinidException):
@@ -208,6 +885,32 @@ def test_compute_checksum():
     assert checksum == TEST_CHECKSUM_VALUE
 
 
+def test_compute_checksums_reads_file_once(monkeypatch):
+    reads = []
+    real_open = open
+
+    def tracked_open(*args, **kwargs):
+        f = real_open(*args, **kwargs)
+        real_readinto = f.readinto
+        f.readinto = lambda buf: reads.append(buf) or real_readinto(buf)
+        return f
+    monkeypatch.setattr('builtins.open', tracked_open)
+    checksums = MinidClient.compute_checksums(TEST_CHECKSUM_FILE, ['md5', 'sha1', 'sha256'])
+    assert checksums == {
+        'md5': hashlib.md5(b'12345').hexdigest(),
+        'sha1': hashlib.sha1(b'12345').hexdigest(),
+        'sha256': TEST_CHECKSUM_VALUE,
+    }
+    # One read for the data, and one to reach the end of the file
+    assert len(reads) == 2
+
+
+def test_get_supported_algorithms():
+    algorithms = MinidClient.get_supported_algorithms()
+    assert {'md5', 'sha1', 'sha256'}.issubset(algorithms)
+    assert all(hasattr(hashlib, alg) for alg in algorithms)
+
+
 def test_validate_checksums_without_common_algs_returns_false(mock_identifier_response):
     checksums = mock_identifier_response['identifiers'][0]['checksums']
     assert MinidClient.validate_checksums(checksums, []) is False
@@ -219,17 +922,81 @@ def test_empty_dir():
         MinidClient.compute_checksum(EMPTY_DIR)
 
 
-def test_get_cached_created_by(mock_globus_sdk_auth, mock_fair_research_login):
+@pytest.fixture
+def mock_userinfo(mock_globus_sdk_auth):
+    mock_globus_sdk_auth.return_value.oauth2_userinfo.return_value.data = {'name': 'Test User'}
+    return mock_globus_sdk_auth
+
+
+def test_get_cached_created_by(mock_userinfo, mock_fair_research_login, mock_config_dir):
     mc = MinidClient()
-    mc.get_cached_created_by()
-    assert mock_globus_sdk_auth.called
+    assert mc.get_cached_created_by() == 'Test User'
+    assert mock_userinfo.called
 
 
-def test_get_cached_created_by_is_cached(mock_globus_sdk_auth, mock_fair_research_login):
+def test_get_cached_created_by_is_cached(mock_userinfo, mock_fair_research_login, mock_config_dir):
     mc = MinidClient()
     mc.get_cached_created_by()
     mc.get_cached_created_by()
-    assert mock_globus_sdk_auth.call_count == 1
+    assert mock_userinfo.call_count == 1
+
+
+def test_get_cached_created_by_persists_across_clients(mock_userinfo, mock_fair_research_login, mock_config_dir):
+    MinidClient().get_cached_created_by()
+    assert MinidClient().get_cached_created_by() == 'Test User'
+    assert mock_userinfo.call_count == 1
+    assert oct(os.stat(MinidClient.CONFIG).st_mode & 0o777) == oct(0o600)
+
+
+def test_get_cached_created_by_expires(mock_userinfo, mock_fair_research_login, mock_config_dir,
+                                       monkeypatch):
+    MinidClient().get_cached_created_by()
+    now = time.time() + MinidClient.CREATED_BY_TTL + 1
+    monkeypatch.setattr(time, 'time', lambda: now)
+    MinidClient().get_cached_created_by()
+    assert mock_userinfo.call_count == 2
+
+
+def test_get_cached_created_by_keyed_to_tokens(mock_userinfo, mock_fair_research_login, mock_config_dir):
+    MinidClient().get_cached_created_by()
+    other_user = {'auth.globus.org': globus_sdk.AccessTokenAuthorizer('other_tokens')}
+    mock_fair_research_login.get_authorizers.return_value = other_user
+    MinidClient().get_cached_created_by()
+    assert mock_userinfo.call_count == 2
+
+
+def test_login_clears_saved_userinfo(mock_userinfo, mock_fair_research_login, mock_config_dir,
+                                     monkeypatch):
+    mc = MinidClient()
+    mc.get_cached_created_by()
+    monkeypatch.setattr(mc.native_client, 'login', Mock())
+    mc.login()
+    MinidClient().get_cached_created_by()
+    assert mock_userinfo.call_count == 2
+
+
+def test_save_userinfo_keeps_tokens(mock_fair_research_login, mock_config_dir):
+    mc = MinidClient()
+    with open(MinidClient.CONFIG, 'w') as config_file:
+        config_file.write('[tokens]\nsecret = value\n')
+    mc._save_userinfo('identity', 'Test User')
+    config = mc._read_config()
+    assert config['tokens']['secret'] == 'value'
+    assert config[MinidClient.USERINFO_SECTION]['name'] == 'Test User'
+    assert oct(os.stat(MinidClient.CONFIG).st_mode & 0o777) == oct(0o600)
+    assert os.listdir(str(mock_config_dir)) == ['minid-config.cfg']
+
+
+def test_save_userinfo_failure_leaves_config(mock_fair_research_login, mock_config_dir,
+                                             monkeypatch):
+    mc = MinidClient()
+    with open(MinidClient.CONFIG, 'w') as config_file:
+        config_file.write('[tokens]\nsecret = value\n')
+    monkeypatch.setattr(os, 'replace', Mock(side_effect=OSError('disk full')))
+    mc._save_userinfo('identity', 'Test User')
+    with open(MinidClient.CONFIG) as config_file:
+        assert config_file.read() == '[tokens]\nsecret = value\n'
+    assert os.listdir(str(mock_config_dir)) == ['minid-config.cfg']
 
 
 def test_read_manifest_entries(mock_rfm, mock_rfm_filename):
@@ -238,20 +1005,44 @@ def test_read_manifest_entries(mock_rfm, mock_rfm_filename):
 
 
 def test_is_stream(mock_streamed_rfm):
-    with open('magic_file.json', 'r') as manifest:
+    with open(mock_streamed_rfm, 'rb') as manifest:
         assert MinidClient._is_stream(manifest) is True
 
 
 def test_is_not_stream(mock_rfm_filename):
-    with open(mock_rfm_filename, 'r') as manifest:
+    with open(mock_rfm_filename, 'rb') as manifest:
         assert MinidClient._is_stream(manifest) is False
 
 
-@pytest.mark.skipif(sys.version_info > (3, 6) and sys.version_info < (3, 7),
-                    reason='Skip if python 3.6')
-def test_read_manifest_entries_streamed(mock_streamed_rfm, mock_rfm,
-                                        monkeypatch):
-    monkeypatch.setattr(MinidClient, '_is_stream', Mock(return_value=True))
-    read_rfm = list(MinidClient.read_manifest_entries('rfm.json'))
+def test_read_manifest_entries_streamed(mock_streamed_rfm, mock_rfm):
+    read_rfm = list(MinidClient.read_manifest_entries(mock_streamed_rfm))
     assert len(read_rfm) == len(mock_rfm)
     assert read_rfm == mock_rfm
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'bz2', 'lzma'])
+@pytest.mark.parametrize('streamed', [True, False])
+def test_read_manifest_entries_compressed(mock_rfm, tmp_path, compression, streamed):
+    module = importlib.import_module(compression)
+    text = '\n'.join(json.dumps(r) for r in mock_rfm) if streamed else json.dumps(mock_rfm, indent=2)
+    manifest = tmp_path / 'rfm.json.compressed'
+    manifest.write_bytes(module.compress(text.encode('utf-8')))
+    assert list(MinidClient.read_manifest_entries(str(manifest))) == mock_rfm
+
+
+@pytest.mark.parametrize('streamed', [True, False])
+def test_read_manifest_entries_stdin(mock_rfm, monkeypatch, streamed):
+    text = '\n'.join(json.dumps(r) for r in mock_rfm) if streamed else json.dumps(mock_rfm)
+    stdin = io.TextIOWrapper(io.BytesIO(gzip.compress(text.encode('utf-8'))))
+    monkeypatch.setattr(sys, 'stdin', stdin)
+    assert list(MinidClient.read_manifest_entries('-')) == mock_rfm
+    assert not stdin.closed
+
+
+def test_read_manifest_entries_zstd_missing(tmp_path, monkeypatch):
+    manifest = tmp_path / 'rfm.json.zst'
+    manifest.write_bytes(b'\x28\xb5\x2f\xfd' + b'\x00' * 8)
+    monkeypatch.setitem(sys.modules, 'zstandard', None)
+    monkeypatch.setitem(sys.modules, 'compression', None)
+    with pytest.raises(MinidException):
+        list(MinidClient.read_manifest_entries(str(manifest)))
@@ -1,3 +1,7 @@
+import io
+import os
+import gzip
+import json
 import traceback
 import pytest
 
@@ -5,6 +9,7 @@ from unittest.mock import Mock
 import click
 from click.testing import CliRunner
 from minid.commands import main, minid_ops, formatting
+from minid.journal import BatchJournal
 from fair_identifiers_client.identifiers_api import IdentifierClientError
 
 import minid
@@ -75,6 +80,24 @@ LOGGED_IN_COMMANDS = [
             'title': None
         })
     }),
+    ({
+        'command': ['register', 'foo.txt', '--algorithms', 'md5,sha256'],
+        'mock': (minid.MinidClient, 'register_file'),
+        'expected_call_args': (['foo.txt'], {
+            'algorithms': ['md5', 'sha256'],
+            'test': False,
+            'title': None
+        })
+    }),
+    ({
+        'command': ['register', 'foo.txt', '--algorithms', 'all'],
+        'mock': (minid.MinidClient, 'register_file'),
+        'expected_call_args': (['foo.txt'], {
+            'algorithms': minid.MinidClient.get_supported_algorithms(),
+            'test': False,
+            'title': None
+        })
+    }),
     ({
         'command': ['register', 'foo.txt', '--title', 'My Foo'],
         'mock': (minid.MinidClient, 'register_file'),
@@ -291,7 +314,7 @@ def test_print_minids_json(mock_identifier_response, monkeypatch):
 
 
 def test_batch_register(logged_in, mock_rfm, mock_rfm_filename, mock_gcs_register,
-                        mock_gcs_get_by_checksum):
+                        mock_gcs_get_by_checksum, mock_config_dir):
     mock_gcs_get_by_checksum.return_value.data['identifiers'] = []
 
     runner = CliRunner()
@@ -300,6 +323,203 @@ def test_batch_register(logged_in, mock_rfm, mock_rfm_filename, mock_gcs_registe
     assert mock_gcs_register.call_count == len(mock_rfm)
 
 
+def test_batch_register_jobs(logged_in, mock_rfm, mock_rfm_filename, mock_gcs_register,
+                             mock_gcs_get_by_checksum, mock_config_dir):
+    runner = CliRunner()
+    result = runner.invoke(main.cli, ['batch-register', '--jobs', '2', mock_rfm_filename])
+    assert result.exit_code == 0
+    assert mock_gcs_register.call_count == len(mock_rfm)
+
+
+def test_batch_register_rate_limit(logged_in, mock_rfm, mock_rfm_filename, mock_gcs_register,
+                                   mock_gcs_get_by_checksum, mock_config_dir, monkeypatch):
+    get_client = Mock(wraps=minid.commands.get_client)
+    monkeypatch.setattr(minid.commands, 'get_client', get_client)
+    runner = CliRunner()
+    result = runner.invoke(main.cli, ['batch-register', '--rate-limit', '5', mock_rfm_filename])
+    assert result.exit_code == 0
+    assert get_client.call_args[1]['rate_limit'] == 5
+
+
+def test_batch_register_failure_outputs_results(logged_in, mock_rfm, mock_rfm_filename, monkeypatch,
+                                                mock_config_dir):
+    def register_rfm(record, test, update_if_exists=False):
+        if record['filename'] == mock_rfm[0]['filename']:
+            raise minid.exc.MinidException('Bad record')
+        return dict(record, url='minid:' + record['filename'])
+    monkeypatch.setattr(minid.MinidClient, 'register_rfm', Mock(side_effect=register_rfm))
+    runner = CliRunner()
+    result = runner.invoke(main.cli, ['batch-register', mock_rfm_filename])
+    assert result.exit_code == 1
+    assert mock_rfm[0]['url'] in result.output
+    assert 'minid:' + mock_rfm[1]['filename'] in result.output
+
+
+def test_batch_register_jsonl_output(logged_in, mock_rfm, mock_rfm_filename, mock_gcs_register, tmp_path,
+                                     mock_config_dir):
+    output = tmp_path / 'out.jsonl'
+    runner = CliRunner()
+    result = runner.invoke(main.cli, ['batch-register', mock_rfm_filename, '--output', str(output),
+                                      '--format', 'jsonl'])
+    assert result.exit_code == 0
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [r['filename'] for r in records] == [r['filename'] for r in mock_rfm]
+    assert all(r['url'] == 'newly_minted_identifier' for r in records)
+
+
+def test_batch_register_prints_summary(logged_in, mock_rfm, mock_rfm_filename, mock_gcs_register,
+                                       mock_config_dir):
+    result = CliRunner().invoke(main.cli, ['batch-register', mock_rfm_filename, '--format', 'jsonl'])
+    assert result.exit_code == 0
+    assert len(result.stdout.splitlines()) == len(mock_rfm)
+    summary = 'Registered {} records, 0 failed, 0 already up to date'.format(len(mock_rfm))
+    assert summary in result.stderr
+
+
+def test_batch_register_dedup(logged_in, mock_rfm, mock_gcs_register, tmp_path, mock_config_dir):
+    manifest = tmp_path / 'rfm.json'
+    manifest.write_text(json.dumps(mock_rfm + [dict(mock_rfm[0], filename='copy.txt')]))
+    result = CliRunner().invoke(main.cli, ['batch-register', str(manifest), '--dedup', '--format', 'jsonl'])
+    assert result.exit_code == 0
+    assert len(result.stdout.splitlines()) == len(mock_rfm) + 1
+    assert mock_gcs_register.call_count == len(mock_rfm)
+
+
+def test_batch_register_gzip_stdin(logged_in, mock_rfm, mock_gcs_register, mock_config_dir):
+    stdin = gzip.compress('\n'.join(json.dumps(r) for r in mock_rfm).encode('utf-8'))
+    runner = CliRunner()
+    result = runner.invoke(main.cli, ['batch-register', '-', '--format', 'jsonl'], input=stdin)
+    assert result.exit_code == 0
+    records = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [r['filename'] for r in records] == [r['filename'] for r in mock_rfm]
+
+
+def test_batch_register_shard_and_merge(logged_in, mock_rfm, mock_rfm_filename, mock_gcs_register, tmp_path,
+                                        mock_config_dir):
+    runner = CliRunner()
+    outputs = []
+    for index in range(2):
+        outputs.append(str(tmp_path / 'shard_{}.jsonl'.format(index)))
+        result = runner.invoke(main.cli, ['batch-register', mock_rfm_filename, '--shard', '{}/2'.format(index),
+                                          '--format', 'jsonl', '--output', outputs[-1]])
+        assert result.exit_code == 0
+    assert mock_gcs_register.call_count == len(mock_rfm)
+    result = runner.invoke(main.cli, ['merge-results', mock_rfm_filename] + outputs)
+    assert result.exit_code == 0
+    assert [r['filename'] for r in json.loads(result.output)] == [r['filename'] for r in mock_rfm]
+
+
+def test_batch_register_queue_and_worker(logged_in, mock_rfm, mock_rfm_filename, mock_gcs_register, tmp_path,
+                                         mock_config_dir):
+    queue = str(tmp_path / 'queue.sqlite')
+    minid.MinidClient().load_work_queue(queue, mock_rfm_filename, True)
+    runner = CliRunner()
+    result = runner.invoke(main.cli, ['batch-worker', queue, '--jobs', '2'])
+    assert result.exit_code == 0
+    assert 'Registered {} records, 0 failed'.format(len(mock_rfm)) in result.output
+    result = runner.invoke(main.cli, ['batch-register', mock_rfm_filename, '--test', '--queue', queue,
+                                      '--format', 'jsonl'])
+    assert result.exit_code == 0
+    assert len(result.stdout.splitlines()) == len(mock_rfm)
+    assert mock_gcs_register.call_count == len(mock_rfm)
+
+
+@pytest.mark.parametrize('shard', ['2/2', '1', 'a/b', '-1/2'])
+def test_batch_register_invalid_shard(logged_in, mock_rfm_filename, shard):
+    result = CliRunner().invoke(main.cli, ['batch-register', mock_rfm_filename, '--shard', shard])
+    assert result.exit_code == 1
+    assert 'INDEX' in result.output
+
+
+def test_batch_register_resume(logged_in, mock_rfm, mock_rfm_filename, mock_gcs_register, mock_config_dir):
+    runner = CliRunner()
+    result = runner.invoke(main.cli, ['batch-register', '--journal', mock_rfm_filename])
+    assert result.exit_code == 0
+    result = runner.invoke(main.cli, ['batch-register', '--resume', mock_rfm_filename])
+    assert result.exit_code == 0
+    assert mock_gcs_register.call_count == len(mock_rfm)
+    assert json.loads(result.stdout) == [dict(r, url='newly_minted_identifier') for r in mock_rfm]
+
+
+def test_batch_register_journal_is_opt_in(logged_in, mock_rfm, mock_rfm_filename, mock_gcs_register,
+                                          mock_config_dir):
+    runner = CliRunner()
+    assert runner.invoke(main.cli, ['batch-register', mock_rfm_filename]).exit_code == 0
+    assert not os.path.exists(os.path.join(mock_config_dir, BatchJournal.FILENAME))
+    assert runner.invoke(main.cli, ['batch-register', '--resume', mock_rfm_filename]).exit_code == 0
+    assert mock_gcs_register.call_count == len(mock_rfm) * 2
+
+
+@pytest.mark.parametrize('records', [[], [{'url': 'minid:1', 'filename': 'a\nb.txt'}, {'url': 'minid:2'}]])
+def test_write_records_json_matches_json_dumps(records):
+    output = io.StringIO()
+    minid_ops.write_records(iter(records), output)
+    assert output.getvalue() == json.dumps(records, indent=2) + '\n'
+
+
+def test_register_multiple_files(logged_in, mock_print, mock_identifier_response, monkeypatch):
+    register_files = Mock(return_value=iter([('foo.txt', mock_identifier_response),
+                                             ('bar.txt', mock_identifier_response)]))
+    monkeypatch.setattr(minid.MinidClient, 'register_files', register_files)
+    runner = CliRunner()
+    result = runner.invoke(main.cli, ['register', 'foo.txt', 'bar.txt', '--jobs', '4', '--test'])
+    assert result.exit_code == 0
+    register_files.assert_called_with(('foo.txt', 'bar.txt'), jobs=4, test=True)
+    assert minid_ops.print_minids.call_count == 2
+
+
+def test_register_multiple_files_rejects_title(logged_in):
+    runner = CliRunner()
+    result = runner.invoke(main.cli, ['register', 'foo.txt', 'bar.txt', '--title', 'My Foo'])
+    assert result.exit_code == 1
+    assert '--title' in result.output
+
+
+def test_check_from_file(logged_in, mock_cli, tmp_path):
+    entity_file = tmp_path / 'entities.txt'
+    entity_file.write_text('# Files to check\nfoo.txt\n\nbar baz.txt minid:123\nminid:456\n')
+    mock_cli.is_valid_identifier.side_effect = minid.MinidClient.is_valid_identifier
+    mock_cli.check_many.side_effect = lambda entities, **kwargs: (
+        {'entity': entity, 'status': 'found'} for entity in entities)
+    runner = CliRunner()
+    result = runner.invoke(main.cli, ['check', '--from-file', str(entity_file), '--jobs', '2'])
+    assert result.exit_code == 0
+    assert [json.loads(line)['entity'] for line in result.output.splitlines()] == [
+        'foo.txt', ['bar baz.txt', 'minid:123'], 'minid:456']
+    assert mock_cli.check_many.call_args[1] == {'algorithm': 'sha256', 'jobs': 2}
+
+
+def test_translate_jsonl(tmp_path):
+    records = [{'url': 'minid.test:foo', 'filename': 'foo.txt'},
+               {'url': ['hdl:20.500.12582/bar', 'https://example.com/bar']},
+               {'filename': 'baz.txt'}]
+    input_file = tmp_path / 'records.jsonl'
+    input_file.write_text('\n'.join(json.dumps(r) for r in records) + '\n')
+    result = CliRunner().invoke(main.cli, ['translate', str(input_file), '--to', 'minid'])
+    assert result.exit_code == 0
+    assert [json.loads(line) for line in result.output.splitlines()] == [
+        {'url': 'minid.test:foo', 'filename': 'foo.txt'},
+        {'url': ['minid:bar', 'https://example.com/bar']},
+        {'filename': 'baz.txt'}]
+
+
+def test_translate_csv():
+    stdin = 'identifier,replaces\nminid.test:foo,minid:bar\nnot-an-identifier,\n'
+    result = CliRunner().invoke(main.cli, ['translate', '--format', 'csv', '--field', 'identifier',
+                                           '--field', 'replaces'], input=stdin)
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        'identifier,replaces',
+        'hdl:20.500.12633/foo,hdl:20.500.12582/bar',
+        'not-an-identifier,']
+
+
+def test_check_requires_entity(logged_in):
+    runner = CliRunner()
+    result = runner.invoke(main.cli, ['check'])
+    assert result.exit_code == 1
+
+
 def test_cli_update_active_invalid(logged_in):
     runner = CliRunner()
     result = runner.invoke(main.cli, ['update', 'minid:123', '--set-active', '--set-inactive'])
@@ -0,0 +1,96 @@
+import os
+import hashlib
+import pytest
+from unittest.mock import Mock
+
+from minid import hashing
+
+DATA = os.urandom(1024 * 1024 + 123)
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(DATA)
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def clear_calibration(monkeypatch):
+    monkeypatch.setattr(hashing, '_calibrated_block_sizes', {})
+
+
+@pytest.mark.parametrize('block_size', [None, 4096, 1000, 10 * 1024 * 1024])
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_hash_file(data_file, block_size, use_mmap):
+    hashers = [hashlib.md5(), hashlib.sha256()]
+    hashing.hash_file(data_file, hashers, block_size=block_size, use_mmap=use_mmap)
+    assert hashers[0].hexdigest() == hashlib.md5(DATA).hexdigest()
+    assert hashers[1].hexdigest() == hashlib.sha256(DATA).hexdigest()
+
+
+def test_hash_empty_file(tmp_path):
+    path = tmp_path / 'empty.txt'
+    path.write_bytes(b'')
+    hasher = hashlib.sha256()
+    hashing.hash_file(str(path), [hasher], use_mmap=True)
+    assert hasher.hexdigest() == hashlib.sha256(b'').hexdigest()
+
+
+@pytest.mark.parametrize('preferred, expected', [
+    (4096, hashing.DEFAULT_BLOCK_SIZE),
+    (4 * 1024 * 1024, 4 * 1024 * 1024),
+    (64 * 1024 * 1024, 64 * 1024 * 1024),
+    (0, hashing.DEFAULT_BLOCK_SIZE),
+])
+def test_get_block_size(preferred, expected):
+    assert hashing.get_block_size(Mock(st_blksize=preferred)) == expected
+
+
+def test_calibrate_small_file_uses_filesystem_block_size(data_file):
+    expected = hashing.get_block_size(os.stat(data_file))
+    assert hashing.calibrate_block_size(data_file) == expected
+
+
+def test_calibrate_block_size(data_file):
+    candidates = (1024, 4096, 16384)
+    block_size = hashing.calibrate_block_size(data_file, candidates=candidates, sample_size=65536)
+    assert block_size in candidates
+    # The result is remembered for the device
+    assert hashing.calibrate_block_size(data_file) == block_size
+
+
+def test_hash_file_auto_block_size(data_file):
+    hasher = hashlib.sha256()
+    hashing.hash_file(data_file, [hasher], block_size='auto')
+    assert hasher.hexdigest() == hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.mark.parametrize('pipeline_depth', [1, 2, 4])
+def test_hash_file_pipelined(data_file, pipeline_depth):
+    hashers = [hashlib.md5(), hashlib.sha1(), hashlib.sha256()]
+    hashing.hash_file(data_file, hashers, block_size=4096, pipeline_depth=pipeline_depth)
+    assert [h.hexdigest() for h in hashers] == [
+        hashlib.md5(DATA).hexdigest(),
+        hashlib.sha1(DATA).hexdigest(),
+        hashlib.sha256(DATA).hexdigest(),
+    ]
+
+
+def test_hash_file_pipelined_hasher_error(data_file):
+    hasher = Mock()
+    hasher.update.side_effect = ValueError('Hashing failed')
+    with pytest.raises(ValueError):
+        hashing.hash_file(data_file, [hashlib.sha256(), hasher], block_size=4096, pipeline_depth=2)
+
+
+def test_hash_file_pipelined_read_error(data_file, monkeypatch):
+    real_open = open
+
+    def failing_open(*args, **kwargs):
+        f = real_open(*args, **kwargs)
+        f.readinto = Mock(side_effect=OSError('Read failed'))
+        return f
+    monkeypatch.setattr('builtins.open', failing_open)
+    with pytest.raises(OSError):
+        hashing.hash_file(data_file, [hashlib.sha256()], block_size=4096, pipeline_depth=2)
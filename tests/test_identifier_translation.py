@@ -75,3 +75,35 @@ def test_valid_to_minid(valid_to_minid):
 def test_is_minid(is_minid):
     ident, expected = is_minid
     assert minid.MinidClient().is_minid(ident) == expected
+
+
+def test_translation_only_rewrites_prefix():
+    ident = 'minid:foo/minid:bar'
+    assert minid.MinidClient.to_identifier(ident, 'hdl') == 'hdl:20.500.12582/foo/minid:bar'
+    ident = 'hdl:20.500.12633/foo/hdl:20.500.12633/bar'
+    assert minid.MinidClient.to_minid(ident) == 'minid.test:foo/hdl:20.500.12633/bar'
+
+
+def test_identifier_prefix():
+    assert minid.MinidClient.get_identifier_prefix(TEST_MINID) == 'minid.test:'
+    assert minid.MinidClient.get_identifier_prefix(PROD_HDL) == 'hdl:20.500.12582/'
+    assert minid.MinidClient.get_identifier_prefix('foo minid:bar') is None
+    assert minid.MinidClient.get_identifier_prefix(['minid:foo']) is None
+    assert minid.MinidClient.is_test(TEST_HDL) is True
+    assert minid.MinidClient.is_test(PROD_MINID) is False
+
+
+def test_translate_many():
+    idents = [PROD_HDL, TEST_HDL, PROD_MINID, TEST_MINID]
+    assert minid.MinidClient.translate_many(idents, 'minid') == [
+        PROD_MINID, TEST_MINID, PROD_MINID, TEST_MINID]
+    assert minid.MinidClient.translate_many(iter(idents), 'hdl') == [
+        PROD_HDL, TEST_HDL, PROD_HDL, TEST_HDL]
+
+
+def test_translate_many_unknown_identifiers():
+    idents = [PROD_HDL, 'https://example.com/foo', None]
+    with pytest.raises(minid.exc.UnknownIdentifier):
+        minid.MinidClient.translate_many(idents, 'minid')
+    assert minid.MinidClient.translate_many(idents, 'minid', strict=False) == [
+        PROD_MINID, 'https://example.com/foo', None]
@@ -0,0 +1,33 @@
+import subprocess
+import sys
+
+import pytest
+
+# Dependencies which take most of the time spent starting the CLI. They must
+# only be imported by the code paths which need them.
+SLOW_IMPORTS = {'globus_sdk', 'fair_research_login', 'fair_identifiers_client',
+                'pytz', 'tzlocal', 'requests', 'asyncio', 'multiprocessing'}
+
+
+def get_imported_modules(code):
+    """Run code in a fresh interpreter, and return every module it imports"""
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True, check=True)
+    return {line.rsplit('|', 1)[-1].strip() for line in output.stderr.splitlines()
+            if line.startswith('import time:')}
+
+
+@pytest.mark.parametrize('code', [
+    'import minid',
+    'import minid.commands.main',
+    'from minid.commands.main import cli; cli(["version"], standalone_mode=False)',
+    'from minid.commands.main import cli; cli(["--help"], standalone_mode=False)',
+])
+def test_startup_does_not_import_slow_dependencies(code):
+    imported = get_imported_modules(code)
+    assert {module.split('.')[0] for module in imported} & SLOW_IMPORTS == set()
+
+
+def test_async_client_is_imported_on_first_use():
+    imported = get_imported_modules('import minid; minid.AsyncMinidClient')
+    assert 'minid.async_client' in imported
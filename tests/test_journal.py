@@ -0,0 +1,40 @@
+from minid.journal import BatchJournal
+
+RECORD = {'url': 'https://example.com/foo.txt', 'sha256': 'abc', 'filename': 'foo.txt'}
+RESULT = dict(RECORD, url='minid:foo')
+
+
+def test_journal_get_missing(tmp_path):
+    journal = BatchJournal(str(tmp_path / 'journal.sqlite'))
+    assert journal.get('manifest.json', 0, RECORD) is None
+
+
+def test_journal_add_and_get(tmp_path):
+    journal = BatchJournal(str(tmp_path / 'journal.sqlite'))
+    journal.add('manifest.json', 0, RECORD, RESULT)
+    assert journal.get('manifest.json', 0, RECORD) == RESULT
+    assert journal.get('manifest.json', 1, RECORD) is None
+    assert journal.get('other_manifest.json', 0, RECORD) is None
+
+
+def test_journal_persists_across_instances(tmp_path):
+    filename = str(tmp_path / 'journal.sqlite')
+    journal = BatchJournal(filename)
+    journal.add('manifest.json', 0, RECORD, RESULT)
+    journal.close()
+    assert BatchJournal(filename).get('manifest.json', 0, RECORD) == RESULT
+
+
+def test_journal_ignores_changed_records(tmp_path):
+    journal = BatchJournal(str(tmp_path / 'journal.sqlite'))
+    journal.add('manifest.json', 0, RECORD, RESULT)
+    assert journal.get('manifest.json', 0, dict(RECORD, sha256='changed')) is None
+
+
+def test_journal_clear(tmp_path):
+    journal = BatchJournal(str(tmp_path / 'journal.sqlite'))
+    journal.add('manifest.json', 0, RECORD, RESULT)
+    journal.add('other_manifest.json', 0, RECORD, RESULT)
+    journal.clear('manifest.json')
+    assert journal.get('manifest.json', 0, RECORD) is None
+    assert journal.get('other_manifest.json', 0, RECORD) == RESULT
@@ -0,0 +1,59 @@
+import io
+import json
+import pytest
+
+from minid.manifest import iter_json_array, benchmark
+
+RECORDS = [
+    {'filename': 'foo.txt', 'length': 12345, 'sha256': 'abc',
+     'url': ['https://example.com/foo.txt', 'minid:foo']},
+    {'filename': 'b[a]r, "baz".txt', 'length': 0, 'nested': {'a': [1, 2.5, None]}},
+    1234567890,
+    'text',
+    [],
+    {'flags': [True, False, None], 'number': -1.5e-10, 'escaped': 'caf\u00e9 \u2603 "quoted"\n'},
+]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 1024])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_iter_json_array(chunk_size, indent):
+    manifest = io.StringIO(json.dumps(RECORDS, indent=indent))
+    records = list(iter_json_array(manifest, chunk_size=chunk_size))
+    assert records == RECORDS
+    assert type(records[0]) is dict
+
+
+@pytest.mark.parametrize('text', ['[]', ' \n[ ]\n', '[\n]'])
+def test_iter_json_array_empty(text):
+    assert list(iter_json_array(io.StringIO(text), chunk_size=1)) == []
+
+
+@pytest.mark.parametrize('text', ['', '{"a": 1}', '[1, 2', '[1 2]', '[1,]', '[1] [2]', '[{"a": 1]'])
+def test_iter_json_array_invalid(text):
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(io.StringIO(text), chunk_size=2))
+
+
+def test_iter_json_array_yields_before_reading_everything():
+    manifest = io.StringIO('[{"a": 1}, {"a": 2}, ' + ' ' * 100 + '{"a": 3}]')
+    records = iter_json_array(manifest, chunk_size=16)
+    assert next(records) == {'a': 1}
+    assert manifest.tell() < 100
+
+
+def test_iter_json_array_malformed_record_stops_reading():
+    manifest = io.StringIO('[{"a": 1}, {"a": tru}, ' + '{"a": 2}, ' * 10000 + '{"a": 3}]')
+    records = iter_json_array(manifest, chunk_size=64)
+    assert next(records) == {'a': 1}
+    with pytest.raises(json.JSONDecodeError):
+        next(records)
+    assert manifest.tell() <= 128
+
+
+def test_benchmark():
+    results = benchmark(num_records=100)
+    assert results['records'] == 100
+    for name in ('json.load', 'iter_json_array'):
+        assert results[name]['records_per_second'] > 0
+        assert results[name]['peak_memory'] > 0
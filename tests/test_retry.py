@@ -0,0 +1,144 @@
+import time
+import pytest
+import requests
+from unittest.mock import Mock
+from requests.adapters import HTTPAdapter
+from globus_sdk.transport import RequestsTransport
+
+from minid.minid import MinidClient
+from minid.retry import RetryPolicy, RateLimiter
+from minid.adapters import RateLimitedAdapter
+
+URL = 'https://identifiers.example.com/hdl:20.500.12633/foo'
+
+
+class MockAdapter(HTTPAdapter):
+    """Replies to each request with the next of the given status codes"""
+
+    def __init__(self, status_codes, headers=None):
+        super().__init__()
+        self.status_codes = list(status_codes)
+        self.headers = headers or {}
+        self.sent = 0
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = self.status_codes[self.sent]
+        response.headers.update(self.headers)
+        response.request = request
+        response._content = b'{}'
+        self.sent += 1
+        return response
+
+
+def get_transport(status_codes, headers=None, **policy_kwargs):
+    transport = RequestsTransport()
+    adapter = MockAdapter(status_codes, headers=headers)
+    transport.session.mount('https://', adapter)
+    RetryPolicy(backoff=0, **policy_kwargs).configure_transport(transport)
+    return transport, adapter
+
+
+@pytest.mark.parametrize('method, status_code, retryable', [
+    ('GET', 502, True),
+    ('PUT', 503, True),
+    ('GET', 429, True),
+    ('GET', 404, False),
+    ('POST', 502, False),
+    ('POST', 500, False),
+    ('POST', 429, True),
+])
+def test_retry_policy_is_retryable(method, status_code, retryable):
+    assert RetryPolicy().is_retryable(method, status_code=status_code) is retryable
+
+
+def test_retry_policy_network_errors():
+    policy = RetryPolicy()
+    error = requests.exceptions.ReadTimeout()
+    assert policy.is_retryable('GET', error=error) is True
+    assert policy.is_retryable('POST', error=error) is False
+    assert policy.is_retryable('POST', error=error, sent=False) is True
+    assert policy.is_unsent(requests.exceptions.ConnectTimeout()) is True
+    assert policy.is_unsent(error) is False
+
+
+def test_retry_policy_backoff_is_capped_and_jittered():
+    policy = RetryPolicy(backoff=1, max_backoff=8)
+    for attempt in range(10):
+        assert 0 <= policy.get_delay(attempt) <= min(8, 2 ** attempt)
+    assert RetryPolicy(backoff=1, jitter=False).get_delay(3) == 8
+
+
+def test_retry_policy_honors_retry_after():
+    policy = RetryPolicy(max_retry_after=60)
+    assert policy.get_delay(0, retry_after=12) == 12
+    assert policy.get_delay(0, retry_after=600) == 60
+    assert policy.parse_retry_after('7') == 7
+    assert policy.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert policy.parse_retry_after('soon') is None
+    assert policy.parse_retry_after(None) is None
+
+
+def test_transport_retries_idempotent_requests():
+    transport, adapter = get_transport([502, 503, 200])
+    response = transport.request('GET', URL)
+    assert response.status_code == 200
+    assert adapter.sent == 3
+
+
+def test_transport_does_not_retry_ambiguous_create():
+    transport, adapter = get_transport([502, 200])
+    response = transport.request('POST', URL, data={})
+    assert response.status_code == 502
+    assert adapter.sent == 1
+
+
+def test_transport_retries_throttled_create():
+    transport, adapter = get_transport([429, 429, 200],
+                                       headers={'Retry-After': '0'})
+    response = transport.request('POST', URL, data={})
+    assert response.status_code == 200
+    assert adapter.sent == 3
+
+
+def test_transport_stops_after_max_retries():
+    transport, adapter = get_transport([503] * 5, max_retries=2)
+    response = transport.request('GET', URL)
+    assert response.status_code == 503
+    assert adapter.sent == 3
+
+
+def test_rate_limiter_allows_bursts():
+    limiter = RateLimiter(10, burst=3)
+    assert [limiter.reserve() for _ in range(3)] == [0, 0, 0]
+    assert limiter.reserve() == pytest.approx(0.1, abs=0.01)
+    assert limiter.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_rate_limiter_refills(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    limiter = RateLimiter(2, burst=1)
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == 0.5
+    now[0] += 5
+    assert limiter.reserve() == 0
+
+
+def test_rate_limited_adapter_waits_on_limiter(logged_out):
+    mc = MinidClient(rate_limit=5)
+    adapter = mc.identifiers_client.transport.session.get_adapter(mc.base_url)
+    assert isinstance(adapter, RateLimitedAdapter)
+    assert adapter.rate_limiter is mc.rate_limiter
+    adapter.rate_limiter = Mock()
+    with pytest.raises(requests.exceptions.RequestException):
+        adapter.send(requests.Request('GET', 'http://localhost:1/').prepare(), timeout=0.01)
+    assert adapter.rate_limiter.acquire.called
+
+
+def test_client_configures_transport_retries(logged_out):
+    policy = RetryPolicy(max_retries=2)
+    mc = MinidClient(retry_policy=policy)
+    transport = mc.identifiers_client.transport
+    assert transport.max_retries == 2
+    assert len(transport.retry_checks) == 2
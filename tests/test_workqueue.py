@@ -0,0 +1,104 @@
+import pytest
+
+from minid.exc import MinidException
+from minid.workqueue import WorkQueue
+
+RECORDS = [{'url': 'https://example.com/{}.txt'.format(i), 'filename': '{}.txt'.format(i)} for i in range(5)]
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'))
+    queue.load(RECORDS, test=True, update_if_exists=False)
+    yield queue
+    queue.close()
+
+
+def test_queue_load(queue):
+    assert queue.get_options() == {'test': True, 'update_if_exists': False}
+    assert queue.get_counts()[WorkQueue.PENDING] == len(RECORDS)
+    assert queue.is_finished() is False
+
+
+def test_queue_load_rejects_other_options(queue):
+    with pytest.raises(MinidException):
+        queue.load(RECORDS, test=False, update_if_exists=False)
+
+
+@pytest.mark.parametrize('records', [RECORDS[:4], RECORDS[::-1], RECORDS + RECORDS[:1]])
+def test_queue_load_rejects_other_manifest(queue, records):
+    with pytest.raises(MinidException):
+        queue.load(records, test=True, update_if_exists=False)
+    assert [r for r, _, _ in queue.iter_results()] == RECORDS
+    assert queue.get_counts()[WorkQueue.PENDING] == len(RECORDS)
+
+
+def test_queue_lease_is_exclusive(queue):
+    first = queue.lease('worker-1', 3, 60)
+    second = queue.lease('worker-2', 3, 60)
+    assert [p for p, _, _ in first] == [0, 1, 2]
+    assert [p for p, _, _ in second] == [3, 4]
+    assert first[0][1] == RECORDS[0]
+    assert queue.lease('worker-3', 3, 60) == []
+
+
+def test_queue_expired_leases_are_reissued(queue):
+    queue.lease('worker-1', 2, -1)
+    assert [p for p, _, _ in queue.lease('worker-2', 2, 60)] == [0, 1]
+
+
+def test_queue_complete_and_fail(queue):
+    for position, record, token in queue.lease('worker-1', 5, 60):
+        if position == 1:
+            assert queue.fail(position, token, MinidException('Bad record')) is True
+        else:
+            assert queue.complete(position, token, dict(record, url='minid:{}'.format(position))) is True
+    assert queue.is_finished() is True
+    results = list(queue.iter_results())
+    assert results[0] == (RECORDS[0], dict(RECORDS[0], url='minid:0'), None)
+    assert results[1] == (RECORDS[1], None, 'Bad record')
+
+
+def test_queue_ignores_expired_lease_results(queue):
+    (_, _, expired_token), = queue.lease('worker-1', 1, -1)
+    (_, _, token), = queue.lease('worker-2', 1, 60)
+    assert queue.fail(0, expired_token, 'Expired') is False
+    assert queue.complete(0, expired_token, {'url': 'minid:expired'}) is False
+    assert queue.get_counts()[WorkQueue.LEASED] == 1
+    assert queue.is_finished() is False
+    assert queue.complete(0, token, {'url': 'minid:current'}) is True
+    assert queue.complete(0, token, {'url': 'minid:again'}) is False
+    assert list(queue.iter_results())[0][1] == {'url': 'minid:current'}
+
+
+def test_queue_accepts_expired_lease_not_leased_again(queue):
+    (_, _, token), = queue.lease('worker-1', 1, -1)
+    assert queue.complete(0, token, {'url': 'minid:0'}) is True
+
+
+def test_queue_renew(queue):
+    queue.lease('worker-1', 2, -1)
+    assert queue.renew('worker-1', 60) == 2
+    assert [p for p, _, _ in queue.lease('worker-2', 5, 60)] == [2, 3, 4]
+
+
+def test_queue_release(queue):
+    queue.lease('worker-1', 5, 60)
+    queue.release('worker-1')
+    assert len(queue.lease('worker-2', 5, 60)) == 5
+
+
+def test_queue_reload_requeues_failed(queue):
+    for position, record, token in queue.lease('worker-1', 5, 60):
+        if position == 0:
+            queue.fail(position, token, 'Bad record')
+        else:
+            queue.complete(position, token, record)
+    queue.load(RECORDS, test=True, update_if_exists=False)
+    counts = queue.get_counts()
+    assert counts[WorkQueue.PENDING] == 1
+    assert counts[WorkQueue.DONE] == len(RECORDS) - 1
+
+
+def test_queue_worker_ids_are_unique():
+    assert WorkQueue.get_worker_id() != WorkQueue.get_worker_id()